@@ -10,7 +10,7 @@ from .actions import (
     DeployMachineAction, RedeployMachineAction, RemoveTaskAction,
     RestartTaskAction, StartTaskAction, StopTaskAction)
 from .productionjob import ProductionJob
-from threading import RLock, Thread
+from threading import Event, RLock, Thread
 
 logger = logging.getLogger(__name__)
 
@@ -60,18 +60,74 @@ class JobState(object):
                     },
                 ],
             }
+
+        Tasks are also indexed by (name, machine) and by machine (None for
+        tasks waiting for one), so lookups don't scan every task. Only
+        change tasks through the methods below, which keep the indexes up
+        to date.
         """
         self.tasks = {}
+        # (name, machine) -> the first item in tasks[name] on machine
+        self._task_items = {}
+        # machine -> [(name, item)] of every task on machine
+        self._machine_items = {}
+
+    def _index(self, name, item):
+        """
+        Add a task item to the indexes.
+        """
+        machine = item['machine']
+        self._machine_items.setdefault(machine, []).append((name, item))
+        first = self._task_items.get((name, machine))
+        if first is None:
+            self._task_items[(name, machine)] = item
+            return
+
+        # Keep whichever comes first in tasks[name], as a scan would find
+        for task in self.tasks[name]:
+            if task is first:
+                break
+            if task is item:
+                self._task_items[(name, machine)] = item
+                break
+
+    def _unindex(self, name, item):
+        """
+        Remove a task item from the indexes.
+        """
+        machine = item['machine']
+        items = self._machine_items.get(machine, [])
+        for index, (task_name, task) in enumerate(items):
+            if task is item:
+                del items[index]
+                break
+        if not items:
+            self._machine_items.pop(machine, None)
+
+        if self._task_items.get((name, machine)) is item:
+            del self._task_items[(name, machine)]
+            others = set([id(task) for task_name, task in items
+                          if task_name == name])
+            for task in self.tasks.get(name, []):
+                if id(task) in others:
+                    self._task_items[(name, machine)] = task
+                    break
+
+    def _remove_items(self, name, remove):
+        """
+        Remove the items in tasks[name] for which remove(item) is True.
+        """
+        removed = [task for task in self.tasks[name] if remove(task)]
+        self.tasks[name] = [task for task in self.tasks[name]
+                            if not remove(task)]
+        for task in removed:
+            self._unindex(name, task)
 
     def _get_task_item(self, name, machine):
         """
         Get the list item from self.tasks[name] that contains the given task.
         """
-        if name in self.tasks:
-            for task in self.tasks[name]:
-                if task['machine'] == machine:
-                    return task
-        return None
+        return self._task_items.get((name, machine))
 
     def flatten(self):
         """
@@ -97,11 +153,7 @@ class JobState(object):
         @param machine The machine to check.
         @return True if the machine is idle or False.
         """
-        for task_items in list(self.tasks.values()):
-            for task in task_items:
-                if task['machine'] == machine:
-                    return False
-        return True
+        return not self._machine_items.get(machine)
 
     def remove_machine(self, machine):
         """
@@ -109,10 +161,10 @@ class JobState(object):
 
         @param machine The machine to remove tasks from.
         """
+        for name in set([n for n, task in
+                         self._machine_items.get(machine, [])]):
+            self._remove_items(name, lambda task: task['machine'] == machine)
         for name in list(self.tasks.keys()):
-            for task in list(self.tasks[name]):
-                if task['machine'] == machine:
-                    self.tasks[name].remove(task)
             if not self.tasks[name]:
                 del self.tasks[name]
 
@@ -196,11 +248,9 @@ class JobState(object):
             the machine is not present.
         """
         names = set()
-        for name, tasks in self.tasks.items():
-            for task in tasks:
-                if task['machine'] == machine:
-                    if status is None or status == task['status']:
-                        names.add(name)
+        for name, task in self._machine_items.get(machine, []):
+            if status is None or status == task['status']:
+                names.add(name)
         return names
 
     def add_tasks(self, name, zone, machines, create=None, status=None):
@@ -227,15 +277,19 @@ class JobState(object):
 
         for machine in machines:
             if not self.has_task(name, machine):
-                self.tasks[name].append({
+                item = {
                     'machine': machine,
                     'status': status,
-                    'zone': zone})
+                    'zone': zone}
+                self.tasks[name].append(item)
+                self._index(name, item)
         for n in range(create):
-            self.tasks[name].append({
+            item = {
                 'machine': None,
                 'status': status,
-                'zone': zone})
+                'zone': zone}
+            self.tasks[name].append(item)
+            self._index(name, item)
 
     def remove_tasks(self, name, machines=None):
         """
@@ -250,11 +304,11 @@ class JobState(object):
         if name in self.tasks:
             removed.append(name)
             if machines is None:
-                del self.tasks[name]
+                for task in self.tasks.pop(name):
+                    self._unindex(name, task)
             else:
-                for task in list(self.tasks[name]):
-                    if task['machine'] in machines:
-                        self.tasks[name].remove(task)
+                self._remove_items(
+                    name, lambda task: task['machine'] in machines)
                 if not self.tasks[name]:
                     del self.tasks[name]
         return removed
@@ -267,9 +321,15 @@ class JobState(object):
         @param machines The machines to update the task status on.
         """
         if name in self.tasks:
-            for task in self.tasks[name]:
-                if not machines or task['machine'] in machines:
+            if not machines:
+                for task in self.tasks[name]:
                     task['status'] = status
+                return
+
+            for machine in set(machines):
+                for task_name, task in self._machine_items.get(machine, []):
+                    if task_name == name:
+                        task['status'] = status
 
     def set_pending_deploying(self, zone, name, count):
         """
@@ -326,7 +386,9 @@ class JobState(object):
             for task in self.tasks.get(name, []):
                 if (not task['machine'] and task['zone'] == zone and
                         task['status'] == self.Deploying):
+                    self._unindex(name, task)
                     task['machine'] = machine
+                    self._index(name, task)
                     break
 
     def get_job_fill(self):
@@ -401,6 +463,10 @@ class ClusterState(object):
                 },
             ]
 
+        machines is also indexed by machine and by zone. Only add and
+        remove machines through add_machine and remove_machine, which keep
+        the indexes up to date.
+
         @param sitter The cluster sitter object.
         """
         self.thread = None
@@ -412,6 +478,12 @@ class ClusterState(object):
         self.providers = {}
         self.max_idle_per_zone = -1
         self.machines = []
+        # machine -> its item in machines
+        self._machine_items = {}
+        # zone -> the items in machines in that zone, in the same order
+        self._zone_items = {}
+        # hostname -> machine, filled in by find_machine
+        self._machine_names = {}
         self.jobs = {}
         self.job_file = "%s/jobs.json" % sitter.log_location
         self.job_chains = {}
@@ -420,6 +492,8 @@ class ClusterState(object):
         self.current_jobs = JobState()
         self.actions = ClusterActionManager()
         self.lock = RLock()
+        # Set to run the next calculation cycle straight away
+        self.wakeup = Event()
 
         #TODO: Move this to the sitter. State is not a catch-all.
         self.loggers = []
@@ -429,10 +503,7 @@ class ClusterState(object):
         """
         Get the list item from self.machines that contains the given machine.
         """
-        for item in self.machines:
-            if item['machine'] == machine:
-                return item
-        return None
+        return self._machine_items.get(machine)
 
     @lock
     def _get_master_job(self, job):
@@ -583,15 +654,21 @@ class ClusterState(object):
         else:
             zoned_machines = {}
 
-        for item in self.machines:
+        for zone in self._zone_items:
+            if zone not in zoned_machines:
+                zoned_machines[zone] = []
+
+        if zones is None:
+            items = self.machines
+        else:
+            # Only look through the requested zones.
+            items = []
+            for zone in set(zones):
+                items.extend(self._zone_items.get(zone, []))
+
+        for item in items:
             zone = item['zone']
             machine = item['machine']
-            if item['zone'] not in zoned_machines:
-                zoned_machines[item['zone']] = []
-
-            # Check for the requested zone.
-            if zones is not None and zone not in zones:
-                continue
 
             # Check for the requested status.
             if status and item['status'] != status:
@@ -625,6 +702,66 @@ class ClusterState(object):
             return None
         return item['zone']
 
+    @lock
+    def find_machine(self, hostnames):
+        """
+        Find a machine by any of its names.
+
+        @param hostnames Hostnames or IPs the machine may be known by.
+        @return The machine or None if no machine has any of the names.
+        """
+        def get_names(machine):
+            names = set([machine.hostname, machine.config.dns_name,
+                         machine.config.ip])
+            if machine.datamanager:
+                names.add(machine.datamanager.hostname)
+            return names
+
+        hostnames = set(hostnames)
+        # Machines' names can change, so check the one we remembered
+        for hostname in hostnames:
+            machine = self._machine_names.get(hostname)
+            if (machine and self.has_machine(machine) and
+                    hostname in get_names(machine)):
+                return machine
+
+        for item in self.machines:
+            machine = item['machine']
+            names = get_names(machine)
+            if names & hostnames:
+                for name in names:
+                    self._machine_names[name] = machine
+                return machine
+        return None
+
+    def ingest_stats(self, push):
+        """
+        Apply stats pushed by a machinesitter, and recalculate straight
+        away if any of its tasks started or stopped.
+
+        @param push The push, see machinesitter.statspusher.
+        @return "OK", "Resync" if the machinesitter should push all of its
+            stats, or an error.
+        """
+        machine = self.find_machine(push.get('hostnames', []))
+        if not machine or not machine.is_initialized():
+            return "Unknown machine"
+
+        def task_states():
+            return dict([(name, task.get('running')) for name, task in
+                         machine.get_tasks().items()])
+
+        before = task_states()
+        if not machine.datamanager.receive_push(push):
+            return "Resync"
+
+        machine.loaded = True
+        if task_states() != before:
+            logger.info("Tasks on %s changed, recalculating" % machine)
+            self.wakeup.set()
+
+        return "OK"
+
     def get_machine_status(self, machine):
         """
         Get the status of the machine.
@@ -670,11 +807,14 @@ class ClusterState(object):
                     status = self.Active
 
             zone = machine.config.shared_fate_zone
-            self.machines.append({
+            item = {
                 'machine': machine,
                 'status': status,
                 'zone': zone,
-            })
+            }
+            self.machines.append(item)
+            self._machine_items[machine] = item
+            self._zone_items.setdefault(zone, []).append(item)
 
             if existing and status != self.Pending:
                 self.add_machine_tasks(machine)
@@ -724,6 +864,11 @@ class ClusterState(object):
         item = self._get_machine_item(machine)
         if item:
             self.machines.remove(item)
+            del self._machine_items[machine]
+            zone_items = self._zone_items[item['zone']]
+            zone_items.remove(item)
+            if not zone_items:
+                del self._zone_items[item['zone']]
 
     @lock
     def update_machine(self, machine, status):
@@ -1020,10 +1165,12 @@ class ClusterState(object):
         job_machines = self.current_jobs.get_task_machines()
 
         # Remove missing machines.
+        zoned_machine_sets = dict([
+            (zone, set(machines)) for zone, machines in
+            zoned_machines.items()])
         for zone, machines in job_machines.items():
             for machine in machines:
-                if (zone not in zoned_machines or
-                        machine not in zoned_machines[zone]):
+                if machine not in zoned_machine_sets.get(zone, ()):
                     self.current_jobs.remove_machine(machine)
 
         # Update tasks.
@@ -1249,7 +1396,8 @@ class ClusterState(object):
         def run_loop():
             while self.running:
                 self.run()
-                time.sleep(self.sleep)
+                self.wakeup.wait(self.sleep)
+                self.wakeup.clear()
 
         if self.thread is None or not self.thread.is_alive():
             self.thread = Thread(target=run_loop, name="Calculator")
@@ -4,6 +4,7 @@ import threading
 from tenjin.helpers import *
 
 from .eventmanager import ClusterEventManager
+from sittercommon import machinedata
 from tasksitter.stats_collector import StatsCollector
 
 
@@ -13,6 +14,10 @@ class ClusterStats(StatsCollector):
         engine = args['engine']
         data = self.get_metadata()
         data.update(self.get_live_data())
+        data.update(self.get_hot_tasks(
+            data['machines'],
+            float(args.get('warn', self.harness.utilisation_warning)),
+            float(args.get('critical', self.harness.utilisation_critical))))
         if "nohtml" not in args:
             return engine.render('cluster_overview.html', {'data': data,
                                                            'pagewidth': 1300})
@@ -49,6 +54,12 @@ class ClusterStats(StatsCollector):
             monitor_data['pull_failures'] = dict([
                 (str(k), v) for k, v in monitor.pull_failures.items()])
             monitor_data['failure_threshold'] = monitor.failure_threshold
+            # Seconds until each machine's next poll, backing off while
+            # its pulls fail
+            monitor_data['next_poll'] = dict([
+                (str(k), round(v, 1)) for k, v in
+                monitor.get_schedule().items()])
+            monitor_data['max_backoff'] = monitor.max_backoff
             monitor_data['number'] = monitor.number
             monitors.append(monitor_data)
 
@@ -64,6 +75,7 @@ class ClusterStats(StatsCollector):
 
         data['machines'] = machines
         data['monitors'] = monitors
+        data['http_pool'] = machinedata.http_pool.get_stats()
 
         jobs = []
         check_jobs = list(state.jobs.values()) + list(state.repair_jobs.values())
@@ -130,6 +142,34 @@ class ClusterStats(StatsCollector):
         data['other_threads'] = other_threads
         return data
 
+    def get_hot_tasks(self, machines, warning, critical):
+        """
+        List every task at or above the warning utilisation, hottest first
+
+        machines: serialized machines, as in get_live_data()['machines']
+        """
+        hot_tasks = []
+        for machine in machines:
+            for task_name, task in list(machine['tasks'].items()):
+                utilisation = task.get('max_utilisation')
+                if utilisation is None or utilisation < warning:
+                    continue
+
+                level = 'warning'
+                if utilisation >= critical:
+                    level = 'critical'
+
+                hot_tasks.append({'machine': machine['repr'],
+                                  'task': task_name,
+                                  'utilisation': utilisation,
+                                  'level': level,
+                                  'stats_page': task.get('stats_page')})
+
+        hot_tasks.sort(key=lambda t: t['utilisation'], reverse=True)
+        return {'hot_tasks': hot_tasks,
+                'utilisation_warning': warning,
+                'utilisation_critical': critical}
+
     def get_metadata(self):
         data = {}
         data['clustersitter_pid'] = os.getpid()
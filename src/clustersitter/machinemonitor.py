@@ -1,7 +1,12 @@
+import asyncio
+import concurrent.futures
 import logging
+import random
 import time
 from datetime import datetime
 
+from sittercommon.async_http import HTTPConnection
+
 logger = logging.getLogger(__name__)
 
 
@@ -13,8 +18,17 @@ class MachineMonitor:
         # amoung threads
         self.monitored_machines = [m for m in monitored_machines]
         self.add_queue = []
+        # Everything in monitored_machines or add_queue, for quick lookups
+        self.all_machines = set(self.monitored_machines)
         self.pull_failures = {}
         self.failure_threshold = 5
+        # When each machine is next due to be polled
+        self.next_poll = {}
+        # Each pull failure in a row doubles the wait before the next,
+        # up to this many seconds
+        self.max_backoff = 30
+        # Seconds before polling a machine which just answered again
+        self.recovery_interval = 1
 
         logger.info(
             "Initialized a machine monitor for %s" %
@@ -30,9 +44,7 @@ class MachineMonitor:
         @param monitored_machine The machine to check for.
         @return True if the monitor has the machine or False.
         """
-        return (
-            monitored_machine in self.monitored_machines or
-            monitored_machine in self.add_queue)
+        return monitored_machine in self.all_machines
 
     def remove_machine(self, monitored_machine):
         """
@@ -42,13 +54,16 @@ class MachineMonitor:
         @return True if the machine was removed or False if the machine was not
             being monitored.
         """
+        if monitored_machine not in self.all_machines:
+            return False
+        self.all_machines.discard(monitored_machine)
+        self.pull_failures.pop(monitored_machine, None)
+        self.next_poll.pop(monitored_machine, None)
         if monitored_machine in self.add_queue:
             self.add_queue.remove(monitored_machine)
             return True
         if monitored_machine in self.monitored_machines:
             self.monitored_machines.remove(monitored_machine)
-            if monitored_machine in self.pull_failures:
-                del self.pull_failures[monitored_machine]
             return True
         return False
 
@@ -64,6 +79,7 @@ class MachineMonitor:
             return False
 
         self.add_queue.append(monitored_machine)
+        self.all_machines.add(monitored_machine)
         self.pull_failures[monitored_machine] = 0
 
         logger.info(
@@ -82,7 +98,81 @@ class MachineMonitor:
                 traceback.print_exc()
                 logger.error(traceback.format_exc())
             if not val:
-                self.pull_failures[m] += 1
+                self.record_pull(m, val)
+            else:
+                # Fetch its stats straight away
+                self.schedule(m, 0)
+
+    def record_pull(self, machine, succeeded, started=None):
+        """
+        Count a pull failure or success, and schedule the next poll from
+        when this one started.
+        """
+        if machine not in self.all_machines:
+            # Removed while it was being polled
+            return
+
+        failures = self.pull_failures.get(machine, 0)
+        if not succeeded:
+            failures = self.pull_failures[machine] = failures + 1
+            logger.info(
+                "Detected a pull failure for %s, total: %s" % (
+                    machine, failures))
+            self.schedule(machine, self.backoff(failures), started)
+        else:
+            self.pull_failures[machine] = 0
+            if failures:
+                self.schedule(machine, self.recovery_interval, started)
+            else:
+                self.schedule(machine,
+                              self.clustersitter.stats_poll_interval,
+                              started)
+
+    def backoff(self, failures):
+        """
+        Returns: seconds to wait after failures pulls in a row failed, a
+        random amount between half and all of the doubled wait so failing
+        machines don't all retry together
+        """
+        delay = min(self.clustersitter.stats_poll_interval * 2 ** failures,
+                    self.max_backoff)
+        return random.uniform(delay / 2.0, delay)
+
+    def schedule(self, machine, delay, started=None):
+        self.next_poll[machine] = (started or time.time()) + delay
+
+    def spread(self, machines):
+        """
+        Schedule machines' first polls at random points in the next
+        interval, rather than all at once.
+        """
+        for machine in machines:
+            self.schedule(machine, random.uniform(
+                0, self.clustersitter.stats_poll_interval))
+
+    def is_due(self, machine, now=None):
+        return (now or time.time()) >= self.next_poll.get(machine, 0)
+
+    def get_schedule(self):
+        """
+        Returns: {machine: seconds until it's next polled}
+        """
+        now = time.time()
+        return dict([(machine, max(0, when - now)) for machine, when in
+                     list(self.next_poll.items())])
+
+    def remove_failed_machines(self):
+        for machine, count in list(self.pull_failures.items()):
+            if count >= self.failure_threshold:
+                if machine in self.monitored_machines:
+                    self.monitored_machines.remove(machine)
+                    self.all_machines.discard(machine)
+                del self.pull_failures[machine]
+                self.next_poll.pop(machine, None)
+                machine.detected_sitter_failures += 1
+                logger.warn((
+                    "Removing '%s' because we can't contact "
+                    "the sitter!") % machine.hostname)
 
     def __repr__(self):
         return str(self)
@@ -102,6 +192,8 @@ class MachineMonitor:
 
     def start(self):
         self.initialize_machines(self.monitored_machines)
+        self.spread([m for m in self.monitored_machines if
+                     self.pull_failures.get(m, 0) == 0])
 
         while True:
             start_time = datetime.now()
@@ -122,7 +214,16 @@ class MachineMonitor:
                         self.number))
 
                 for machine in self.monitored_machines:
-                    if machine.is_initialized():
+                    if not self.is_due(machine):
+                        continue
+
+                    poll_start = time.time()
+                    if (machine.is_initialized() and
+                            not machine.datamanager.needs_pull(
+                                self.clustersitter.push_reconcile_interval)):
+                        # It's pushing its stats to us
+                        self.record_pull(machine, True, poll_start)
+                    elif machine.is_initialized():
                         val = True
                         try:
                             val = machine._api_get_stats()
@@ -132,14 +233,7 @@ class MachineMonitor:
                             traceback.print_exc()
                             logger.error(traceback.format_exc())
 
-                        if not val:
-                            self.pull_failures[machine] += 1
-                            logger.info(
-                                "Detected a pull failure for %s, total: %s" % (
-                                    machine, self.pull_failures[machine]))
-
-                        else:
-                            self.pull_failures[machine] = 0
+                        self.record_pull(machine, val, poll_start)
                     else:
                         self.initialize_machines([machine])
 
@@ -147,22 +241,19 @@ class MachineMonitor:
                     (m.hostname, count) for m, count in
                     list(self.pull_failures.items())]))
 
-                for machine, count in list(self.pull_failures.items()):
-                    if count >= self.failure_threshold:
-                        self.monitored_machines.remove(machine)
-                        del self.pull_failures[machine]
-                        machine.detected_sitter_failures += 1
-                        logger.warn((
-                            "Removing '%s' because we can't contact "
-                            "the sitter!") % machine.hostname)
+                self.remove_failed_machines()
             except:
                 import traceback
                 traceback.print_exc()
                 logger.error(traceback.format_exc())
 
             time_spent = datetime.now() - start_time
-            sleep_time = self.clustersitter.stats_poll_interval - \
-                time_spent.seconds
+            # Until the next machine is due, checking the add queue at
+            # least every interval
+            now = time.time()
+            sleep_time = min(
+                [self.clustersitter.stats_poll_interval] +
+                [when - now for when in list(self.next_poll.values())])
             logger.debug(
                 "Finished poll run for %s.  Time_spent: %s, sleep_time: %s" % (
                     [str(a) for a in self.monitored_machines],
@@ -171,3 +262,170 @@ class MachineMonitor:
 
             if sleep_time > 0:
                 time.sleep(sleep_time)
+
+
+class AsyncMachineMonitor(MachineMonitor):
+    """
+    Poll every machine from one event loop, instead of a pass over them
+    all in turn.  Each machine is polled on its own schedule, as in
+    MachineMonitor.  At most max_in_flight polls run at once, and a poll
+    is given up after poll_deadline seconds.
+
+    /all_stats is fetched over a persistent connection per machine.
+    Finding a machinesitter, and polling one without /all_stats, block so
+    they run in a pool of blocking_workers threads.
+    """
+    # Seconds between checks for machines to start polling
+    queue_interval = .5
+
+    def __init__(self, parent, number, monitored_machines=[],
+                 max_in_flight=200, poll_deadline=None, blocking_workers=16):
+        MachineMonitor.__init__(self, parent, number, monitored_machines)
+        self.max_in_flight = max_in_flight
+        self.poll_deadline = poll_deadline or parent.stats_poll_interval
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            blocking_workers)
+        # machine -> asyncio task polling it
+        self.watchers = {}
+        # machine -> HTTPConnection to its machinesitter
+        self.connections = {}
+        # machine -> future of a blocking call which may still be running
+        self.blocking = {}
+        self.semaphore = None
+        self.loop = None
+
+    def start(self):
+        asyncio.run(self._run())
+
+    async def _run(self):
+        self.loop = asyncio.get_running_loop()
+        self.semaphore = asyncio.Semaphore(self.max_in_flight)
+        self.spread(self.monitored_machines)
+        for machine in list(self.monitored_machines):
+            self._watch(machine)
+
+        while True:
+            try:
+                while len(self.add_queue) > 0:
+                    machine = self.add_queue[-1]
+                    self.monitored_machines.append(machine)
+                    self.add_queue.remove(machine)
+                    # Fetch its stats straight away
+                    self.schedule(machine, 0)
+                    self._watch(machine)
+
+                self.remove_failed_machines()
+            except:
+                import traceback
+                traceback.print_exc()
+                logger.error(traceback.format_exc())
+
+            await asyncio.sleep(self.queue_interval)
+
+    def _watch(self, machine):
+        if machine not in self.watchers:
+            self.watchers[machine] = self.loop.create_task(
+                self._watch_machine(machine))
+
+    async def _watch_machine(self, machine):
+        try:
+            while machine in self.all_machines:
+                await asyncio.sleep(max(
+                    0, self.next_poll.get(machine, 0) - time.time()))
+                if machine not in self.all_machines:
+                    break
+
+                start_time = time.time()
+                self.record_pull(machine, await self.poll_machine(machine),
+                                 start_time)
+        finally:
+            del self.watchers[machine]
+            self._close(machine)
+
+    async def poll_once(self, machines):
+        """
+        Poll machines once, all at the same time.
+
+        Returns: a list of whether each poll succeeded
+        """
+        if self.loop is None:
+            self.loop = asyncio.get_running_loop()
+            self.semaphore = asyncio.Semaphore(self.max_in_flight)
+
+        return await asyncio.gather(
+            *[self.poll_machine(machine) for machine in machines])
+
+    async def poll_machine(self, machine):
+        """
+        Returns: True if the machine's stats are up to date
+        """
+        async with self.semaphore:
+            try:
+                return await asyncio.wait_for(self._poll(machine),
+                                              self.poll_deadline)
+            except asyncio.TimeoutError:
+                logger.info("Polling %s timed out" % machine)
+                # The response may still turn up on the connection
+                self._close(machine)
+            except Exception:
+                import traceback
+                logger.error(traceback.format_exc())
+            return False
+
+    async def _poll(self, machine):
+        if not machine.is_initialized():
+            if not await self._blocking(machine, machine.initialize):
+                return False
+
+        data = machine.datamanager
+        if not data.needs_pull(self.clustersitter.push_reconcile_interval):
+            # It's pushing its stats to us
+            return True
+
+        if data.batched_stats:
+            path, since = data.all_stats_request()
+            try:
+                status, content = await self._connection(machine).get(
+                    "/" + path)
+            except (OSError, ValueError, asyncio.IncompleteReadError):
+                status = None
+
+            if status is not None:
+                machine_stats, task_stats = data.parse_all_stats(
+                    status, content, since)
+                if machine_stats is not None:
+                    data.update_tasks(machine_stats, task_stats)
+                    data.last_reload = time.time()
+                    machine.loaded = True
+                    return True
+
+        # Either it doesn't serve /all_stats, or it couldn't be reached and
+        # a reload will look for it on another port
+        return await self._blocking(machine, machine._api_get_stats)
+
+    async def _blocking(self, machine, function):
+        pending = self.blocking.get(machine)
+        if pending is not None and not pending.done():
+            # Still stuck in the last call
+            return False
+
+        future = self.blocking[machine] = self.loop.run_in_executor(
+            self.executor, function)
+        # Timing out mustn't mark the future done while the call still runs
+        return bool(await asyncio.shield(future))
+
+    def _connection(self, machine):
+        data = machine.datamanager
+        connection = self.connections.get(machine)
+        if connection is None or (connection.host, connection.port) != (
+                data.hostname, data.portnum):
+            self._close(machine)
+            connection = self.connections[machine] = HTTPConnection(
+                data.hostname, data.portnum)
+
+        return connection
+
+    def _close(self, machine):
+        connection = self.connections.pop(machine, None)
+        if connection is not None:
+            connection.close()
@@ -85,7 +85,15 @@ def main(sys_args=None):
                            dns_provider_config=settings.dns_provider_config,
                            keys=settings.keys, login_user=settings.login_user,
                            log_location=settings.log_location,
-                           launch_location=launch_location)
+                           launch_location=launch_location,
+                           utilisation_warning=getattr(
+                               settings, 'utilisation_warning', .8),
+                           utilisation_critical=getattr(
+                               settings, 'utilisation_critical', .95),
+                           async_monitor=getattr(
+                               settings, 'async_monitor', False),
+                           max_in_flight=getattr(
+                               settings, 'max_in_flight', 200))
     sitter.start()
 
     if False:
@@ -49,6 +49,16 @@ for az in ['b', 'c', 'd']:
     provider_config['aws']['us-west-1%s' % az] = \
         provider_config['aws']['us-west-1a']
 
+# Fraction of a task's constraint limits (cpu, mem etc.) at which the
+# overview page flags it as a warning or critical
+utilisation_warning = .8
+utilisation_critical = .95
+
+# Poll all machines from one asyncio event loop rather than threads, with
+# at most max_in_flight polls running at once
+async_monitor = False
+max_in_flight = 200
+
 # DNS Provider configuration
 dns_provider_config = {
     'class': 'dynect:Dynect',
@@ -21,7 +21,7 @@ import sittercommon.machinedata
 from .clusterstate import ClusterState
 from .clusterstats import ClusterStats
 from .eventmanager import ClusterEventManager
-from .machinemonitor import MachineMonitor
+from .machinemonitor import AsyncMachineMonitor, MachineMonitor
 from .monitoredmachine import MonitoredMachine
 from .productionjob import ProductionJob
 from .providers.aws import AmazonEC2
@@ -47,8 +47,18 @@ class ClusterSitter(object):
                  dns_provider_config,
                  keys=None, login_user=None,
                  starting_port=30000,
-                 launch_location=None):
+                 launch_location=None,
+                 utilisation_warning=.8,
+                 utilisation_critical=.95,
+                 async_monitor=False,
+                 max_in_flight=200):
         self.worker_thread_count = 4
+        # Poll every machine from one event loop instead of a pass over
+        # each monitor's machines in turn
+        self.async_monitor = async_monitor
+        self.max_in_flight = max_in_flight
+        if async_monitor:
+            self.worker_thread_count = 1
         self.daemon = daemon
         self.keys = keys
         self.login_user = login_user
@@ -61,6 +71,14 @@ class ClusterSitter(object):
 
         # In seconds
         self.stats_poll_interval = 5
+        # Machines pushing their stats are still polled this often (in
+        # seconds), in case a push was lost
+        self.push_reconcile_interval = 60
+
+        # Fractions of a constraint's limit at which the overview flags
+        # a task
+        self.utilisation_warning = utilisation_warning
+        self.utilisation_critical = utilisation_critical
 
         self.state = ClusterState(self)
 
@@ -94,6 +112,8 @@ class ClusterSitter(object):
                                       self.api_update_logging_level)
         self.http_monitor.add_handler('/update_job',
                                       self.api_update_job)
+        self.http_monitor.add_handler('/ingest_stats',
+                                      self.api_ingest_stats)
 
         # Do lots of logging configuration
         modules = [
@@ -141,6 +161,10 @@ class ClusterSitter(object):
 
         socket.setdefaulttimeout(2)
 
+        # Look for machinesitters where they were found last time first
+        sittercommon.machinedata.port_cache.load(
+            "%s/machinesitter_ports.json" % self.log_location)
+
     # ----------- API ----------------
     def _api_check(self, args, required_fields):
         if self.start_state != "Started":
@@ -242,6 +266,12 @@ class ClusterSitter(object):
         else:
             return "Job Not Found"
 
+    def api_ingest_stats(self, args):
+        if not 'delta' in args:
+            return "Missing Field delta"
+
+        return self.state.ingest_stats(args)
+
     # ----------- END API ----------
 
     def machines_in_queue(self):
@@ -436,8 +466,13 @@ class ClusterSitter(object):
         # Spin up all the monitoring threads
         #TODO: Move monitor thread spinup to ClusterState.
         for threadnum in range(self.worker_thread_count):
-            machinemonitor = MachineMonitor(parent=self,
-                                            number=threadnum)
+            if self.async_monitor:
+                machinemonitor = AsyncMachineMonitor(
+                    parent=self, number=threadnum,
+                    max_in_flight=self.max_in_flight)
+            else:
+                machinemonitor = MachineMonitor(parent=self,
+                                                number=threadnum)
             thread = threading.Thread(target=machinemonitor.start,
                                       name='Monitoring-%s' % threadnum)
             self.state.monitors.append((machinemonitor, thread))
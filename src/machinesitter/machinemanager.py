@@ -1,3 +1,4 @@
+import concurrent.futures
 import json
 import os
 import signal
@@ -8,17 +9,31 @@ import time
 
 import sittercommon.http_monitor as http_monitor
 import sittercommon.logmanager as logmanager
+import sittercommon.statsdelta as statsdelta
 from . import machinestats
+from . import procsampler
+from . import statspusher
 from . import taskmanager
 
 
 class MachineManager(object):
+    # Tasksitters queried at once when gathering stats for /all_stats
+    stats_workers = 8
+
 
     def __init__(self, task_definition_file, log_location,
                  machine_sitter_starting_port=40000,
                  task_sitter_starting_port=50000,
                  launch_location="",
-                 daemon=False):
+                 daemon=False,
+                 shared_sampler=False,
+                 sample_interval=0.1,
+                 async_http=False,
+                 http_workers=8,
+                 http_max_connections=1000,
+                 push_to=None,
+                 push_interval=0.5,
+                 heartbeat_interval=10):
         self.tasks = {}
         self.launch_location = launch_location
         self.task_definition_file = task_definition_file
@@ -36,14 +51,25 @@ class MachineManager(object):
         self.parent_pid = os.getpid()
         self.stats = machinestats.MachineStats(self)
 
+        self.sampler = None
+        if shared_sampler:
+            self.sampler = procsampler.ProcSampler(
+                self,
+                os.path.join(log_location, "usage"),
+                sample_interval)
+
         self.machine_sitter_starting_port = machine_sitter_starting_port
         self.task_sitter_starting_port = task_sitter_starting_port
         self.orig_machine_port = self.machine_sitter_starting_port
         self.orig_task_port = self.task_sitter_starting_port
 
-        self.http_monitor = http_monitor.HTTPMonitor(self.stats,
-                                                     self,
-                                                     self.next_port(True))
+        self.http_monitor = http_monitor.HTTPMonitor(
+            self.stats,
+            self,
+            self.next_port(True),
+            use_asyncio=async_http,
+            max_workers=http_workers,
+            max_connections=http_max_connections)
 
         self.http_monitor.add_handler('/start_task', self.remote_start_task)
         self.http_monitor.add_handler('/stop_task', self.remote_stop_task)
@@ -55,6 +81,22 @@ class MachineManager(object):
                                       self.remote_write_config)
         self.http_monitor.add_handler('/load_config',
                                       self.remote_load_config)
+        self.http_monitor.add_handler('/all_stats',
+                                      self.remote_all_stats)
+        self.http_monitor.add_handler('/identify', self.remote_identify)
+
+        self.stats_pool = concurrent.futures.ThreadPoolExecutor(
+            self.stats_workers)
+        self.all_stats_versions = statsdelta.VersionedStats()
+        # task name -> future of its last background stats refresh
+        self.stats_refreshes = {}
+        self.stats_refreshes_lock = threading.Lock()
+
+        self.pusher = None
+        if push_to:
+            self.pusher = statspusher.StatsPusher(self, push_to,
+                                                  push_interval,
+                                                  heartbeat_interval)
 
         print("Adding signals")
         signal.signal(signal.SIGTERM, self.exit_now)
@@ -179,6 +221,69 @@ class MachineManager(object):
 
         return "Added tasks: %s" % data
 
+    def remote_identify(self, args):
+        """
+        Just enough to tell a machinesitter from anything else listening,
+        without gathering any stats.
+        """
+        return {'machinesitter_pid': os.getpid()}
+
+    def remote_all_stats(self, args):
+        """
+        The machinesitter's own stats plus the full stats of every
+        running task, so a poller needs one request instead of one per
+        task.
+
+        since=<version> returns only the stats which changed after that
+        version, see statsdelta.VersionedStats.get_delta
+        """
+        data = self.get_all_stats()
+        if 'since' in args:
+            return self.all_stats_versions.get_delta(
+                data, statsdelta.parse_version(args['since']))
+
+        return data
+
+    def get_all_stats(self):
+        # Fetched first so the machine stats reuse the cached results
+        tasks = self.get_task_stats()
+        return {'machine': self.http_monitor.get_stats(),
+                'tasks': tasks}
+
+    def get_task_stats(self):
+        """
+        Fetch the stats of every running task from its tasksitter, in
+        parallel.  Each task caches its result for a second.
+
+        Returns: {task name: stats}
+        """
+        running = [task for task in list(self.tasks.values())
+                   if task.is_running()]
+        results = self.stats_pool.map(lambda task: task.get_stats(),
+                                      running)
+        return dict(zip([task.name for task in running], results))
+
+    def refresh_task_stats(self, max_age=1):
+        """
+        Start fetching the stats of running tasks whose cached stats are
+        over max_age seconds old, without waiting for them.  A task whose
+        last refresh is still queued or running is skipped.
+        """
+        now = time.time()
+        with self.stats_refreshes_lock:
+            for name in list(self.stats_refreshes.keys()):
+                if name not in self.tasks:
+                    del self.stats_refreshes[name]
+
+            for task in list(self.tasks.values()):
+                pending = self.stats_refreshes.get(task.name)
+                if pending is not None and not pending.done():
+                    continue
+
+                if task.is_running() and now - task.stats_time >= max_age:
+                    self.stats_refreshes[task.name] = self.stats_pool.submit(
+                        task.get_stats, max_age)
+
     def write_out_task_definitions(self):
         config = {'log_location': self.log_location}
         task_definitions = []
@@ -232,6 +337,9 @@ class MachineManager(object):
             task = self.tasks[task.name]
             task.reload_from_definition(task_definition)
 
+        if self.sampler:
+            task.usage_feed = self.sampler.feed_dir
+
         task.set_port(self.next_port())
 
         self.tasks[task.name] = task
@@ -283,6 +391,12 @@ class MachineManager(object):
         if self.daemon:
             self.logmanager.setup_all()
 
+        if self.sampler:
+            self.sampler.start()
+
+        if self.pusher:
+            self.pusher.start()
+
         for task in list(self.tasks.values()):
             print("Initializing %s" % task.name)
             task.initialize()
@@ -7,6 +7,7 @@ class MachineStats(StatsCollector):
     def get_live_data(self):
         self.update_hostname()
         data = {}
+        utilisations = []
         for task_name, task in list(self.harness.tasks.items()):
             running = bool(task.is_running())
             data["%s-running" % task.name] = running
@@ -40,6 +41,20 @@ class MachineStats(StatsCollector):
                 data["%s-monitoring" % task.name] = "<a href='%s'>%s</a>" % (location,
                                                                            location)
 
+                # As last fetched from the tasksitter, rendering /stats
+                # never waits on one
+                utilisation = task.stats.get('max_utilisation')
+                data["%s-max_utilisation" % task.name] = utilisation
+                if utilisation is not None:
+                    utilisations.append(utilisation)
+
+        data['max_utilisation'] = max(utilisations or [None])
+        self.harness.refresh_task_stats()
+
+        if self.harness.sampler:
+            data['proc_sampler_duration'] = \
+                self.harness.sampler.last_sample_duration
+
         load = os.getloadavg()
         data['load_one_min'] = load[0]
         data['load_five_min'] = load[1]
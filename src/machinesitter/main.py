@@ -34,6 +34,50 @@ def parse_args(args):
                         action="store_true",
                         help='Daemonize and split from launching shell')
 
+    parser.add_argument("--shared-sampler", dest="shared_sampler",
+                        default=False,
+                        action="store_true",
+                        help='Sample /proc once per tick for all tasks and '
+                        'feed the results to the tasksitters instead of '
+                        'having every tasksitter scan /proc itself')
+
+    parser.add_argument("--sample-interval", dest="sample_interval",
+                        default=0.1, type=float,
+                        help='How frequently (seconds) the shared sampler '
+                        'scans /proc')
+
+    parser.add_argument("--async-http", dest="async_http",
+                        default=False,
+                        action="store_true",
+                        help='Serve the HTTP monitor from an asyncio event '
+                        'loop with a bounded pool of handler threads instead '
+                        'of a thread per connection (no follow=1 support)')
+
+    parser.add_argument("--http-workers", dest="http_workers",
+                        default=8, type=int,
+                        help='Handler threads for --async-http')
+
+    parser.add_argument("--http-max-connections",
+                        dest="http_max_connections",
+                        default=1000, type=int,
+                        help='Open connections --async-http accepts before '
+                        'answering 503')
+
+    parser.add_argument("--push-to", dest="push_to",
+                        default=None,
+                        help='URL of a clustersitter to push stats to as '
+                        'tasks start and stop, e.g. http://cluster:30000')
+
+    parser.add_argument("--push-interval", dest="push_interval",
+                        default=0.5, type=float,
+                        help='How frequently (seconds) to check for tasks '
+                        'starting or stopping when pushing stats')
+
+    parser.add_argument("--heartbeat-interval", dest="heartbeat_interval",
+                        default=10, type=float,
+                        help='Push stats at least this often (seconds) '
+                        'when pushing stats')
+
     return parser.parse_args(args=args)
 
 
@@ -83,12 +127,21 @@ def main(sys_args=None):
     except:
         pass
 
-    manager = machinemanager.MachineManager(args.taskfile,
-                                            config['log_location'],
-                                            machine_sitter_starting_port=40000,
-                                            task_sitter_starting_port=50000,
-                                            launch_location=orig_dir,
-                                            daemon=args.daemon)
+    manager = machinemanager.MachineManager(
+        args.taskfile,
+        config['log_location'],
+        machine_sitter_starting_port=40000,
+        task_sitter_starting_port=50000,
+        launch_location=orig_dir,
+        daemon=args.daemon,
+        shared_sampler=args.shared_sampler,
+        sample_interval=args.sample_interval,
+        async_http=args.async_http,
+        http_workers=args.http_workers,
+        http_max_connections=args.http_max_connections,
+        push_to=args.push_to,
+        push_interval=args.push_interval,
+        heartbeat_interval=args.heartbeat_interval)
 
     task_definitions = config['task_definitions']
 
@@ -0,0 +1,152 @@
+"""
+A machine-wide /proc sampler which computes usage for every task
+in a single pass and publishes it to the tasksitters.
+"""
+import json
+import os
+import resource
+import threading
+import time
+
+from tasksitter import process
+from tasksitter import proctree
+
+
+class ProcSampler(object):
+    """
+    Scan /proc once per tick and publish per-pgrp cpu, memory and
+    storage io usage for every task pgrp (the pgrp led by a direct child of a tasksitter).
+
+    Each figure is written to FEED_DIR/PGRP.usage, which a tasksitter
+    started with --usage-feed reads instead of sampling /proc itself.
+    """
+    def __init__(self, manager, feed_dir, interval=0.1):
+        self.manager = manager
+        self.feed_dir = feed_dir
+        self.interval = interval
+        self.thread = None
+        self.should_stop = False
+        self.pagesize = resource.getpagesize()
+
+        # pgrp -> last cpu usage vector
+        self.last_usage = {}
+        self.last_system_usage = None
+        self.published = set()
+        self.last_sample_time = 0
+        self.last_sample_duration = 0
+
+        if not os.path.exists(self.feed_dir):
+            os.makedirs(self.feed_dir)
+
+    def get_sitter_pids(self):
+        pids = set()
+        for task in list(self.manager.tasks.values()):
+            if task.is_running():
+                pids.add(task.process.pid)
+
+        return pids
+
+    def sample(self):
+        """
+        Do a single scan of /proc.
+
+        Returns: a dict of pgrp -> {'cpu': usage vector,
+                                    'mem_usage': [vmem, res],
+                                    'io_usage': {'read_bytes': ...,
+                                                 'write_bytes': ...}}
+        """
+        sitters = self.get_sitter_pids()
+        groups = {}
+        all_stats = []
+        for pid in proctree.list_pids():
+            columns = proctree.read_proc_stat(pid)
+            if not columns:
+                continue
+
+            all_stats.append(columns)
+            # A task's child calls setpgrp(), so it leads its own pgrp
+            if int(columns[3]) in sitters and pid == int(columns[4]):
+                groups[pid] = {'cpu': [0] * 7, 'mem_usage': [0, 0],
+                               'io_usage': {'read_bytes': 0,
+                                            'write_bytes': 0}}
+
+        for columns in all_stats:
+            group = groups.get(int(columns[4]))
+            if group is None:
+                continue
+
+            group['cpu'][0] += int(columns[13])
+            group['cpu'][2] += int(columns[14])
+            group['mem_usage'][0] += int(columns[22])
+            group['mem_usage'][1] += int(columns[23]) * self.pagesize
+
+            counters = proctree.read_proc_io(int(columns[0]))
+            if counters:
+                for name in group['io_usage']:
+                    group['io_usage'][name] += counters.get(name, 0)
+
+        return groups
+
+    def publish(self, pgrp, data):
+        filename = os.path.join(self.feed_dir, "%d.usage" % pgrp)
+        tmpname = "%s.tmp" % filename
+        with open(tmpname, 'w') as feed:
+            feed.write(json.dumps(data))
+
+        # Rename so readers never see a partial file
+        os.rename(tmpname, filename)
+
+    def unpublish(self, pgrp):
+        try:
+            os.unlink(os.path.join(self.feed_dir, "%d.usage" % pgrp))
+        except OSError:
+            pass
+
+    def tick(self):
+        start = time.time()
+        groups = self.sample()
+        system_usage = process.Process.get_system_cpu_usage()
+
+        for pgrp, group in list(groups.items()):
+            cpu_usage = 0
+            last_usage = self.last_usage.get(pgrp)
+            if last_usage and self.last_system_usage:
+                cpu_usage = process.cpu_usage_between(
+                    group['cpu'], last_usage,
+                    system_usage, self.last_system_usage)
+
+            self.publish(pgrp, {'time': time.time(),
+                                'interval': self.interval,
+                                'cpu_usage': cpu_usage,
+                                'mem_usage': group['mem_usage'],
+                                'io_usage': group['io_usage'],
+                                'system_usage': system_usage})
+
+        for pgrp in self.published - set(groups.keys()):
+            self.unpublish(pgrp)
+
+        self.published = set(groups.keys())
+        self.last_usage = dict([(pgrp, group['cpu'])
+                                for pgrp, group in list(groups.items())])
+        self.last_system_usage = system_usage
+        self.last_sample_time = start
+        self.last_sample_duration = time.time() - start
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run,
+                                       name="ProcSampler")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.should_stop = True
+
+    def _run(self):
+        while not self.should_stop:
+            try:
+                self.tick()
+            except:
+                import traceback
+                traceback.print_exc()
+
+            time.sleep(self.interval)
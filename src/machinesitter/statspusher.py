@@ -0,0 +1,116 @@
+"""
+Push a machine's stats to a clustersitter as they change, instead of
+waiting for it to poll.
+"""
+import threading
+import time
+
+import requests
+import simplejson
+
+from sittercommon import httppool
+
+
+class StatsPusher(object):
+    """
+    Every interval seconds, check whether a task was added, removed,
+    started or stopped.  If one was, or heartbeat_interval seconds have
+    passed since the last push, POST what changed in /all_stats since the
+    last push the clustersitter accepted to URL/ingest_stats as:
+
+        data={"hostnames": [...], "port": machinesitter port,
+              "heartbeat_interval": seconds, "since": version or null,
+              "delta": statsdelta.VersionedStats.get_delta() result}
+
+    The clustersitter answers "OK", or "Resync" if it needs everything,
+    which is then pushed straight away.
+    """
+    def __init__(self, manager, url, interval=0.5, heartbeat_interval=10):
+        self.manager = manager
+        self.url = url.rstrip('/')
+        self.interval = interval
+        self.heartbeat_interval = heartbeat_interval
+        self.pool = httppool.SessionPool(max_connections=1, timeout=2,
+                                         retries=0)
+        self.thread = None
+        self.should_stop = False
+
+        # Version of the last push the clustersitter accepted
+        self.since = None
+        self.last_push = 0
+        self.last_states = None
+        self.pushes = 0
+        self.failures = 0
+
+    def get_task_states(self):
+        return dict([(name, bool(task.is_running())) for name, task in
+                     list(self.manager.tasks.items())])
+
+    def get_hostnames(self):
+        stats = self.manager.stats
+        stats.update_hostname()
+        return [name for name in (stats.hostname, stats.hostname_external)
+                if name]
+
+    def tick(self):
+        """
+        Push if a task changed state or a heartbeat is due.
+
+        Returns: True if stats were pushed
+        """
+        states = self.get_task_states()
+        if (states == self.last_states and
+                time.time() - self.last_push < self.heartbeat_interval):
+            return False
+
+        self.last_states = states
+        self.push()
+        return True
+
+    def push(self):
+        delta = self.manager.all_stats_versions.get_delta(
+            self.manager.get_all_stats(), self.since)
+        payload = {'hostnames': self.get_hostnames(),
+                   'port': self.manager.http_monitor.port,
+                   'heartbeat_interval': self.heartbeat_interval,
+                   'since': self.since,
+                   'delta': delta}
+
+        self.last_push = time.time()
+        answer = None
+        try:
+            response = self.pool.post(
+                "%s/ingest_stats" % self.url,
+                data={'data': simplejson.dumps(payload)})
+            answer = response.text
+        except requests.RequestException:
+            pass
+
+        if answer == "OK":
+            self.since = delta['version']
+            self.pushes += 1
+            return
+
+        self.failures += 1
+        self.since = None
+        if answer == "Resync":
+            self.last_push = 0
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run,
+                                       name="StatsPusher")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.should_stop = True
+
+    def _run(self):
+        while not self.should_stop:
+            try:
+                self.tick()
+            except:
+                import traceback
+                traceback.print_exc()
+
+            time.sleep(self.interval)
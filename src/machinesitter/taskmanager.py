@@ -1,4 +1,5 @@
 import json
+import requests
 import simplejson
 import subprocess
 import time
@@ -6,17 +7,37 @@ import time
 
 class TaskManager(object):
     required_fields = ['name', 'command']
+    # Passed straight through as --field-name=value
+    flexible_limit_fields = [
+        'cpu_smoothing',
+        'cpu_grace_period',
+        'mem_smoothing',
+        'mem_grace_period',
+        'io_smoothing',
+        'io_grace_period']
+    log_retention_fields = [
+        'log_budget',
+        'log_segment_size',
+        'log_keep',
+        'log_max_age']
+
     optional_fields = [
         'auto_start',
         'restart',
         'max_restarts',
         'ensure_alive',
         'poll_interval',
+        'max_poll_interval',
         'allow_exit',
         'cpu',
         'mem',
+        'mem_measure',
+        'io_read_mbps',
+        'io_write_mbps',
         'time_limit',
-        'uid']
+        'cgroup',
+        'cgroup_enforce',
+        'uid'] + flexible_limit_fields + log_retention_fields
 
     def __init__(self, task_definition, log_location, launch_location):
         self.reload_from_definition(task_definition)
@@ -28,6 +49,7 @@ class TaskManager(object):
         self.stderr_location = log_location
 
         self.was_started = False
+        self.usage_feed = None
 
         self.sitter_stdout = "%s/%s.stdout" % (log_location, self.name)
         self.sitter_stderr = "%s/%s.stderr" % (log_location, self.name)
@@ -39,17 +61,28 @@ class TaskManager(object):
         self.process = None
         self.used_pids = []
 
+        self.stats = {}
+        self.stats_time = 0
+
     def reload_from_definition(self, task_definition):
         self.auto_start = task_definition.get('auto_start', False)
         self.restart = task_definition.get('restart', False)
         self.max_restarts = task_definition.get('max_restarts', -1)
         self.ensure_alive = task_definition.get('ensure_alive', False)
         self.poll_interval = task_definition.get('poll_interval', 0.1)
+        self.max_poll_interval = task_definition.get('max_poll_interval')
         self.allow_exit = task_definition.get('allow_exit', False)
         self.cpu = task_definition.get('cpu')
         self.mem = task_definition.get('mem')
+        self.mem_measure = task_definition.get('mem_measure')
+        self.io_read_mbps = task_definition.get('io_read_mbps')
+        self.io_write_mbps = task_definition.get('io_write_mbps')
         self.time_limit = task_definition.get('time_limit')
+        self.cgroup = task_definition.get('cgroup', False)
+        self.cgroup_enforce = task_definition.get('cgroup_enforce', False)
         self.uid = task_definition.get('uid')
+        for opt in self.flexible_limit_fields + self.log_retention_fields:
+            setattr(self, opt, task_definition.get(opt))
         self.command = task_definition['command']
         self.name = task_definition['name']
 
@@ -94,6 +127,29 @@ class TaskManager(object):
 
         return self.process.poll() == None
 
+    def get_stats(self, max_age=1):
+        """
+        Fetch the tasksitter's /stats, reusing the last result if it is
+        less than max_age seconds old.
+
+        Returns: the stats dict, or {} if the tasksitter didn't answer
+        """
+        now = time.time()
+        if now - self.stats_time < max_age:
+            return self.stats
+
+        self.stats_time = now
+        try:
+            response = requests.get(
+                "http://localhost:%s/stats?nohtml=1&format=json" % (
+                    self.http_monitoring_port),
+                timeout=1)
+            self.stats = simplejson.loads(response.content)
+        except:
+            self.stats = {}
+
+        return self.stats
+
     def get_last_pid(self):
         return self.used_pids[-1]
 
@@ -121,18 +177,44 @@ class TaskManager(object):
         if self.poll_interval:
             args.append("--poll-interval=%s" % self.poll_interval)
 
+        if self.max_poll_interval:
+            args.append("--max-poll-interval=%s" % self.max_poll_interval)
+
         if self.cpu:
             args.append("--cpu=%s" % self.cpu)
 
         if self.mem:
             args.append("--mem=%s" % self.mem)
 
+        if self.mem_measure:
+            args.append("--mem-measure=%s" % self.mem_measure)
+
+        if self.io_read_mbps:
+            args.append("--io-read-mbps=%s" % self.io_read_mbps)
+
+        if self.io_write_mbps:
+            args.append("--io-write-mbps=%s" % self.io_write_mbps)
+
         if self.time_limit:
             args.append("--time-limit=%s" % self.time_limit)
 
+        if self.cgroup:
+            args.append("--cgroup")
+
+        if self.cgroup_enforce:
+            args.append("--cgroup-enforce")
+
         if self.uid:
             args.append("--uid=%s" % self.uid)
 
+        for opt in self.flexible_limit_fields + self.log_retention_fields:
+            if getattr(self, opt) is not None:
+                args.append("--%s=%s" % (opt.replace('_', '-'),
+                                         getattr(self, opt)))
+
+        if self.usage_feed:
+            args.append("--usage-feed=%s" % self.usage_feed)
+
         args.append("--command")
         args.append(self.command)
 
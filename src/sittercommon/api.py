@@ -2,7 +2,6 @@ import os
 import requests
 import simplejson
 import sys
-import zlib
 
 from clustersitter.monitoredmachine import MonitoredMachine
 from clustersitter.productionjob import ProductionJob
@@ -37,7 +36,8 @@ class ClusterState(object):
         self.raw = None
 
     def reload(self):
-        url = "%s/overview?nohtml=1&format=json&compress=1" % self.url
+        # requests asks for (and decodes) a gzipped response
+        url = "%s/overview?nohtml=1&format=json" % self.url
         # 3 attempts, since sometimes downloading json is a bit flaky
         data = None
         for _ in range(3):
@@ -46,8 +46,7 @@ class ClusterState(object):
                 continue
 
             try:
-                raw_data = zlib.decompress(response.content)
-                data = simplejson.loads(raw_data)
+                data = simplejson.loads(response.content)
                 break
             except:
                 continue
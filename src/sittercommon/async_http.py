@@ -0,0 +1,234 @@
+"""
+An asyncio HTTP/1.1 server which runs blocking request handlers in a
+bounded thread pool, and a client for polling sitters from an event loop
+"""
+import asyncio
+import concurrent.futures
+import gzip
+import threading
+import traceback
+
+
+class AsyncHTTPServer(object):
+    """
+    Serve HTTP from a single event loop.  Reading requests and writing
+    responses happens on the loop, so idle keep-alive connections and
+    slow clients don't tie up a thread.  Only the handlers themselves run
+    in a pool of max_workers threads.
+
+    Connections beyond max_connections get a 503 and are closed.
+
+    handler_class(request, client_address, server) is given the raw bytes
+    of one request and must leave output, keep_alive and file_transfer
+    set, as http_monitor.BufferedMonitorHandler does.
+
+    Has the serve_forever()/shutdown() interface of socketserver servers.
+    """
+    # Seconds an idle connection is kept open
+    keepalive_timeout = 30
+    # Maximum size of a request's headers
+    max_header_size = 65536
+
+    def __init__(self, server_address, handler_class, max_workers=8,
+                 max_connections=1000):
+        self.server_address = server_address
+        self.handler_class = handler_class
+        self.max_workers = max_workers
+        self.max_connections = max_connections
+        self.connections = 0
+
+        self.executor = None
+        self.loop = None
+        self.stop_event = None
+        self.started = threading.Event()
+        self.finished = threading.Event()
+
+    def serve_forever(self, poll_interval=None):
+        """
+        Serve until shutdown() is called.  poll_interval is ignored, the
+        loop wakes up as soon as it's asked to stop.
+        """
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            self.max_workers)
+        try:
+            asyncio.run(self._serve())
+        finally:
+            self.executor.shutdown(wait=False)
+            self.started.set()
+            self.finished.set()
+
+    def shutdown(self):
+        """
+        Stop serving and wait for serve_forever() to return
+        """
+        self.started.wait()
+        if self.loop and not self.finished.is_set():
+            self.loop.call_soon_threadsafe(self.stop_event.set)
+        self.finished.wait()
+
+    async def _serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.stop_event = asyncio.Event()
+        host, port = self.server_address
+        server = await asyncio.start_server(
+            self._handle_connection, host or None, port,
+            limit=self.max_header_size,
+            backlog=min(self.max_connections, 4096))
+        self.started.set()
+
+        async with server:
+            await self.stop_event.wait()
+
+    async def _read_request(self, reader):
+        """
+        Read the headers and body of one request.
+
+        Returns: the raw request, or None if the client closed the
+        connection (or went quiet) between requests
+        """
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'),
+                                          self.keepalive_timeout)
+        except asyncio.IncompleteReadError:
+            return None
+        except asyncio.TimeoutError:
+            return None
+
+        length = 0
+        for line in head.split(b'\r\n')[1:]:
+            name, _, value = line.partition(b':')
+            if name.strip().lower() == b'content-length':
+                length = int(value.strip())
+
+        body = b''
+        if length:
+            body = await reader.readexactly(length)
+
+        return head + body
+
+    async def _send_file(self, writer, filename, offset, length):
+        with open(filename, 'rb') as filehandle:
+            await self.loop.sendfile(writer.transport, filehandle,
+                                     offset, length)
+
+    async def _handle_connection(self, reader, writer):
+        if self.connections >= self.max_connections:
+            writer.write(b'HTTP/1.1 503 Service Unavailable\r\n'
+                         b'Content-Length: 0\r\nConnection: close\r\n\r\n')
+            writer.close()
+            return
+
+        self.connections += 1
+        client_address = writer.get_extra_info('peername')
+        try:
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+
+                handler = await self.loop.run_in_executor(
+                    self.executor, self.handler_class,
+                    request, client_address, self)
+
+                writer.write(handler.output)
+                await writer.drain()
+                if handler.file_transfer:
+                    await self._send_file(writer, *handler.file_transfer)
+
+                if not handler.keep_alive:
+                    break
+        except (ConnectionError, ValueError, asyncio.IncompleteReadError,
+                asyncio.LimitOverrunError):
+            # The client hung up or sent something we can't parse
+            pass
+        except asyncio.CancelledError:
+            # The server is shutting down
+            pass
+        except Exception:
+            traceback.print_exc()
+        finally:
+            self.connections -= 1
+            writer.close()
+
+
+class HTTPConnection(object):
+    """
+    A persistent HTTP/1.1 connection for GETs, opened on first use and
+    reopened whenever the server closes it.
+    """
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def get(self, path):
+        """
+        Returns: (status, body), the body gunzipped if need be
+
+        Raises: OSError, ValueError or asyncio.IncompleteReadError if no
+        response could be read
+        """
+        reused = self.writer is not None
+        try:
+            return await self._get(path)
+        except (OSError, ValueError, asyncio.IncompleteReadError):
+            self.close()
+            if not reused:
+                raise
+
+        # The server may have closed the connection while it was idle
+        try:
+            return await self._get(path)
+        except (OSError, ValueError, asyncio.IncompleteReadError):
+            self.close()
+            raise
+
+    async def _get(self, path):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(
+                self.host, self.port)
+
+        self.writer.write((
+            "GET %s HTTP/1.1\r\nHost: %s:%s\r\n"
+            "Accept-Encoding: gzip\r\n\r\n" % (
+                path, self.host, self.port)).encode('latin-1'))
+
+        head = await self.reader.readuntil(b'\r\n\r\n')
+        lines = head.decode('latin-1').split('\r\n')
+        status = int(lines[0].split()[1])
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip().lower()
+
+        if 'content-length' in headers:
+            body = await self.reader.readexactly(
+                int(headers['content-length']))
+        elif headers.get('transfer-encoding') == 'chunked':
+            body = await self._read_chunks()
+        else:
+            body = await self.reader.read()
+            headers['connection'] = 'close'
+
+        if headers.get('connection') == 'close':
+            self.close()
+
+        if headers.get('content-encoding') == 'gzip':
+            body = gzip.decompress(body)
+
+        return status, body
+
+    async def _read_chunks(self):
+        chunks = []
+        while True:
+            size = int((await self.reader.readline()).split(b';')[0], 16)
+            chunk = await self.reader.readexactly(size + 2)
+            if not size:
+                return b''.join(chunks)
+            chunks.append(chunk[:-2])
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
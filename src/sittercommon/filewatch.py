@@ -0,0 +1,124 @@
+"""
+Wait for a file to change, with inotify where the kernel supports it
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import time
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVE_SELF = 0x00000800
+IN_DELETE_SELF = 0x00000400
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE |
+              IN_MOVE_SELF | IN_DELETE_SELF)
+
+_libc = None
+
+
+def get_libc():
+    global _libc
+    if _libc is None:
+        try:
+            _libc = ctypes.CDLL(ctypes.util.find_library("c"),
+                                use_errno=True)
+            _libc.inotify_init1
+        except (OSError, AttributeError):
+            _libc = False
+
+    return _libc
+
+
+def file_state(filename):
+    """
+    Return: (inode, size, mtime) of filename, or None if it's missing
+    """
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+
+    return (stat.st_ino, stat.st_size, stat.st_mtime)
+
+
+class FileWatcher(object):
+    """
+    Block until a file is written to, replaced or removed.
+
+    Uses inotify when it's available, otherwise polls the file's
+    inode, size and mtime every poll_interval seconds.
+    """
+    def __init__(self, filename, poll_interval=.5):
+        self.filename = filename
+        self.poll_interval = poll_interval
+        self.inotify_fd = None
+        self.last_state = file_state(filename)
+
+        libc = get_libc()
+        if libc:
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if fd >= 0:
+                self.inotify_fd = fd
+                if not self.watch():
+                    self.close()
+
+    def watch(self):
+        """
+        (Re)add the inotify watch, e.g. after the file was replaced.
+
+        Returns: False if the file couldn't be watched
+        """
+        if self.inotify_fd is None:
+            return False
+
+        return get_libc().inotify_add_watch(
+            self.inotify_fd, self.filename.encode(), WATCH_MASK) >= 0
+
+    def wait(self, timeout):
+        """
+        Wait up to timeout seconds for the file to change.
+
+        Returns: True if it (may have) changed
+        """
+        if self.inotify_fd is None:
+            return self._poll(timeout)
+
+        readable, _, _ = select.select([self.inotify_fd], [], [], timeout)
+        if not readable:
+            return False
+
+        # We only care that something happened, not what
+        try:
+            while os.read(self.inotify_fd, 4096):
+                pass
+        except OSError:
+            pass
+
+        state = file_state(self.filename)
+        if state and self.last_state and state[0] != self.last_state[0]:
+            # Replaced (e.g. rotated), so watch the new file
+            self.watch()
+        self.last_state = state
+        return True
+
+    def _poll(self, timeout):
+        deadline = time.time() + timeout
+        while True:
+            state = file_state(self.filename)
+            if state != self.last_state:
+                self.last_state = state
+                return True
+
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+
+            time.sleep(min(self.poll_interval, remaining))
+
+    def close(self):
+        if self.inotify_fd is not None:
+            os.close(self.inotify_fd)
+            self.inotify_fd = None
@@ -0,0 +1,158 @@
+"""
+Fixed size, array backed history of usage samples
+"""
+import array
+import time
+
+
+class RingBuffer(object):
+    """
+    A fixed size ring of (timestamp, cpu, rss, vmem) samples.
+
+    Each column lives in a preallocated array of doubles so memory
+    use never changes once the buffer is created.
+    """
+    columns = ['time', 'cpu', 'rss', 'vmem']
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.data = dict([(column, array.array('d', [0.0] * capacity))
+                          for column in self.columns])
+        self.start = 0
+        self.size = 0
+
+    def append(self, sample):
+        """
+        Add a sample, overwriting the oldest one if the buffer is full.
+
+        sample: a tuple of values in the order of RingBuffer.columns
+        """
+        index = (self.start + self.size) % self.capacity
+        for column, value in zip(self.columns, sample):
+            self.data[column][index] = value
+
+        if self.size < self.capacity:
+            self.size += 1
+        else:
+            self.start = (self.start + 1) % self.capacity
+
+    def get(self, column, since=0):
+        """
+        Return (times, values) arrays of every sample newer than since
+        """
+        times = array.array('d')
+        values = array.array('d')
+        for i in range(self.size):
+            index = (self.start + i) % self.capacity
+            timestamp = self.data['time'][index]
+            if timestamp > since:
+                times.append(timestamp)
+                values.append(self.data[column][index])
+
+        return times, values
+
+
+class HistoryTier(object):
+    """
+    A RingBuffer holding samples averaged over resolution seconds
+    """
+    def __init__(self, resolution, span):
+        self.resolution = resolution
+        self.span = span
+        self.buffer = RingBuffer(int(span / resolution))
+        self.bucket = None
+        self.sums = [0.0] * (len(RingBuffer.columns) - 1)
+        self.count = 0
+
+    def record(self, timestamp, values):
+        bucket = int(timestamp // self.resolution)
+        if bucket != self.bucket:
+            self.flush()
+            self.bucket = bucket
+
+        for index, value in enumerate(values):
+            self.sums[index] += value
+        self.count += 1
+
+    def flush(self):
+        """
+        Write the average of the pending bucket to the buffer
+        """
+        if not self.count:
+            return
+
+        timestamp = (self.bucket + 1) * self.resolution
+        self.buffer.append([timestamp] +
+                           [total / self.count for total in self.sums])
+        self.sums = [0.0] * len(self.sums)
+        self.count = 0
+
+
+class UsageHistory(object):
+    """
+    Multi resolution usage history.  By default keeps 1s samples for
+    10 minutes, 1m samples for a day and 10m samples for a week.
+    """
+    default_tiers = [(1, 600), (60, 86400), (600, 604800)]
+    metrics = RingBuffer.columns[1:]
+
+    def __init__(self, tiers=None):
+        self.tiers = [HistoryTier(resolution, span)
+                      for resolution, span in (tiers or self.default_tiers)]
+
+    def record(self, cpu, rss, vmem, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time()
+
+        for tier in self.tiers:
+            tier.record(timestamp, [cpu, rss, vmem])
+
+    def pick_tier(self, since, resolution=None):
+        """
+        Pick the finest tier whose span reaches back to since, or the
+        tier with the requested resolution.
+        """
+        if resolution:
+            for tier in self.tiers:
+                if tier.resolution == resolution:
+                    return tier
+            return None
+
+        now = time.time()
+        for tier in self.tiers:
+            if since >= now - tier.span:
+                return tier
+
+        return self.tiers[-1]
+
+    def get(self, metric, since=0, resolution=None):
+        """
+        Return: a dict with the tier resolution and times/values arrays
+        of metric after since, or None for an unknown metric/resolution
+        """
+        if metric not in self.metrics:
+            return None
+
+        tier = self.pick_tier(since, resolution)
+        if not tier:
+            return None
+
+        times, values = tier.buffer.get(metric, since)
+        return {'metric': metric,
+                'resolution': tier.resolution,
+                'times': times,
+                'values': values}
+
+
+def to_binary(history):
+    """
+    Pack a UsageHistory.get result as native doubles:
+    resolution, count, then count (time, value) pairs.
+    """
+    packed = array.array('d', [history['resolution'],
+                               len(history['times'])])
+    for timestamp, value in zip(history['times'], history['values']):
+        packed.append(timestamp)
+        packed.append(value)
+
+    return packed.tobytes()
@@ -2,74 +2,193 @@
 Reads data from a stats collector and exposes it via HTTP
 """
 import cgi
+import collections
+import gzip
+import io
 import os
+import re
+import select
 import simplejson
+import socket
 import sys
 import threading
 import tenjin
+import time
 import urllib.parse
 import zlib
 import socketserver
 import http.server
 from pkg_resources import resource_filename
 
+from sittercommon import async_http
+from sittercommon import filewatch
+from sittercommon import history
+from sittercommon import statsdelta
+
 # A weird requirement from tenjin to have this
 # The world explodes if we don't have it
 from tenjin.helpers import *
 
 
+READ_BLOCK_SIZE = 64 * 1024
+
+
+def is_compressed(filename):
+    return filename.endswith('.gz')
+
+
+def open_log(filename):
+    """
+    Open a log for reading bytes, decompressing gzipped (rotated) logs
+    """
+    if is_compressed(filename):
+        return gzip.open(filename, 'rb')
+
+    return open(filename, 'rb')
+
+
 def head(filename, num_lines):
-    return file_process("head", filename, num_lines)
+    """
+    Return the first num_lines lines of filename, like head -n
+    """
+    lines = []
+    with open_log(filename) as filehandle:
+        for line in filehandle:
+            if len(lines) >= num_lines:
+                break
+            lines.append(line)
+
+    return b''.join(lines).decode('utf-8', 'replace')
+
+
+def tail_offset(filehandle, num_lines):
+    """
+    Return the offset in filehandle (opened in binary mode) at which
+    its last num_lines lines start.
+
+    Reads backwards from the end of the file a block at a time, so only
+    about as much as is returned is ever read.
+    """
+    filehandle.seek(0, os.SEEK_END)
+    size = position = filehandle.tell()
+    if num_lines <= 0:
+        return size
+
+    data = b''
+    # num_lines + 1 newlines guarantees the first line we return is
+    # complete, whether or not the file ends with a newline
+    while position > 0 and data.count(b'\n') <= num_lines:
+        read_size = min(READ_BLOCK_SIZE, position)
+        position -= read_size
+        filehandle.seek(position)
+        data = filehandle.read(read_size) + data
+
+    lines = data.splitlines(True)
+    return size - len(b''.join(lines[-num_lines:]))
 
 
 def tail(filename, num_lines):
-    return file_process("tail", filename, num_lines)
+    """
+    Return the last num_lines lines of filename, like tail -n.
+    """
+    if is_compressed(filename):
+        # Can't seek backwards through gzip, so decompress it all
+        with open_log(filename) as filehandle:
+            lines = collections.deque(filehandle, max(num_lines, 0))
+        return b''.join(lines).decode('utf-8', 'replace')
+
+    with open(filename, 'rb') as filehandle:
+        filehandle.seek(tail_offset(filehandle, num_lines))
+        return filehandle.read().decode('utf-8', 'replace')
 
 
-def file_process(cmd, filename, num_lines):
+def parse_range(header, size):
     """
-    Implementing tail in python is like 50 lines of code,
-    and is pretty unreadable.  Just cop out and use something
-    we know works.
+    Parse a single range HTTP Range header ("bytes=START-END",
+    "bytes=START-" or "bytes=-SUFFIX") against a file of size bytes.
 
+    Returns: (offset, length), or None if the range can't be satisfied
     """
-    stdin, stdout = os.popen2("%s -n %s %s" % (cmd, num_lines, filename))
-    stdin.close()
-    data = stdout.read()
-    stdout.close()
-    return data
+    match = re.match(r'^bytes=(\d*)-(\d*)$', header.strip())
+    if not match or match.groups() == ('', ''):
+        return None
 
+    start, end = match.groups()
+    if not start:
+        length = min(int(end), size)
+        if not length:
+            # Nothing to send, e.g. bytes=-0 or an empty file
+            return None
+        return size - length, length
 
-class HTTPMonitorHandler(http.server.BaseHTTPRequestHandler):
+    start = int(start)
+    if start >= size:
+        return None
 
-    def __init__(self, monitor, new_handlers, *args, **kwargs):
-        self.monitor = monitor
+    end = min(int(end), size - 1) if end else size - 1
+    if end < start:
+        return None
 
-        self.handlers = {
-            "/stats": self._get_stats,
-            "/logs": self._get_logs,
-            "/logfile": self._get_logfile,
-        }
+    return start, end - start + 1
 
-        self.handlers.update(new_handlers)
 
-        paths = [
-            resource_filename(__name__, 'templates'),
-            'templates',
-            '/usr/local/cerebro/templates',
-            '/opt/tasksitter/templates/',
-            os.path.join(
-                os.getenv('HOME'),
-                'workspace',
-                'tasksitter',
-                'templates')]
+class FileResponse(object):
+    """
+    Returned by a handler to have a (part of a) file streamed to the
+    client straight from disk instead of being read into memory.
+    """
+    def __init__(self, filename, offset=0, length=None):
+        self.filename = filename
+        self.offset = offset
+        self.length = length
 
-        if hasattr(monitor.harness, "launch_location"):
-            paths.append(
-                os.path.join(monitor.harness.launch_location, "templates"))
 
-        tenjin.Engine.cache = tenjin.MemoryCacheStorage()
-        self.engine = tenjin.Engine(path=paths)
+class FollowResponse(object):
+    """
+    Returned by a handler to keep the connection open and push bytes
+    appended to a file from offset on (or from the end if offset is
+    None), as chunked text or as Server-Sent Events.
+    """
+    def __init__(self, filename, offset=None, events=False):
+        self.filename = filename
+        self.offset = offset
+        self.events = events
+
+
+def content_type(output, args):
+    """
+    Guess the Content-Type of a handler's output
+    """
+    if isinstance(output, bytes):
+        return 'application/octet-stream'
+    elif args.get('format') == 'json':
+        return 'application/json'
+    elif output.lstrip().startswith('<'):
+        return 'text/html; charset=utf-8'
+
+    return 'text/plain; charset=utf-8'
+
+
+class HTTPMonitorHandler(http.server.BaseHTTPRequestHandler):
+    # Keep connections open between requests
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately, don't let Nagle hold the
+    # body back waiting for an ACK
+    disable_nagle_algorithm = True
+    # Seconds an idle persistent connection is kept
+    timeout = 30
+    # Don't bother gzipping responses smaller than this many bytes
+    min_gzip_size = 512
+    # Seconds between size checks when following a file without inotify
+    follow_poll_interval = .5
+    # Seconds of silence before checking a following client is still there
+    follow_keepalive = 15
+
+    def __init__(self, monitor, *args, **kwargs):
+        # Built once per HTTPMonitor and shared by every request
+        self.monitor = monitor
+        self.handlers = monitor.handlers
+        self.engine = monitor.engine
 
         http.server.BaseHTTPRequestHandler.__init__(self, *args, **kwargs)
 
@@ -86,7 +205,7 @@ class HTTPMonitorHandler(http.server.BaseHTTPRequestHandler):
         return output
 
     def add_handler(self, path, callback):
-        self.handlers[path] = callback
+        self.monitor.add_handler(path, callback)
 
     def _get_logfile(self, args):
         # @TODO This is a bit of a security problem...
@@ -95,25 +214,66 @@ class HTTPMonitorHandler(http.server.BaseHTTPRequestHandler):
             if not 'logname' in args:
                 return "No filename specified"
 
-            logfiles = self.monitor.get_logs()
-            filename = logfiles[args['logname']]
+            filename = self.monitor.find_log(args['logname'])
+            if not filename:
+                return "No log named %s" % args['logname']
+
+        if not os.path.isfile(filename) and \
+                os.path.isfile("%s.gz" % filename):
+            # Compressed since it was listed
+            filename = "%s.gz" % filename
+
+        if not os.path.isfile(filename):
+            return "File not found"
 
-        filehandle = None
         try:
-            filehandle = open(filename)
+            if args.get('follow'):
+                if is_compressed(filename):
+                    return "Can't follow a compressed log"
+                return self._follow_response(filename, args)
+            elif args.get('tail'):
+                return tail(filename, int(args['tail']))
+            elif args.get('head'):
+                return head(filename, int(args['head']))
+
+            offset = int(args.get('offset', 0))
+            length = int(args['length']) if 'length' in args else None
+        except ValueError:
+            return "Invalid head, tail, offset or length"
         except IOError:
             return "File not found"
 
-        if not args.get('head') and not args.get('tail'):
-            return filehandle.read()
+        return FileResponse(filename, max(offset, 0), length)
 
-        if args.get('tail'):
-            return tail(filename, int(args['tail']))
-        else:
-            return head(filename, int(args['head']))
+    def _follow_response(self, filename, args):
+        """
+        follow=1 starts at offset, the last tail lines or the end of the
+        file.  format=sse sends Server-Sent Events, whose ids let a
+        reconnecting EventSource resume where it left off.
+        """
+        events = args.get('format') == 'sse'
+        offset = None
+        if events and self.headers.get('Last-Event-ID'):
+            offset = int(self.headers['Last-Event-ID'])
+        elif 'offset' in args:
+            offset = int(args['offset'])
+        elif args.get('tail'):
+            with open(filename, 'rb') as filehandle:
+                offset = tail_offset(filehandle, int(args['tail']))
+
+        return FollowResponse(filename, offset, events)
 
     def _get_logs(self, args):
-        logfiles = self.monitor.get_logs()
+        """
+        offset and limit page through the logs, newest first
+        """
+        try:
+            offset = int(args.get('offset', 0))
+            limit = int(args['limit']) if 'limit' in args else None
+        except ValueError:
+            return "Invalid offset or limit"
+
+        logfiles = self.monitor.get_logs(offset, limit)
         for k, v in list(logfiles.items()):
             size = 0
             try:
@@ -130,13 +290,255 @@ class HTTPMonitorHandler(http.server.BaseHTTPRequestHandler):
         else:
             return self.engine.render('logs.html', {'data': logfiles})
 
+    def _get_history(self, args):
+        """
+        Usage history for one metric (cpu, rss or vmem) after the unix
+        timestamp since.  format=binary returns packed doubles (see
+        history.to_binary), anything else compact JSON.
+        """
+        try:
+            since = float(args.get('since', 0))
+            resolution = int(args.get('resolution', 0))
+        except ValueError:
+            return "Invalid since or resolution"
+
+        data = self.monitor.get_history(args.get('metric', 'cpu'), since,
+                                        resolution)
+        if data is None:
+            return "No history for metric %s" % args.get('metric', 'cpu')
+
+        if args.get('format') == 'binary':
+            return history.to_binary(data)
+
+        # Sent as JSON whatever other format was asked for
+        args['format'] = 'json'
+        data['times'] = data['times'].tolist()
+        data['values'] = data['values'].tolist()
+        return simplejson.dumps(data, separators=(',', ':'))
+
     def _get_stats(self, args):
+        """
+        since=<version> returns only the stats which changed after that
+        version, see statsdelta.VersionedStats.get_delta
+        """
+        if 'since' in args:
+            return self.monitor.get_stats_delta(
+                statsdelta.parse_version(args['since']))
+
         stats = self.monitor.get_stats()
         if "nohtml" in args:
             return stats
         else:
             return self.engine.render('stats.html', {'data': stats})
 
+    def _send_file(self, response):
+        """
+        Stream a FileResponse to the client with sendfile, honouring a
+        Range header if the handler didn't ask for a specific slice.
+        """
+        if is_compressed(response.filename):
+            self._send_compressed(response)
+            return
+
+        try:
+            filehandle = open(response.filename, 'rb')
+        except IOError:
+            self.send_error(404)
+            return
+
+        with filehandle:
+            size = os.fstat(filehandle.fileno()).st_size
+            offset = min(response.offset, size)
+            length = size - offset
+            if response.length is not None:
+                length = min(response.length, length)
+
+            status = 200
+            range_header = self.headers.get('Range')
+            if range_header and not offset and response.length is None:
+                byte_range = parse_range(range_header, size)
+                if byte_range is None:
+                    self.send_response(416)
+                    self.send_header('Content-Range', 'bytes */%d' % size)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+
+                offset, length = byte_range
+                status = 206
+
+            self.send_response(status)
+            self.send_header('Content-Type', 'text/plain')
+            self.send_header('Content-Length', str(length))
+            self.send_header('Accept-Ranges', 'bytes')
+            if status == 206:
+                self.send_header('Content-Range', 'bytes %d-%d/%d' % (
+                    offset, offset + length - 1, size))
+            self.end_headers()
+
+            if length:
+                self._copy_file(filehandle, offset, length)
+
+    def _copy_file(self, filehandle, offset, length):
+        """
+        Send length bytes of filehandle from offset as the response body
+        """
+        # Falls back to plain reads where sendfile isn't available
+        self.connection.sendfile(filehandle, offset, length)
+
+    def _send_compressed(self, response):
+        """
+        Send a gzipped log as-is to clients which accept gzip, otherwise
+        decompress it on the fly.  Ranges aren't supported, but offset
+        and length are applied to the decompressed data.
+        """
+        whole_file = not response.offset and response.length is None
+        if whole_file and 'gzip' in self.headers.get('Accept-Encoding', ''):
+            try:
+                filehandle = open(response.filename, 'rb')
+            except IOError:
+                self.send_error(404)
+                return
+
+            with filehandle:
+                size = os.fstat(filehandle.fileno()).st_size
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain')
+                self.send_header('Content-Encoding', 'gzip')
+                self.send_header('Content-Length', str(size))
+                self.end_headers()
+                if size:
+                    self._copy_file(filehandle, 0, size)
+            return
+
+        try:
+            filehandle = open_log(response.filename)
+            filehandle.seek(response.offset)
+        except (IOError, OSError, EOFError):
+            self.send_error(404)
+            return
+
+        # The decompressed size isn't known up front, so end the body
+        # by closing the connection
+        self.close_connection = True
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+
+        with filehandle:
+            remaining = response.length
+            while remaining is None or remaining > 0:
+                read_size = READ_BLOCK_SIZE
+                if remaining is not None:
+                    read_size = min(read_size, remaining)
+                    remaining -= read_size
+
+                data = filehandle.read(read_size)
+                if not data:
+                    break
+                self.wfile.write(data)
+
+    def _write_chunk(self, data, chunked):
+        if chunked:
+            self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+        else:
+            self.wfile.write(data)
+
+    def _client_gone(self):
+        """
+        Check if the client closed its end without waiting on a write
+        """
+        readable, _, _ = select.select([self.connection], [], [], 0)
+        if not readable:
+            return False
+
+        try:
+            return not self.connection.recv(1, socket.MSG_PEEK)
+        except (IOError, OSError):
+            return True
+
+    def _follow_file(self, response):
+        """
+        Stream a FollowResponse until the client goes away or the
+        monitor stops.  A file that gets truncated or replaced (e.g.
+        rotated) is followed from its start.
+        """
+        try:
+            filehandle = open(response.filename, 'rb')
+        except IOError:
+            self.send_error(404)
+            return
+
+        # Chunked encoding needs HTTP/1.1; 1.0 clients just read to EOF
+        chunked = (not response.events and
+                   self.request_version == 'HTTP/1.1')
+        self.close_connection = True
+
+        self.send_response(200)
+        if response.events:
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Cache-Control', 'no-cache')
+        else:
+            self.send_header('Content-Type', 'text/plain')
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+
+        watcher = filewatch.FileWatcher(response.filename,
+                                        self.follow_poll_interval)
+        inode = os.fstat(filehandle.fileno()).st_ino
+        offset = response.offset
+        if offset is None:
+            offset = os.fstat(filehandle.fileno()).st_size
+        last_write = time.time()
+
+        try:
+            while not self.monitor.stopped:
+                state = filewatch.file_state(response.filename)
+                if state and state[0] != inode:
+                    filehandle.close()
+                    filehandle = open(response.filename, 'rb')
+                    inode = state[0]
+                    offset = 0
+                    watcher.watch()
+                elif state and state[1] < offset:
+                    offset = 0
+
+                filehandle.seek(offset)
+                data = filehandle.read(READ_BLOCK_SIZE)
+                if data:
+                    offset += len(data)
+                    if response.events:
+                        if data.endswith(b'\n'):
+                            data = data[:-1]
+                        data = b''.join([b'data: %s\n' % line for line in
+                                         data.split(b'\n')])
+                        data = b'id: %d\n%s\n' % (offset, data)
+                    self._write_chunk(data, chunked)
+                    last_write = time.time()
+                    continue
+
+                if time.time() - last_write > self.follow_keepalive:
+                    if self._client_gone():
+                        break
+                    if response.events:
+                        # Stops proxies timing the stream out
+                        self._write_chunk(b': keepalive\n\n', chunked)
+                    last_write = time.time()
+
+                watcher.wait(self.follow_poll_interval)
+
+            if chunked:
+                self.wfile.write(b'0\r\n\r\n')
+        except (IOError, OSError):
+            # The client hung up
+            pass
+        finally:
+            watcher.close()
+            filehandle.close()
+
     def _format_dict(self, data, args):
         """
         Convert a dictionary of data into an appropriate
@@ -166,88 +568,215 @@ class HTTPMonitorHandler(http.server.BaseHTTPRequestHandler):
 
         return output
 
-    def do_GET(self):
-        urldata = urllib.parse.urlparse(self.path)
-        array_args = urllib.parse.parse_qs(urldata.query)
-        args = dict([(k, v[0]) for k, v in list(array_args.items())])
-
-        if not urldata.path in self.handlers:
-            self.wfile.write(self._usage(args))
+    def _send_output(self, output, args, status=200):
+        """
+        Send a handler's output as a complete response, gzipped if the
+        client accepts it.  Content-Length lets the connection be reused.
+        """
+        if not output:
+            output = "No Data"
+
+        if isinstance(output, dict):
+            output = self._format_dict(output, args)
+            if args.get('compress'):
+                # Old clients zlib.decompress() the body themselves
+                output = zlib.compress(output.encode('utf-8'))
+
+        mimetype = content_type(output, args)
+        if not isinstance(output, bytes):
+            output = output.encode('utf-8')
+
+        encoding = None
+        if (len(output) >= self.min_gzip_size and not args.get('compress') and
+                'gzip' in self.headers.get('Accept-Encoding', '')):
+            output = gzip.compress(output, 6)
+            encoding = 'gzip'
+
+        self.send_response(status)
+        self.send_header('Content-Type', mimetype)
+        self.send_header('Content-Length', str(len(output)))
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('Vary', 'Accept-Encoding')
+        self.end_headers()
+        self.wfile.write(output)
+
+    def _handle(self, path, args):
+        if not path in self.handlers:
+            self._send_output(self._usage(args), args,
+                              200 if path == '/' else 404)
             return
 
         args['engine'] = self.engine
 
         try:
-            output = self.handlers[urldata.path](args)
-            if not output:
-                output = "No Data"
-
-            if isinstance(output, dict):
-                output = self._format_dict(output, args)
-                if args.get('compress'):
-                    output = zlib.compress(output)
-
-                self.wfile.write(output)
+            output = self.handlers[path](self, args)
+            if isinstance(output, FileResponse):
+                self._send_file(output)
+            elif isinstance(output, FollowResponse):
+                self._follow_file(output)
             else:
-                self.wfile.write(output)
+                self._send_output(output, args)
         except:
             import traceback
-            self.wfile.write(traceback.format_exc())
+            error = traceback.format_exc()
+            # We may be part way through a response already
+            self.close_connection = True
+            try:
+                self._send_output(error, {}, 500)
+            except (IOError, OSError):
+                pass
+
+    def do_GET(self):
+        urldata = urllib.parse.urlparse(self.path)
+        array_args = urllib.parse.parse_qs(urldata.query)
+        args = dict([(k, v[0]) for k, v in list(array_args.items())])
 
-        return
+        self._handle(urldata.path, args)
 
     def do_POST(self):
         urldata = urllib.parse.urlparse(self.path)
-        ctype, pdict = cgi.parse_header(self.headers.getheader('content-type'))
+        ctype, pdict = cgi.parse_header(
+            self.headers.get('content-type', ''))
+
+        # Always read the body, or it would be taken for the next request
+        length = int(self.headers.get('content-length', 0))
+        body = self.rfile.read(length)
+
+        args = {}
         if ctype == 'application/x-www-form-urlencoded':
-            length = int(self.headers.getheader('content-length'))
             try:
-                args = cgi.parse_qs(self.rfile.read(length),
-                                    keep_blank_values=1)
+                args = urllib.parse.parse_qs(body.decode('utf-8'),
+                                             keep_blank_values=1)
                 args = simplejson.loads(args['data'][0])
             except:
                 import traceback
                 traceback.print_exc()
-                self.wfile.write("Error decoding POST data")
-                return traceback.format_exc()
-        else:
-            args = {}
+                self._send_output("Error decoding POST data", {}, 400)
+                return
 
-        if not urldata.path in self.handlers:
-            self.wfile.write(self._usage(args))
-            return
+        self._handle(urldata.path, args)
 
-        args['engine'] = self.engine
 
-        self.wfile.write(self.handlers[urldata.path](args))
+class BufferedMonitorHandler(HTTPMonitorHandler):
+    """
+    Handle a single request which the asyncio server has already read,
+    buffering the response for the event loop to write.
+
+    Afterwards output holds the response, keep_alive whether the
+    connection can be reused and file_transfer any (filename, offset,
+    length) the event loop should then send from disk.
+    """
+    def setup(self):
+        self.connection = None
+        self.rfile = io.BytesIO(self.request)
+        self.wfile = io.BytesIO()
+        self.file_transfer = None
+
+    def handle(self):
+        self.handle_one_request()
+        self.keep_alive = not self.close_connection
 
-        return
+    def finish(self):
+        self.output = self.wfile.getvalue()
+
+    def _copy_file(self, filehandle, offset, length):
+        self.file_transfer = (filehandle.name, offset, length)
+
+    def _follow_file(self, response):
+        # Following would hold one of the pool's threads indefinitely
+        self.send_error(501, "follow=1 is only supported by the threaded "
+                        "HTTP server")
 
 
 class ThreadedTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
-    pass
+    # Followed logs hold their thread open, don't let them block exit
+    daemon_threads = True
+    # socketserver's default listen backlog of 5 drops connections (which
+    # the client retries seconds later) as soon as a few arrive together
+    request_queue_size = 128
 
 
 class HTTPMonitor(object):
-    def __init__(self, stats, harness, port):
+    """
+    reload_templates: check template mtimes (at most once a second) and
+    recompile changed ones, for development.  Otherwise templates are
+    compiled once and never looked at again.
+
+    use_asyncio: serve from an asyncio event loop (see
+    async_http.AsyncHTTPServer) instead of a thread per connection.
+    Handlers then run in a pool of max_workers threads, and at most
+    max_connections connections are accepted at once.
+    """
+    def __init__(self, stats, harness, port, reload_templates=False,
+                 use_asyncio=False, max_workers=8, max_connections=1000):
         self.port = int(port)
         self.stats = stats
         self.harness = harness
         self.logmanager = harness.logmanager
+        self.use_asyncio = use_asyncio
+        self.max_workers = max_workers
+        self.max_connections = max_connections
         self.httpd = None
         self.stopped = False
         self.run_thread = None
-        self.new_handlers = {}
+
+        # path -> callback(HTTPMonitorHandler, args)
+        self.handlers = {
+            "/stats": HTTPMonitorHandler._get_stats,
+            "/logs": HTTPMonitorHandler._get_logs,
+            "/logfile": HTTPMonitorHandler._get_logfile,
+        }
+        # Only the tasksitter records usage history, see
+        # StatsCollector.start
+        if stats.history is not None:
+            self.handlers["/history"] = HTTPMonitorHandler._get_history
+
+        self.engine = self.build_engine(reload_templates)
+        self.stats_versions = statsdelta.VersionedStats()
+
+    def build_engine(self, reload_templates=False):
+        paths = [
+            resource_filename(__name__, 'templates'),
+            'templates',
+            '/usr/local/cerebro/templates',
+            '/opt/tasksitter/templates/',
+            os.path.join(
+                os.getenv('HOME', ''),
+                'workspace',
+                'tasksitter',
+                'templates')]
+
+        if hasattr(self.harness, "launch_location"):
+            paths.append(
+                os.path.join(self.harness.launch_location, "templates"))
+
+        # Compiled templates are kept in memory, not in .cache files
+        # next to the templates
+        engine = tenjin.Engine(path=paths, cache=tenjin.MemoryCacheStorage())
+        if not reload_templates:
+            engine.timestamp_interval = float('inf')
+
+        return engine
 
     def add_handler(self, path, callback):
-        self.new_handlers[path] = callback
+        """
+        Serve path with callback(args).  Can be called at any time.
+        """
+        self.handlers[path] = lambda _, args: callback(args)
 
-    def get_logs(self):
+    def get_logs(self, offset=0, limit=None):
         """
         Pull a list of logfiles for all of the tasks
         that this tasksitter has created.
         """
-        return self.logmanager.get_logfile_names()
+        return self.logmanager.get_logfile_names(offset, limit)
+
+    def find_log(self, name):
+        """
+        Return the filename of the log called name, or None
+        """
+        return self.logmanager.find_logfile(name)
 
     def get_stats(self):
         """
@@ -257,6 +786,19 @@ class HTTPMonitor(object):
         data.update(self.stats.get_live_data())
         return data
 
+    def get_stats_delta(self, since=None):
+        """
+        Return the stats which changed after version since
+        """
+        return self.stats_versions.get_delta(self.get_stats(), since)
+
+    def get_history(self, metric, since=0, resolution=None):
+        """
+        Return usage history for the process, or None for an unknown
+        metric or resolution
+        """
+        return self.stats.history.get(metric, since, resolution)
+
     def start(self):
         """
         Begin serving HTTP requests with stats data
@@ -281,9 +823,15 @@ class HTTPMonitor(object):
         """
         Internal method to start the server.
         """
-        handler = lambda x, y, z: HTTPMonitorHandler(
-            self,
-            self.new_handlers, x, y, z)
-        self.httpd = ThreadedTCPServer(('', self.port), handler)
-        self.httpd.timeout = 1
+        if self.use_asyncio:
+            handler = lambda x, y, z: BufferedMonitorHandler(self, x, y, z)
+            self.httpd = async_http.AsyncHTTPServer(
+                ('', self.port), handler,
+                max_workers=self.max_workers,
+                max_connections=self.max_connections)
+        else:
+            handler = lambda x, y, z: HTTPMonitorHandler(self, x, y, z)
+            self.httpd = ThreadedTCPServer(('', self.port), handler)
+            self.httpd.timeout = 1
+
         self.httpd.serve_forever(poll_interval=0.1)
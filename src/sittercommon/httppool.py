@@ -0,0 +1,107 @@
+"""
+Reuse HTTP connections to sitters between requests
+"""
+import collections
+import threading
+import urllib.parse
+
+import requests
+import requests.adapters
+from urllib3.util.retry import Retry
+
+
+class SessionPool(object):
+    """
+    A requests Session per host:port, each keeping up to max_connections
+    connections alive for reuse.
+
+    timeout: seconds to wait to connect and for each read, unless the
+    caller gives its own.
+
+    retries, backoff: failed connection attempts are retried up to
+    retries times, sleeping backoff, 2 * backoff, ... seconds in between.
+    Requests which reached the server are never retried, as GETs to the
+    sitters can start and stop tasks.
+
+    max_sessions: sessions kept at most.  Beyond that the least recently
+    used is closed, so the sessions of tasksitters which since moved to
+    another port don't pile up.
+    """
+    def __init__(self, max_connections=4, timeout=5, retries=2,
+                 backoff=.1, max_sessions=4096):
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_sessions = max_sessions
+        # Least recently used first
+        self.sessions = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def session(self, url):
+        """
+        Return: the Session for url's host:port
+        """
+        parsed = urllib.parse.urlsplit(url)
+        key = "%s://%s" % (parsed.scheme, parsed.netloc)
+        evicted = []
+        with self.lock:
+            session = self.sessions.get(key)
+            if session is None:
+                session = self.sessions[key] = self.build_session()
+                while len(self.sessions) > self.max_sessions:
+                    evicted.append(self.sessions.popitem(last=False)[1])
+            else:
+                self.sessions.move_to_end(key)
+
+        for old in evicted:
+            # Requests in flight on it still finish
+            old.close()
+
+        return session
+
+    def build_session(self):
+        retry = Retry(total=self.retries, connect=self.retries, read=0,
+                      status=0, other=0, redirect=0,
+                      backoff_factor=self.backoff,
+                      raise_on_status=False)
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=self.max_connections,
+            max_retries=retry)
+
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def get(self, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session(url).get(url, **kwargs)
+
+    def post(self, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session(url).post(url, **kwargs)
+
+    def get_stats(self):
+        """
+        Returns: a dict of
+          hosts: how many hosts have a session
+          hits: requests sent over a connection that was already open
+          misses: requests which had to open a new connection
+        """
+        with self.lock:
+            sessions = list(self.sessions.values())
+
+        requests_sent = connections = 0
+        for session in sessions:
+            for adapter in set(session.adapters.values()):
+                pools = adapter.poolmanager.pools
+                for key in list(pools.keys()):
+                    pool = pools.get(key)
+                    if pool is not None:
+                        requests_sent += pool.num_requests
+                        connections += pool.num_connections
+
+        return {'hosts': len(sessions),
+                'hits': requests_sent - connections,
+                'misses': connections}
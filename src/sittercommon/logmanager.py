@@ -1,18 +1,77 @@
 """
 Manage the various logging facilities for a child process.
 """
-import md5
+import ctypes
+import gzip
+import hashlib
 import os
 import random
+import re
+import shutil
+import sys
+import threading
+import time
+
+
+# fallocate() mode removing a range of whole blocks from a file, see
+# fallocate(2)
+FALLOC_FL_COLLAPSE_RANGE = 0x08
+
+
+def collapse_range(fd, length):
+    """
+    Cut the first length bytes, a whole number of blocks, out of the file
+    open as fd.  Appends racing with it go after what's left.
+
+    Returns: False if the kernel or filesystem can't
+    """
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        result = libc.fallocate(fd, FALLOC_FL_COLLAPSE_RANGE,
+                                ctypes.c_longlong(0),
+                                ctypes.c_longlong(length))
+    except (OSError, AttributeError):
+        # Not linux
+        return False
+
+    return result == 0
+
+
+def copy_bytes(source, dest, length):
+    while length > 0:
+        data = source.read(min(length, 1024 * 1024))
+        if not data:
+            break
+        dest.write(data)
+        length -= len(data)
 
 
 class LogManager(object):
     """
-    An object to manage logging facilities for the child
+    An object to manage logging facilities for the child.
+
+    Every start of the child writes to a new segment.  When a byte budget
+    or retention is configured, maintain() (run every maintain_interval
+    seconds once start() is called) also:
+      - splits the live segment once it grows past max_segment_bytes
+      - gzips segments which are no longer being written to
+      - deletes the oldest segments beyond max_segments, max_bytes or
+        max_age seconds
     """
-    def __init__(self, stdout_location='-', stderr_location='-'):
+    # Don't list more than this many segments unless asked to
+    max_listed = 100
+    maintain_interval = 10
+
+    def __init__(self, stdout_location='-', stderr_location='-',
+                 max_bytes=None, max_segment_bytes=None, max_segments=None,
+                 max_age=None, compress=True):
         self.stdout_location = stdout_location
         self.stderr_location = stderr_location
+        self.max_bytes = max_bytes
+        self.max_segment_bytes = max_segment_bytes
+        self.max_segments = max_segments
+        self.max_age = max_age
+        self.compress = compress
 
         # Enable others to write to the log locations incase the child
         # Process is run as another user.
@@ -22,6 +81,10 @@ class LogManager(object):
             os.system("chmod o+rwx %s" % stderr_location)
         self.harness = None
         self.extra_logfiles = {}
+        # Names logs consistently when there's no harness to name them by
+        self.salt = str(random.random())
+        self.thread = None
+        self.should_stop = False
 
     def set_harness(self, harness):
         self.harness = harness
@@ -43,62 +106,248 @@ class LogManager(object):
         self.setup_stdout()
         self.setup_stderr()
 
+    def open_segment(self, filename):
+        """
+        Open a fresh segment for the child to write to.  It's opened for
+        appending so maintain() can cut it under the writer.
+        """
+        return os.open(filename,
+                       os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_APPEND,
+                       0o666)
+
     def setup_stdout(self):
         if self.stdout_location != '-':
-            stdout = open(self._calculate_filename(self.stdout_location),
-                          'w')
-            stdout_fileno = stdout.fileno()
+            stdout_fileno = self.open_segment(
+                self._calculate_filename(self.stdout_location))
             os.dup2(stdout_fileno, 1)
+            os.close(stdout_fileno)
 
     def setup_stderr(self):
         if self.stderr_location != '-':
-            stderr = open(self._calculate_filename(self.stderr_location,
-                                                   True),
-                          'w')
-            stderr_fileno = stderr.fileno()
+            stderr_fileno = self.open_segment(
+                self._calculate_filename(self.stderr_location, True))
             os.dup2(stderr_fileno, 2)
+            os.close(stderr_fileno)
+
+    def get_streams(self):
+        """
+        Return: a list of (stream name, directory, is stderr) for every
+        stream written to files
+        """
+        streams = []
+        if self.stdout_location != "-":
+            streams.append(("stdout", self.stdout_location, False))
+        if self.stderr_location != "-":
+            streams.append(("stderr", self.stderr_location, True))
 
-    def get_logfile_names(self):
-        filenames = {}
-        for i in range(self.harness.start_count):
-            if self.stdout_location != "-":
-                filenames["stdout.%d" % i] = self._calculate_filename(
-                    self.stdout_location,
-                    False,
-                    str(i))
-
-            if self.stderr_location != "-":
-                filenames["stderr.%d" % i] = self._calculate_filename(
-                    self.stderr_location,
-                    True,
-                    str(i))
+        return streams
+
+    def get_segments(self, directory, stderr=False):
+        """
+        Find every segment of a stream on disk.
+
+        Returns: a list of (start number, part, filename), oldest first.
+        part is None for the segment a start wrote to directly, or the
+        number of a piece split off it by maintain().
+        """
+        pattern = re.compile(r'^%s\.(\d+)(?:\.(\d+))?(?:\.gz)?$' %
+                             self._hash(stderr))
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            return []
+
+        segments = []
+        for name in names:
+            match = pattern.match(name)
+            if not match:
+                continue
+
+            part = match.group(2)
+            segments.append((int(match.group(1)),
+                             int(part) if part is not None else None,
+                             os.path.join(directory, name)))
+
+        # Split off pieces are older than what's left in their segment
+        segments.sort(key=lambda segment: (
+            segment[0], segment[1] if segment[1] is not None else
+            float('inf')))
+        return segments
+
+    def get_logfile_names(self, offset=0, limit=None):
+        """
+        List the segments of the child's logs, newest first, plus any
+        extra logfiles.
+
+        offset, limit: page through the segments.  At most max_listed
+        are returned if no limit is given.
+        """
+        if limit is None:
+            limit = self.max_listed
+
+        segments = []
+        for stream, directory, stderr in self.get_streams():
+            for number, part, filename in self.get_segments(directory,
+                                                            stderr):
+                name = "%s.%d" % (stream, number)
+                if part is not None:
+                    name += ".%d" % part
+                segments.append(((number, part is None, part or 0),
+                                 name, filename))
+
+        segments.sort(reverse=True)
+        filenames = dict([(name, filename) for _, name, filename in
+                          segments[offset:offset + limit]])
 
         filenames.update(self.extra_logfiles)
         return filenames
 
-    def _calculate_filename(self, directory, stderr=False,
-                            number=None):
-        if not os.path.exists(directory):
-            os.makedirs(directory)
+    def find_logfile(self, name):
+        """
+        Return the filename of the log called name (as listed by
+        get_logfile_names, on any page), or None
+        """
+        if name in self.extra_logfiles:
+            return self.extra_logfiles[name]
 
-        filenum = number
-        if not number and self.harness:
-            filenum = self.harness.start_count
+        return self.get_logfile_names(0, sys.maxsize).get(name)
+
+    def split_segment(self, segments):
+        """
+        Move the contents of the live segment into a new piece.  The
+        writer opened it for appending, so it carries on at the end of
+        whatever is left.
+
+        Whole blocks are copied and then cut from the front of the live
+        segment, leaving less than a block, so nothing written meanwhile
+        is lost.  On filesystems which can't cut a file the live segment
+        is copied and truncated instead, losing anything written in
+        between.
+        """
+        number, _, filename = segments[-1]
+        part = max([seg[1] or 0 for seg in segments
+                    if seg[0] == number] + [0]) + 1
+        piece = "%s.%d" % (filename, part)
+        with open(filename, 'rb+') as live:
+            stat = os.fstat(live.fileno())
+            length = stat.st_size - stat.st_size % stat.st_blksize
+            if not length:
+                return
+
+            with open(piece, 'wb') as dest:
+                copy_bytes(live, dest, length)
+                dest.flush()
+                if not collapse_range(live.fileno(), length):
+                    shutil.copyfileobj(live, dest)
+                    live.truncate(0)
+
+        segments.insert(-1, (number, part, piece))
+
+    def compress_segment(self, filename):
+        """
+        Returns: the name of the compressed segment
+        """
+        compressed = "%s.gz" % filename
+        tmpname = "%s.tmp" % compressed
+        with open(filename, 'rb') as source:
+            with gzip.open(tmpname, 'wb') as dest:
+                shutil.copyfileobj(source, dest)
+
+        os.rename(tmpname, compressed)
+        os.unlink(filename)
+        return compressed
+
+    def has_limits(self):
+        return bool(self.max_bytes or self.max_segment_bytes or
+                    self.max_segments or self.max_age)
+
+    def maintain(self):
+        """
+        Split, compress and expire segments, see the class docstring.
+        Without any limits configured segments are left as they are.
+        """
+        if not self.has_limits():
+            return
+
+        now = time.time()
+        for _, directory, stderr in self.get_streams():
+            segments = self.get_segments(directory, stderr)
+            if not segments:
+                continue
+
+            # The newest segment is the one being written to
+            live = segments[-1]
+            if (self.max_segment_bytes and live[1] is None and
+                    os.path.getsize(live[2]) > self.max_segment_bytes):
+                self.split_segment(segments)
+
+            old = []
+            for number, part, filename in segments[:-1]:
+                if self.compress and not filename.endswith(".gz"):
+                    filename = self.compress_segment(filename)
+                old.append(filename)
+
+            # Expire from the oldest, always keeping the live segment
+            total = sum([os.path.getsize(filename) for filename in old] +
+                        [os.path.getsize(live[2])])
+            count = len(segments)
+            for filename in old:
+                stat = os.stat(filename)
+                if ((self.max_segments and count > self.max_segments) or
+                        (self.max_bytes and total > self.max_bytes) or
+                        (self.max_age and
+                         now - stat.st_mtime > self.max_age)):
+                    os.unlink(filename)
+                    total -= stat.st_size
+                    count -= 1
 
-        parent_pid = os.getpid()
+    def start(self):
+        """
+        Run maintain() in the background
+        """
+        self.thread = threading.Thread(target=self._run,
+                                       name="LogManager")
+        self.thread.daemon = True
+        self.thread.start()
 
+    def stop(self):
+        self.should_stop = True
+
+    def _run(self):
+        while not self.should_stop:
+            try:
+                self.maintain()
+            except (IOError, OSError):
+                import traceback
+                traceback.print_exc()
+
+            time.sleep(self.maintain_interval)
+
+    def _hash(self, stderr=False):
         if self.harness:
             payload = self.harness.command
             parent_pid = self.harness.parent_pid
         else:
-            payload = str(random.random())
+            payload = self.salt
+            parent_pid = os.getpid()
 
         payload += str(parent_pid)
 
         if stderr:
             payload += "err"
 
+        return hashlib.md5(payload.encode('utf-8')).hexdigest()
+
+    def _calculate_filename(self, directory, stderr=False,
+                            number=None):
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        filenum = number
+        if not number and self.harness:
+            filenum = self.harness.start_count
+
         name = "%s/%s.%s" % (directory,
-                             md5.md5(payload).hexdigest(),
+                             self._hash(stderr),
                              filenum)
         return name
@@ -1,21 +1,117 @@
+import concurrent.futures
 import logging
+import os
 import re
-import requests
 import simplejson
 import _thread
 import threading
 import time
 import urllib.request, urllib.parse, urllib.error
 
+from sittercommon import httppool
+from sittercommon import statsdelta
+
 logger = logging.getLogger(__name__)
 
+# Shared by every MachineData for fetching tasksitter stats from machines
+# without /all_stats.  Workers are only started as they're needed.
+TASK_STATS_WORKERS = 16
+task_stats_pool = concurrent.futures.ThreadPoolExecutor(TASK_STATS_WORKERS)
+
+# Connections to sitters, shared by every MachineData
+http_pool = httppool.SessionPool()
+
+# Probes of the ports a machinesitter might be on, shared by every
+# MachineData
+PORT_PROBE_WORKERS = 64
+port_probe_pool = concurrent.futures.ThreadPoolExecutor(PORT_PROBE_WORKERS)
+
+
+class PortCache(object):
+    """
+    The port each host's machinesitter was last found on.  Once load()ed
+    from a file, changes are written back to it within save_interval
+    seconds, so a restarted clustersitter looks there first too.
+    """
+    save_interval = 5
+
+    def __init__(self):
+        self.ports = {}
+        self.filename = None
+        self.lock = threading.Lock()
+        self.save_timer = None
+
+    def load(self, filename):
+        with self.lock:
+            self.filename = filename
+            try:
+                with open(filename) as fd:
+                    self.ports.update(simplejson.loads(fd.read()))
+            except (IOError, ValueError):
+                pass
+
+    def get(self, hostname):
+        return self.ports.get(hostname)
+
+    def set(self, hostname, port):
+        with self.lock:
+            if self.ports.get(hostname) == port:
+                return
+
+            self.ports[hostname] = port
+            if self.filename and not self.save_timer:
+                # Finding many machines at once only writes the file once
+                self.save_timer = threading.Timer(self.save_interval,
+                                                  self.save)
+                self.save_timer.daemon = True
+                self.save_timer.start()
+
+    def save(self):
+        with self.lock:
+            self.save_timer = None
+            if not self.filename:
+                return
+
+            temp = "%s.tmp" % self.filename
+            try:
+                with open(temp, 'w') as fd:
+                    fd.write(simplejson.dumps(self.ports))
+                os.rename(temp, self.filename)
+            except (IOError, OSError):
+                logger.warn("Couldn't save machinesitter ports to %s" %
+                            self.filename)
+
+
+# Shared by every MachineData
+port_cache = PortCache()
+
 
 class MachineData(object):
+    # Seconds reload() waits for tasksitters to send their stats
+    task_stats_deadline = 10
+    # How many ports from starting_port a machinesitter might be on
+    port_range = 16
+    # Seconds to wait for each of them to answer
+    probe_timeout = 2
+
     def __init__(self, hostname, starting_port):
         self.hostname = hostname
         self.portnum = None
         self.starting_port = starting_port
         self.url = ""
+        # Whether the machinesitter serves /all_stats
+        self.batched_stats = True
+        # Our copy of /all_stats, as of stats_version
+        self.all_stats = {}
+        self.stats_version = None
+        # Held while all_stats is changed, pushes arrive on other threads,
+        # and while looking for the machinesitter again
+        self.lock = threading.Lock()
+        self.last_reload = 0
+        # When the machinesitter last pushed stats, and how often it
+        # promised to
+        self.last_push = 0
+        self.heartbeat_interval = None
         self._find_portnum()
         self.tasks = {}
         self.metadata = {}
@@ -23,41 +119,85 @@ class MachineData(object):
                                                 self.portnum))
 
     def _find_portnum(self):
-        found = False
-        port = self.starting_port
-        while not found:
-            try:
-                logger.info("Attempting to connect to %s" % (
-                        "%s:%s" % (self.hostname, port)))
-
-                # Verify we can actually make an http request
-                req = requests.get("http://%s:%s" % (self.hostname,
-                                                     port),
-                                   timeout=2)
-                if not req.content:
-                    raise Exception("No content recieved!")
-
-                found = True
-                self.portnum = port
-                logger.info("Successfully connected to %s:%s" % (
-                    self.hostname, self.portnum))
-            except:
-                import traceback
-                logger.warn("Failed to connect to %s:%s" % (
-                    self.hostname, port))
-                logger.warn(traceback.format_exc().splitlines()[-1])
-                port += 1
-                if port > self.starting_port + 15:
-                    self.url = ""
-                    self.portnum = None
-                    return
+        port = self._find_sitter()
+        if port is None:
+            logger.warn("Couldn't find a machinesitter on %s:%s-%s" % (
+                self.hostname, self.starting_port,
+                self.starting_port + self.port_range - 1))
+            self.url = ""
+            self.portnum = None
+            return
+
+        self.portnum = port
+        # Might be a different machinesitter than before
+        self.batched_stats = True
+        self.stats_version = None
+        port_cache.set(self.hostname, port)
+        logger.info("Successfully connected to %s:%s" % (
+            self.hostname, self.portnum))
 
         self.url = "http://%s:%s" % (self.hostname,
                                      self.portnum)
         return self.url
 
-    def _make_request(self, function, path, host=None, async=False):
-        if not async:
+    def _refind_portnum(self, failed_url):
+        """
+        Look for the machinesitter again after a request to failed_url
+        failed, unless another thread already has.
+        """
+        with self.lock:
+            if self.url == failed_url:
+                self._find_portnum()
+
+    def _find_sitter(self):
+        """
+        Try the port the machinesitter was last found on, then all the
+        others at once.
+
+        Returns: the lowest port a machinesitter answers on, or None
+        """
+        cached = port_cache.get(self.hostname)
+        if cached is not None and self._probe_port(cached):
+            return cached
+
+        probes = [(port, port_probe_pool.submit(self._probe_port, port))
+                  for port in range(self.starting_port,
+                                    self.starting_port + self.port_range)
+                  if port != cached]
+        try:
+            for port, probe in probes:
+                if probe.result():
+                    return port
+        finally:
+            for port, probe in probes:
+                probe.cancel()
+
+        return None
+
+    def _probe_port(self, port):
+        """
+        Returns: True if a machinesitter answers on port
+        """
+        logger.info("Attempting to connect to %s:%s" % (self.hostname, port))
+        url = "http://%s:%s/" % (self.hostname, port)
+        try:
+            response = http_pool.get(url + "identify?format=json",
+                                     timeout=self.probe_timeout)
+            if response.status_code == 404:
+                # An older machinesitter, /stats says the same
+                response = http_pool.get(url + "stats?nohtml=1&format=json",
+                                         timeout=self.probe_timeout)
+            data = simplejson.loads(response.content)
+        except Exception as e:
+            logger.info("Failed to connect to %s:%s: %s" % (
+                self.hostname, port, e))
+            return False
+
+        # Whatever else might be listening won't say this
+        return isinstance(data, dict) and 'machinesitter_pid' in data
+
+    def _make_request(self, function, path, host=None, background=False):
+        if not background:
             return self.__make_request(function, path, host)
         else:
             _thread.start_new_thread(self.__make_request,
@@ -65,21 +205,20 @@ class MachineData(object):
 
     def __make_request(self, function, path, host):
         val = None
+        url = self.url
         hostname = host
         if not hostname:
-            hostname = self.url
+            hostname = url
 
         try:
-            val = function("%s/%s" % (hostname, path),
-                           timeout=5)
+            val = function("%s/%s" % (hostname, path))
         except:
-            self._find_portnum()
-            hostname = host
-            if not hostname:
+            if not host:
+                # A tasksitter failing says nothing about the machinesitter
+                self._refind_portnum(url)
                 hostname = self.url
             try:
-                val = function("%s/%s" % (hostname, path),
-                               timeout=5)
+                val = function("%s/%s" % (hostname, path))
             except:
                 logger.warn("Couldn't execute %s/%s!" % (
                     hostname, path))
@@ -90,7 +229,7 @@ class MachineData(object):
         return val
 
     def load_generic_page(self, host, page):
-        response = self._make_request(requests.get,
+        response = self._make_request(http_pool.get,
                                       path="%s?nohtml=1&format=json" % page,
                                       host=host)
         if not response:
@@ -99,14 +238,145 @@ class MachineData(object):
         data = simplejson.loads(response.content)
         return data
 
-    def reload(self):
-        response = self._make_request(requests.get,
-                                      path="stats?nohtml=1&format=json")
-        if not response:
+    def load_all_stats(self):
+        """
+        Fetch the machinesitter's stats and the stats of all its running
+        tasks in one request.  Only what changed since the last call is
+        sent, if the machinesitter supports it.
+
+        Returns: (machine stats, {task name: stats}), (None, None) if the
+        machinesitter doesn't serve /all_stats, or None if the request
+        failed
+        """
+        path, since = self.all_stats_request()
+        response = self._make_request(http_pool.get, path=path)
+        if response is None:
             return None
 
-        data = simplejson.loads(response.content)
+        return self.parse_all_stats(response.status_code, response.content,
+                                    since)
+
+    def all_stats_request(self):
+        """
+        Returns: (path, since) of the next /all_stats request
+        """
+        # Anything older than the machinesitter's first version gets the
+        # full stats
+        since = self.stats_version or 0
+        return "all_stats?format=json&since=%s" % since, since
+
+    def parse_all_stats(self, status, content, since):
+        """
+        Read the answer to the request from all_stats_request().
+
+        Returns: (machine stats, {task name: stats}), or (None, None) if
+        the machinesitter doesn't serve /all_stats
+        """
+        try:
+            if status == 404:
+                raise ValueError("Not found")
+
+            data = simplejson.loads(content)
+            if 'version' not in data:
+                return data['machine'], data['tasks']
+
+            self.apply_stats(data, since)
+            return self.get_all_stats()
+        except (ValueError, KeyError, TypeError):
+            # An older machinesitter, ask each task for its stats instead
+            logger.info("%s doesn't serve /all_stats" % self.url)
+            self.batched_stats = False
+            return None, None
+
+    def apply_stats(self, delta, since=None):
+        """
+        Apply a delta from /all_stats?since= or a push to our copy.
+
+        since: the version delta was worked out from
+
+        Returns: False if delta only applies on top of stats we don't have
+        """
+        with self.lock:
+            if (self.stats_version is not None and
+                    delta['version'] < self.stats_version):
+                # We've already had newer stats from a push or reload
+                return True
+
+            if not delta['full'] and (
+                    since is None or self.stats_version is None or
+                    since > self.stats_version):
+                return False
+
+            self.all_stats = statsdelta.apply_delta(self.all_stats, delta)
+            self.stats_version = delta['version']
+            return True
+
+    def get_all_stats(self):
+        """
+        Returns: a copy of (machine stats, {task name: stats}) as last
+        loaded or pushed
+        """
+        with self.lock:
+            tasks = self.all_stats.get('tasks', {})
+            return (dict(self.all_stats.get('machine', {})),
+                    dict([(name, dict(stats))
+                          for name, stats in tasks.items()]))
+
+    def receive_push(self, push):
+        """
+        Apply stats pushed by the machinesitter, see
+        machinesitter.statspusher.
+
+        Returns: False if the machinesitter needs to push everything
+        """
+        if not self.apply_stats(push['delta'], push.get('since')):
+            return False
+
+        self.last_push = time.time()
+        self.heartbeat_interval = push.get('heartbeat_interval')
+        self.update_tasks(*self.get_all_stats())
+        return True
+
+    def needs_pull(self, reconcile_interval):
+        """
+        Whether stats should be polled: the machinesitter isn't pushing
+        them, has missed two heartbeats, or it's been reconcile_interval
+        seconds since the last reload().
+        """
+        now = time.time()
+        if (not self.heartbeat_interval or
+                now - self.last_push > 2 * self.heartbeat_interval):
+            return True
+
+        return now - self.last_reload >= reconcile_interval
+
+    def reload(self):
+        data = task_stats = None
+        if self.batched_stats:
+            result = self.load_all_stats()
+            if result is None:
+                return None
+            data, task_stats = result
+
+        if data is None:
+            response = self._make_request(http_pool.get,
+                                          path="stats?nohtml=1&format=json")
+            if not response:
+                return None
+
+            data = simplejson.loads(response.content)
+
+        self.update_tasks(data, task_stats)
+        self.last_reload = time.time()
+        return self.tasks
 
+    def update_tasks(self, data, task_stats=None):
+        """
+        Rebuild tasks from the machinesitter's stats.
+
+        task_stats: {task name: stats} of the running tasks, or None to
+        fetch them from each tasksitter
+        """
         task_data = {}
         new_tasks = {}
         for key, value in data.items():
@@ -120,46 +390,57 @@ class MachineData(object):
                 task_data[task_name] = {}
             task_data[task_name][metric] = value
 
-        # Update all tasks in parallel
-        update_threads = []
+        # Fetch the stats of each task in parallel
+        pending = {}
         for task_name in list(task_data.keys()):
             task_dict = task_data[task_name]
             new_tasks[task_dict['name']] = task_dict
-            if task_dict['running']:
-                t = threading.Thread(target=self.run_update_task_data,
-                                     args=[new_tasks, task_dict['name']])
-                t.start()
-                update_threads.append(t)
-
-        while update_threads:
-            for thread in update_threads:
-                if not _thread.isAlive():
-                    update_threads.remove(thread)
-            time.sleep(0.0001)
+            if not task_dict['running']:
+                continue
+
+            if task_stats is not None:
+                self.add_task_stats(new_tasks, task_dict['name'],
+                                    task_stats.get(task_dict['name'], {}))
+            else:
+                future = task_stats_pool.submit(self.fetch_task_stats,
+                                                task_dict)
+                pending[future] = task_dict['name']
+
+        if pending:
+            done, not_done = concurrent.futures.wait(
+                pending, timeout=self.task_stats_deadline)
+            for future in not_done:
+                future.cancel()
+                logger.warn("Timed out fetching stats of %s on %s" % (
+                    pending[future], self.hostname))
+
+            # Only merged here, so late results can't change self.tasks
+            for future, task_name in list(pending.items()):
+                stats = {}
+                if future in done:
+                    stats = future.result()
+                self.add_task_stats(new_tasks, task_name, stats)
 
         self.tasks = new_tasks
-        return self.tasks
 
-    def run_update_task_data(self, new_tasks, task_name):
-        updated = False
-        tries = 0
-        while not updated and tries < 10:
-            tries += 1
-            try:
-                self.update_task_data(new_tasks,
-                                      task_name)
-                updated = True
-            except:
-                # Http server might not be up yet
-                time.sleep(0.01)
-                logger.warn("Couldn't update task")
+    def fetch_task_stats(self, task_dict):
+        """
+        Returns: the stats of a task from its tasksitter, or {} if it
+        couldn't be loaded
+        """
+        stats_page = self.strip_html(task_dict['monitoring'])
+        # Refused connections, as while its HTTP server starts, are
+        # already retried by http_pool
+        try:
+            return self.load_generic_page(stats_page, 'stats')
+        except ValueError:
+            # Not JSON
+            logger.warn("Couldn't update task %s" % task_dict['name'])
+            return {}
 
-    def update_task_data(self, tasks, task_name):
+    def add_task_stats(self, tasks, task_name, stats):
         stats_page = self.strip_html(tasks[task_name]['monitoring'])
-        tasks[task_name].update(
-            self.load_generic_page(
-                stats_page,
-                'stats'))
+        tasks[task_name].update(stats)
         tasks[task_name]['stats_page'] = "%s/stats" % stats_page
         tasks[task_name]['logs_page'] = "%s/logs" % stats_page
         return tasks
@@ -168,7 +449,7 @@ class MachineData(object):
         params = '&'.join(
             "%s=%s" % (
                 k, urllib.parse.quote_plus(str(v))) for k, v in list(config.items()))
-        val = self._make_request(requests.get,
+        val = self._make_request(http_pool.get,
                                  path="add_task?%s" % params)
         if val:
             return val.content
@@ -181,7 +462,7 @@ class MachineData(object):
 
         tid = urllib.parse.quote(task['name'])
         val = self._make_request(
-            requests.get,
+            http_pool.get,
             path="remove_task?task_name=%s" % tid)
 
         if val:
@@ -195,9 +476,9 @@ class MachineData(object):
 
         tid = urllib.parse.quote(task['name'])
         val = self._make_request(
-            requests.get,
+            http_pool.get,
             path="start_task?task_name=%s" % tid,
-            async=True)
+            background=True)
 
         if val:
             return val.content
@@ -210,9 +491,9 @@ class MachineData(object):
 
         tid = urllib.parse.quote(task['name'])
         val = self._make_request(
-            requests.get,
+            http_pool.get,
             path="restart_task?task_name=%s" % tid,
-            async=True)
+            background=True)
 
         if val:
             return val.content
@@ -225,9 +506,9 @@ class MachineData(object):
 
         tid = urllib.parse.quote(task['name'])
         val = self._make_request(
-            requests.get,
+            http_pool.get,
             path="stop_task?task_name=%s" % tid,
-            async=True)
+            background=True)
 
         if val:
             return val.content
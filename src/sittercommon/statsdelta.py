@@ -0,0 +1,169 @@
+"""
+Track which stats changed, so a poller can fetch only what's new
+"""
+import threading
+import time
+
+
+def flatten(data, prefix=()):
+    """
+    Returns: {key path: value} for every value in nested dicts, except
+    non-empty dicts which are flattened in turn
+    """
+    flat = {}
+    for key, value in data.items():
+        path = prefix + (key,)
+        if isinstance(value, dict) and value:
+            flat.update(flatten(value, path))
+        else:
+            flat[path] = value
+
+    return flat
+
+
+def nest(flat):
+    """
+    The inverse of flatten()
+    """
+    data = {}
+    for path, value in flat.items():
+        node = data
+        for key in path[:-1]:
+            node = node.setdefault(key, {})
+        node[path[-1]] = value
+
+    return data
+
+
+def merge(data, changed):
+    for key, value in changed.items():
+        if (isinstance(value, dict) and value and
+                isinstance(data.get(key), dict)):
+            merge(data[key], value)
+        else:
+            data[key] = value
+
+
+def parse_version(value):
+    """
+    Returns: the version in a since argument, or None if it isn't one
+    """
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def apply_delta(data, delta):
+    """
+    Apply a delta from VersionedStats.get_delta() to data, in place
+    unless the delta holds the full stats.
+
+    Returns: the updated stats
+    """
+    if delta['full']:
+        return delta['changed']
+
+    for path in delta['removed']:
+        nodes = [data]
+        for key in path[:-1]:
+            node = nodes[-1].get(key)
+            if not isinstance(node, dict):
+                break
+            nodes.append(node)
+        else:
+            nodes[-1].pop(path[-1], None)
+            # Drop dicts left empty, any which should stay are in changed
+            for parent, key in reversed(list(zip(nodes, path[:-1]))):
+                if parent[key]:
+                    break
+                del parent[key]
+
+    merge(data, delta['changed'])
+    return data
+
+
+class VersionedStats(object):
+    """
+    Number each change to a nested dict of stats, so a poller which
+    last saw version v can be sent only what changed since.
+
+    Versions start at the time this was created in milliseconds, so a
+    poller holding a version from an earlier process gets the full stats.
+    """
+    # Removed stats remembered, pollers older than the ones forgotten get
+    # the full stats
+    max_removed = 10000
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = int(time.time() * 1000)
+        # Deltas since versions older than this are sent in full
+        self.horizon = self.version
+        self.values = {}
+        # key path -> version it last changed or was removed in
+        self.changed = {}
+        self.removed = {}
+
+    def update(self, data):
+        """
+        Record data as the current stats.
+
+        Returns: the current version
+        """
+        flat = flatten(data)
+        with self.lock:
+            return self._update(flat)
+
+    def get_delta(self, data, since=None):
+        """
+        Record data as the current stats and work out what changed after
+        version since.
+
+        Returns: a dict of
+          version: the current version, to pass as since next time
+          full: True if changed holds all of the stats, because since
+            was None, too old or from another process
+          changed: a nested dict of the stats which changed
+          removed: a list of key paths of stats which were removed
+        """
+        flat = flatten(data)
+        with self.lock:
+            self._update(flat)
+            if since is None or since < self.horizon or since > self.version:
+                return {'version': self.version, 'full': True,
+                        'changed': nest(self.values), 'removed': []}
+
+            changed = dict([(path, self.values[path]) for path, version
+                            in self.changed.items() if version > since])
+            removed = [list(path) for path, version in self.removed.items()
+                       if version > since]
+            return {'version': self.version, 'full': False,
+                    'changed': nest(changed), 'removed': removed}
+
+    def _update(self, flat):
+        version = self.version + 1
+        modified = False
+        for path, value in flat.items():
+            if path not in self.values or self.values[path] != value:
+                self.changed[path] = version
+                self.removed.pop(path, None)
+                modified = True
+
+        for path in self.values:
+            if path not in flat:
+                self.removed[path] = version
+                del self.changed[path]
+                modified = True
+
+        if modified:
+            self.version = version
+            self.values = flat
+
+        if len(self.removed) > self.max_removed:
+            oldest = sorted(self.removed.items(), key=lambda item: item[1])
+            for path, version in oldest[:len(oldest) // 2]:
+                del self.removed[path]
+                self.horizon = max(self.horizon, version)
+
+        return self.version
@@ -0,0 +1,181 @@
+"""
+A cgroup (v2) backend for accounting and limiting a task's resources
+"""
+import os
+import signal
+import time
+
+
+class CGroup(object):
+    """
+    A cgroup v2 group holding every process of a single task.
+
+    Accounting comes from cpu.stat and memory.current, which the kernel
+    keeps for the whole group, so descendants that leave the task's pgrp
+    are still counted and no per-process /proc scanning is needed.
+    """
+
+    cpu_period = 100000
+
+    def __init__(self, name, parent="/sys/fs/cgroup/cerebro"):
+        self.name = name
+        self.parent = parent
+        self.path = os.path.join(parent, name)
+
+        self.last_cpu_time = None
+        self.last_cpu_read = None
+        self.cpu_usage = 0
+
+    @classmethod
+    def is_available(cls, parent="/sys/fs/cgroup/cerebro"):
+        """
+        Check if the unified (v2) hierarchy is mounted and we can
+        create groups under parent.
+        """
+        root = os.path.dirname(parent.rstrip("/"))
+        if not os.path.exists(os.path.join(root, "cgroup.controllers")):
+            return False
+
+        if os.path.exists(parent):
+            return os.access(parent, os.W_OK)
+
+        return os.access(root, os.W_OK)
+
+    def _path(self, filename):
+        return os.path.join(self.path, filename)
+
+    def _read(self, filename):
+        with open(self._path(filename)) as fileh:
+            return fileh.read()
+
+    def _write(self, filename, value, path=None):
+        with open(os.path.join(path or self.path, filename), "w") as fileh:
+            fileh.write(str(value))
+
+    def create(self):
+        """
+        Create the group, enabling the cpu and memory controllers for it,
+        and the io controller if the kernel has it.
+
+        Raises: OSError/IOError if the group can't be set up
+        """
+        if not os.path.exists(self.parent):
+            os.makedirs(self.parent)
+
+        # Controllers have to be enabled all the way down from the root
+        root = os.path.dirname(self.parent.rstrip("/"))
+        for path in (root, self.parent):
+            # Separately, as one missing controller fails the whole write
+            for controllers in ("+cpu +memory", "+io"):
+                try:
+                    self._write("cgroup.subtree_control", controllers,
+                                path=path)
+                except (IOError, OSError):
+                    # Already enabled, or delegated to us as-is
+                    pass
+
+        if not os.path.exists(self.path):
+            os.mkdir(self.path)
+
+    def add_pid(self, pid):
+        """
+        Move pid into the group.  Children forked after this inherit it.
+        """
+        self._write("cgroup.procs", pid)
+
+    def get_pids(self):
+        try:
+            return [int(pid) for pid in self._read("cgroup.procs").split()]
+        except (IOError, OSError):
+            return []
+
+    def set_cpu_limit(self, cores):
+        """
+        Have the kernel throttle the group to the given number of cores.
+        """
+        quota = int(float(cores) * self.cpu_period)
+        self._write("cpu.max", "%d %d" % (quota, self.cpu_period))
+
+    def set_memory_limit(self, limit):
+        """
+        Have the kernel OOM kill the group above limit bytes.
+        """
+        self._write("memory.max", int(limit))
+
+    def get_cpu_time(self):
+        """
+        Return: total cpu time (usec) used by the group
+        """
+        for line in self._read("cpu.stat").splitlines():
+            key, value = line.split()
+            if key == "usage_usec":
+                return int(value)
+
+        return 0
+
+    def get_memory_usage(self):
+        """
+        Return: bytes of memory charged to the group
+        """
+        return int(self._read("memory.current"))
+
+    def get_io_usage(self):
+        """
+        Return: {'read_bytes': ..., 'write_bytes': ...} of storage io by
+        the group, summed over every device in io.stat
+
+        Raises: IOError/OSError if the io controller isn't enabled
+        """
+        totals = {'read_bytes': 0, 'write_bytes': 0}
+        fields = {'rbytes': 'read_bytes', 'wbytes': 'write_bytes'}
+        for line in self._read("io.stat").splitlines():
+            for column in line.split()[1:]:
+                key, _, value = column.partition("=")
+                if key in fields:
+                    totals[fields[key]] += int(value)
+
+        return totals
+
+    def update_cpu_usage(self):
+        """
+        Calculate CPU usage (in cores) since the last call.
+        """
+        now = time.time()
+        cpu_time = self.get_cpu_time()
+        if self.last_cpu_time is not None and now > self.last_cpu_read:
+            self.cpu_usage = ((cpu_time - self.last_cpu_time) /
+                              ((now - self.last_cpu_read) * 1000000.0))
+
+        self.last_cpu_time = cpu_time
+        self.last_cpu_read = now
+        return self.cpu_usage
+
+    def kill_all(self):
+        """
+        SIGKILL every process in the group, including any that have
+        moved out of the task's pgrp.
+        """
+        try:
+            self._write("cgroup.kill", 1)
+            return
+        except (IOError, OSError):
+            # cgroup.kill needs linux 5.14+
+            pass
+
+        for pid in self.get_pids():
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except OSError:
+                pass
+
+    def destroy(self):
+        """
+        Remove the group.  Only works once every process has exited.
+        """
+        try:
+            os.rmdir(self.path)
+        except OSError:
+            pass
+
+    def __str__(self):
+        return self.path
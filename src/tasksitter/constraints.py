@@ -1,7 +1,44 @@
 """
 Define a class which represents a constraint on the sub task
 """
+import collections
 import datetime
+import time
+
+
+def parse_smoothing(spec):
+    """
+    Parse a smoothing spec from the command line:
+
+      none
+      ewma[:ALPHA]                  (0 < ALPHA <= 1, default 0.3)
+      percentile[:PERCENT[:WINDOW]] (default the 50th percentile of the
+                                     samples from the last 10 seconds)
+
+    Returns: a (kind, params) tuple for Constraint.set_flexibility
+    """
+    parts = spec.split(':')
+    kind = parts[0]
+    try:
+        params = tuple(float(p) for p in parts[1:])
+    except ValueError:
+        raise ValueError("Invalid smoothing: %s" % spec)
+
+    if kind == 'none' and not params:
+        return None, ()
+    if kind == 'ewma' and len(params) <= 1:
+        if params and not 0 < params[0] <= 1:
+            raise ValueError("ewma alpha must be in (0, 1]: %s" % spec)
+        return kind, params
+    if kind == 'percentile' and len(params) <= 2:
+        if params and not 0 <= params[0] <= 100:
+            raise ValueError("percentile must be in [0, 100]: %s" % spec)
+        if len(params) > 1 and params[1] <= 0:
+            raise ValueError("percentile window must be positive: %s" %
+                             spec)
+        return kind, params
+
+    raise ValueError("Invalid smoothing: %s" % spec)
 
 
 class Constraint(object):
@@ -11,6 +48,18 @@ class Constraint(object):
         self.value = value
         self.kill_on_violation = True
 
+        # Flexible limits, see set_flexibility
+        self.smoothing = None
+        self.ewma_alpha = .3
+        self.percentile = 50
+        # Seconds of (time, value) samples the percentile is taken over
+        self.window = 10
+        self.samples = collections.deque()
+        self.grace_period = 0
+
+        self.current_utilisation = None
+        self.violation_start = None
+
     def check_violation(self, child_proc):
         """
         Look for a violation of a constraint
@@ -22,6 +71,86 @@ class Constraint(object):
         print("check generic violation %s" % child_proc.pid)
         return 0
 
+    def set_flexibility(self, smoothing=None, grace_period=0):
+        """
+        Make the limit flexible.
+
+        Args:
+          smoothing - a (kind, params) tuple from parse_smoothing.  'ewma'
+            compares an exponentially weighted moving average of usage
+            against the limit, 'percentile' a percentile of the samples
+            from the last WINDOW seconds, None for the instantaneous
+            usage.
+          grace_period - seconds usage must stay over the limit before
+            it counts as a violation
+        """
+        kind, params = smoothing or (None, ())
+        self.smoothing = kind
+        if kind == 'ewma' and params:
+            self.ewma_alpha = params[0]
+        if kind == 'percentile':
+            if params:
+                self.percentile = params[0]
+            if len(params) > 1:
+                self.window = params[1]
+
+        self.grace_period = grace_period or 0
+
+    def reset(self):
+        """
+        Forget usage history, e.g. when the child is restarted
+        """
+        self.samples.clear()
+        self.current_utilisation = None
+        self.violation_start = None
+
+    def smooth(self, value, now=None):
+        if self.smoothing == 'ewma':
+            if self.current_utilisation is None:
+                return value
+            return (self.ewma_alpha * value +
+                    (1 - self.ewma_alpha) * self.current_utilisation)
+
+        if self.smoothing == 'percentile':
+            # Polls are further apart while usage is low, so the window
+            # is in seconds rather than samples
+            now = now or time.time()
+            self.samples.append((now, value))
+            while self.samples[0][0] <= now - self.window:
+                self.samples.popleft()
+            ordered = sorted([sample for _, sample in self.samples])
+            index = int(round(self.percentile / 100.0 * (len(ordered) - 1)))
+            return ordered[index]
+
+        return value
+
+    def check_utilisation(self, value, now=None):
+        """
+        Smooth a new utilisation reading and apply the grace period.
+
+        Returns: True if in violation
+        """
+        now = now or time.time()
+        self.current_utilisation = self.smooth(value, now)
+        if self.current_utilisation <= 1:
+            self.violation_start = None
+            return False
+
+        if self.violation_start is None:
+            self.violation_start = now
+
+        return now - self.violation_start >= self.grace_period
+
+    def utilisation(self, child_proc):
+        """
+        How close the child is to violating the constraint, as of the
+        last check_violation.
+
+        Returns: (smoothed) usage as a fraction of the limit, or None if
+        the constraint has no notion of usage
+        """
+        return self.current_utilisation
+
 
 class LivingConstraint(Constraint):
     """
@@ -56,6 +185,9 @@ class TimeConstraint(Constraint):
         Check how long a child has been alive.
         """
         now = datetime.datetime.now()
+        self.current_utilisation = ((now - child_proc.start_time)
+                                    .total_seconds() /
+                                    self.value.total_seconds())
         return now - child_proc.start_time > self.value
 
     def __str__(self):
@@ -76,7 +208,7 @@ class CPUConstraint(Constraint):
         """
         child_proc.update_usage(deep=True)
 
-        if child_proc.cpu_usage > float(self.value):
+        if self.check_utilisation(child_proc.cpu_usage / float(self.value)):
             print("CPU Limit Exceeded")
             return True
 
@@ -86,24 +218,81 @@ class CPUConstraint(Constraint):
         return "CPU Constraint (%s)" % self.value
 
 
+class IOConstraint(Constraint):
+    """
+    Ensure we satisfy a disk I/O based constraint.  Limits are in MB/s
+    of storage reads and writes (read_bytes/write_bytes in /proc/PID/io),
+    either may be None for no limit.
+    """
+    def __init__(self, read_limit=None, write_limit=None):
+        super(IOConstraint, self).__init__("IO Based Constraint",
+                                           (read_limit, write_limit))
+        self.read_limit = read_limit
+        self.write_limit = write_limit
+
+    def check_violation(self, child_proc):
+        """
+        Calculate child I/O rates and see if they violate the constraint.
+        """
+        child_proc.track_io = True
+        child_proc.update_usage(deep=True)
+
+        limits = [(self.read_limit, 'read_bytes'),
+                  (self.write_limit, 'write_bytes')]
+        usage = max([child_proc.io_rates.get(name, 0) /
+                     (float(limit) * 1024 * 1024)
+                     for limit, name in limits if limit] or [0])
+
+        if self.check_utilisation(usage):
+            print("IO Limit Exceeded")
+            return True
+
+        return False
+
+    def __str__(self):
+        return "IO Constraint (read %s MB/s, write %s MB/s)" % (
+            self.read_limit, self.write_limit)
+
+
 class MemoryConstraint(Constraint):
     """
     Ensure we satisfy a memory based constraint
+
+    measure picks what is compared against the limit: 'rss' (from
+    /proc/PID/stat), or 'pss' / 'uss' (from smaps, which don't double
+    count pages shared between e.g. pre-forked workers).
     """
-    def __init__(self, mem_limit):
+    measures = ['rss', 'pss', 'uss']
+
+    def __init__(self, mem_limit, measure='rss', sample_interval=1.0):
         # convert MB to bytes
         mem_limit = int(mem_limit) * 1024 * 1024
         super(MemoryConstraint, self).__init__("Memory Based Constraint",
                                              mem_limit)
+        self.measure = measure
+        self.sample_interval = sample_interval
+
+    def get_usage(self, child_proc):
+        if self.measure == 'rss':
+            return child_proc.mem_usage[1]
+
+        child_proc.update_smaps_usage(deep=True,
+                                      interval=self.sample_interval)
+        return child_proc.mem_detail.get(self.measure, 0)
 
     def check_violation(self, child_proc):
         """ Check for using too much Memory"""
         child_proc.update_usage(deep=True)
 
-        if child_proc.mem_usage[1] > self.value:
+        if self.check_utilisation(float(self.get_usage(child_proc)) /
+                                  self.value):
             print("Memory Limit Exceeded")
             return True
         return False
 
     def __str__(self):
+        if self.measure != 'rss':
+            return "Memory Constraint (%s MB %s)" % (
+                self.value / 1024 / 1024, self.measure.upper())
+
         return "Memory Constraint (%s MB)" % (self.value / 1024 / 1024)
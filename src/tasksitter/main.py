@@ -12,39 +12,58 @@ an alert.
 import os
 import simplejson
 import sys
+import traceback
 
 
 import sittercommon.arg_parser as argparse
 import sittercommon.http_monitor as http_monitor
 import sittercommon.logmanager as logmanager
+from . import cgroup
 from . import constraints
 from . import process_harness
 from . import stats_collector
 
 
-def run_command_with_harness(command, args, constraints_list):
+def run_command_with_harness(command, args, constraints_list,
+                             task_cgroup=None):
     """Execute the child command.
 
     Args:
       command: a string which includes the file and args
       args: An object which containts configuration options
       constraints: an array of Constraint objects
+      task_cgroup: a CGroup to run the child in, or None
 
     Return:
       A Harness object encapsulating the child process
       and all the current constraints
     """
 
-    logs = logmanager.LogManager(args.stdout_location,
-                                 args.stderr_location)
-
-    return process_harness.ProcessHarness(command, constraints_list,
-                                          restart=args.restart,
-                                          max_restarts=args.max_restarts,
-                                          poll_interval=args.poll_interval,
-                                          collect_stats=args.collect_stats,
-                                          logmanager=logs,
-                                          uid=args.uid)
+    def to_bytes(megabytes):
+        if megabytes:
+            return int(megabytes * 1024 * 1024)
+
+    logs = logmanager.LogManager(
+        args.stdout_location,
+        args.stderr_location,
+        max_bytes=to_bytes(args.log_budget),
+        max_segment_bytes=to_bytes(args.log_segment_size),
+        max_segments=args.log_keep,
+        max_age=args.log_max_age,
+        compress=args.log_compress)
+
+    return process_harness.ProcessHarness(
+        command, constraints_list,
+        restart=args.restart,
+        max_restarts=args.max_restarts,
+        poll_interval=args.poll_interval,
+        max_poll_interval=args.max_poll_interval,
+        collect_stats=args.collect_stats,
+        logmanager=logs,
+        uid=args.uid,
+        usage_feed=args.usage_feed,
+        cgroup=task_cgroup,
+        track_io=args.collect_stats)
 
 
 def parse_args(args):
@@ -60,6 +79,39 @@ def parse_args(args):
                         help='The amount of memory in MB that this '
                         'task can use')
 
+    parser.add_argument('--mem-measure', dest='mem_measure',
+                        default='rss',
+                        choices=constraints.MemoryConstraint.measures,
+                        help='What --mem is compared against.  pss and uss '
+                        'are read from smaps and don\'t double count shared '
+                        'pages, but cost more to sample')
+
+    parser.add_argument('--mem-sample-interval', dest='mem_sample_interval',
+                        default=1.0, type=float,
+                        help='How frequently (seconds) to sample pss/uss')
+
+    parser.add_argument('--io-read-mbps', dest='io_read_mbps', type=float,
+                        help='The MB/s of disk reads this task can do')
+
+    parser.add_argument('--io-write-mbps', dest='io_write_mbps', type=float,
+                        help='The MB/s of disk writes this task can do')
+
+    for name, label in [('cpu', '--cpu'), ('mem', '--mem'),
+                        ('io', '--io-read-mbps/--io-write-mbps')]:
+        parser.add_argument('--%s-smoothing' % name,
+                            dest='%s_smoothing' % name,
+                            type=constraints.parse_smoothing,
+                            help='Compare a smoothed usage against %s: '
+                            'none, ewma[:ALPHA] or '
+                            'percentile[:PERCENT[:WINDOW]], with WINDOW '
+                            'in seconds' % label)
+
+        parser.add_argument('--%s-grace-period' % name,
+                            dest='%s_grace_period' % name,
+                            default=0, type=float,
+                            help='Seconds usage must stay over %s before '
+                            'the task is killed' % label)
+
     parser.add_argument('--time-limit', dest='time_limit', type=float,
                         help='Maximum time the child can run for in seconds')
 
@@ -111,6 +163,12 @@ def parse_args(args):
                         'process for constraint violations '
                         '(default=0.1 seconds)')
 
+    parser.add_argument('--max-poll-interval', dest='max_poll_interval',
+                        type=float,
+                        help='Let the poll interval grow up to this many '
+                        'seconds while the task is well under its limits. '
+                        'By default it stays fixed at --poll-interval')
+
     parser.add_argument('--stdout-location', dest='stdout_location',
                         default='-', type=str,
                         help='Directory where stdout logs should be placed '
@@ -121,6 +179,53 @@ def parse_args(args):
                         help='Directory where stdout logs should be placed '
                         'default is to print to caller\'s STDERR')
 
+    parser.add_argument('--log-budget', dest='log_budget', type=float,
+                        help='MB of stdout (and of stderr) logs to keep '
+                        'across all starts of the task.  The oldest '
+                        'segments are deleted beyond this')
+
+    parser.add_argument('--log-segment-size', dest='log_segment_size',
+                        type=float,
+                        help='Split the running task\'s log into a new '
+                        'segment once it grows past this many MB')
+
+    parser.add_argument('--log-keep', dest='log_keep', type=int,
+                        help='Maximum number of log segments to keep '
+                        'per stream')
+
+    parser.add_argument('--log-max-age', dest='log_max_age', type=float,
+                        help='Delete log segments older than this many '
+                        'seconds')
+
+    parser.add_argument('--no-log-compress', dest='log_compress',
+                        default=True, action='store_false',
+                        help='Don\'t gzip log segments which are no '
+                        'longer being written to.  They are only gzipped '
+                        'when one of the --log limits is set')
+
+    parser.add_argument('--usage-feed', dest='usage_feed',
+                        help='Directory where a machinesitter shared sampler '
+                        'publishes usage for this task.  When fresh data is '
+                        'available there /proc is not sampled directly.')
+
+    parser.add_argument('--cgroup', dest='cgroup',
+                        default=False,
+                        action='store_true',
+                        help='Run the task in its own cgroup (v2) and read '
+                        'cpu/memory usage from it.  Falls back to /proc '
+                        'sampling if cgroups are not writable.')
+
+    parser.add_argument('--cgroup-parent', dest='cgroup_parent',
+                        default='/sys/fs/cgroup/cerebro', type=str,
+                        help='cgroup under which task cgroups are created')
+
+    parser.add_argument('--cgroup-enforce', dest='cgroup_enforce',
+                        default=False,
+                        action='store_true',
+                        help='Have the kernel enforce --cpu and --mem via '
+                        'cpu.max and memory.max instead of only killing '
+                        'the task after the fact')
+
     parser.add_argument('--uid', dest='uid',
                         help='Change to UID before executing child process'
                         'requires root priviledges.  Can be an ID or name.')
@@ -140,10 +245,21 @@ def build_constraints(args):
         proc_constraints.append(constraints.LivingConstraint())
 
     if args.cpu:
-        proc_constraints.append(constraints.CPUConstraint(args.cpu))
+        constraint = constraints.CPUConstraint(args.cpu)
+        constraint.set_flexibility(args.cpu_smoothing, args.cpu_grace_period)
+        proc_constraints.append(constraint)
 
     if args.mem:
-        proc_constraints.append(constraints.MemoryConstraint(args.mem))
+        constraint = constraints.MemoryConstraint(
+            args.mem, args.mem_measure, args.mem_sample_interval)
+        constraint.set_flexibility(args.mem_smoothing, args.mem_grace_period)
+        proc_constraints.append(constraint)
+
+    if args.io_read_mbps or args.io_write_mbps:
+        constraint = constraints.IOConstraint(args.io_read_mbps,
+                                              args.io_write_mbps)
+        constraint.set_flexibility(args.io_smoothing, args.io_grace_period)
+        proc_constraints.append(constraint)
 
     if args.time_limit:
         proc_constraints.append(constraints.TimeConstraint(args.time_limit))
@@ -151,6 +267,37 @@ def build_constraints(args):
     return proc_constraints
 
 
+def build_cgroup(args):
+    """
+    Create a cgroup for the task if requested and possible.
+
+    Returns: a CGroup, or None to use /proc based accounting
+    """
+    if not args.cgroup:
+        return None
+
+    if not cgroup.CGroup.is_available(args.cgroup_parent):
+        print("cgroups not writable at %s, using /proc" % args.cgroup_parent)
+        return None
+
+    task_cgroup = cgroup.CGroup("tasksitter-%d" % os.getpid(),
+                                args.cgroup_parent)
+    try:
+        task_cgroup.create()
+        if args.cgroup_enforce:
+            if args.cpu:
+                task_cgroup.set_cpu_limit(args.cpu)
+            if args.mem:
+                task_cgroup.set_memory_limit(args.mem * 1024 * 1024)
+    except (IOError, OSError):
+        print("Couldn't set up cgroup %s, using /proc" % task_cgroup)
+        traceback.print_exc()
+        task_cgroup.destroy()
+        return None
+
+    return task_cgroup
+
+
 def main(sys_args=None, wait_for_child=True, allow_spam=False):
     """Run the task sitter."""
 
@@ -165,11 +312,15 @@ def main(sys_args=None, wait_for_child=True, allow_spam=False):
     # Set outselves to our own pgrp to separate from machine sitter
     os.setpgrp()
 
-    harness = run_command_with_harness(args.command, args, constraints_list)
+    harness = run_command_with_harness(args.command, args, constraints_list,
+                                       build_cgroup(args))
     harness.allow_spam = allow_spam
     harness.begin_monitoring()
 
+    harness.logmanager.start()
+
     stats = stats_collector.StatsCollector(harness)
+    stats.start()
     httpd = None
 
     if args.http_monitoring:
@@ -182,8 +333,13 @@ def main(sys_args=None, wait_for_child=True, allow_spam=False):
 
         print(simplejson.dumps(harness.logmanager.get_logfile_names()))
 
+        if harness.cgroup:
+            harness.cgroup.destroy()
+
         if httpd and not args.keep_http_running:
             httpd.stop()
+            stats.stop()
+            harness.logmanager.stop()
 
         if not args.keep_http_running:
             sys.exit(exit_code)
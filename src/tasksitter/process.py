@@ -2,19 +2,145 @@
 A class to encapsulate data about a process
 """
 import datetime
+import fcntl
+import json
 import os
 import resource
+import select
 import signal
 import sys
 import time
 
+from . import proctree
+
+
+def cpu_usage_between(usage, last_usage, system_usage, last_system_usage):
+    """
+    Calculate the CPU usage of a process between two samples, in cores
+    like a cgroup's cpu.stat.
+
+    Formula:
+    (utime + stime jiffies used by the process) /
+    (jiffies passed on every CPU, from /proc/stat / number of CPUs)
+    """
+    proc_time_diff = ((usage[0] + usage[2]) -
+                      (last_usage[0] + last_usage[2]))
+
+    # user, nice, system, idle, iowait, irq, softirq and steal add up to
+    # the time passed on every CPU.  guest time is already in user.
+    system_time_diff = (sum(system_usage[:8]) -
+                        sum(last_system_usage[:8]))
+    elapsed = float(system_time_diff) / ONLINE_CPUS
+    if elapsed <= 0:
+        return 0
+
+    return proc_time_diff / elapsed
+
+
+def online_cpus():
+    """
+    Returns: how many CPUs /proc/stat's cpu line covers
+    """
+    try:
+        return os.sysconf('SC_NPROCESSORS_ONLN') or 1
+    except (ValueError, OSError):
+        return 1
+
+
+ONLINE_CPUS = online_cpus()
+
+
+class SigchldPipe(object):
+    """
+    A self-pipe written to by a SIGCHLD handler, so child exits can be
+    waited for with select() on kernels without pidfd_open (< 5.3).
+    """
+    read_fd = None
+    write_fd = None
+
+    @classmethod
+    def install(cls):
+        """
+        Install the SIGCHLD handler.  Must be called from the main thread.
+        """
+        if cls.read_fd is not None:
+            return
+
+        cls.read_fd, cls.write_fd = os.pipe()
+        for fd in (cls.read_fd, cls.write_fd):
+            flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+        signal.signal(signal.SIGCHLD, cls._handle_sigchld)
+
+    @classmethod
+    def _handle_sigchld(cls, *_):
+        try:
+            os.write(cls.write_fd, b"x")
+        except OSError:
+            # Pipe is full, the reader will wake up anyway
+            pass
+
+    @classmethod
+    def drain(cls):
+        try:
+            while os.read(cls.read_fd, 1024):
+                pass
+        except OSError:
+            pass
+
+
+def pidfd_supported():
+    """
+    Check if the kernel lets us wait on a pid with pidfd_open
+    """
+    if not hasattr(os, "pidfd_open"):
+        return False
+
+    try:
+        os.close(os.pidfd_open(os.getpid()))
+        return True
+    except OSError:
+        return False
+
+
+def install_exit_notifier():
+    """
+    Set up whatever Process.wait_for_exit needs.  Call from the main
+    thread before starting any children.
+    """
+    if not pidfd_supported():
+        SigchldPipe.install()
+
 
 class Process(object):
     """
     An object representing the child process or running task
     """
-    def __init__(self, pid):
+
+    # How many of the shared sampler's intervals old a reading may be
+    # before we ignore it and sample /proc ourselves, but at least
+    # feed_max_age seconds
+    feed_max_intervals = 2
+    feed_max_age = 1
+
+    # Reading smaps is far more expensive than stat, so PSS/USS are
+    # only refreshed this often (seconds)
+    smaps_interval = 1.0
+
+    # /proc/PID/io counter -> name used in io_usage and io_rates
+    io_counters = {'read_bytes': 'read_bytes',
+                   'write_bytes': 'write_bytes',
+                   'syscr': 'read_syscalls',
+                   'syscw': 'write_syscalls'}
+
+    def __init__(self, pid, usage_feed=None, cgroup=None, track_io=False):
         self.pid = pid
+        self.usage_feed = usage_feed
+        # Whether we've said we're sampling /proc as the feed failed
+        self.feed_fallback_reported = False
+        self.cgroup = cgroup
+        self.track_io = track_io
 
         self.previous_update_time = 0
         self.last_usage_update = 0
@@ -24,27 +150,98 @@ class Process(object):
         self.last_system_usage = None
         self.cpu_usage = 0
         self.mem_usage = [0, 0]
-        self.proc_stats = []
+        # rss, pss and uss from smaps, only filled in when asked for
+        self.mem_detail = {}
+        self.last_smaps_update = 0
+        # Cumulative io counters and their per second rates
+        self.io_usage = {}
+        self.io_rates = {}
+        # Cumulative io counters from the usage feed, if it has them
+        self.feed_io_usage = None
+        self.last_io_update = 0
+        self.proc_stats = {}
+        self.proc_tree = proctree.ProcessTree(pid)
         self.start_time = datetime.datetime.now()
 
+        self.exit_status = None
+        self.exit_fd = None
+        if hasattr(os, "pidfd_open"):
+            try:
+                self.exit_fd = os.pidfd_open(pid)
+            except OSError:
+                # Already gone, or the kernel is too old
+                pass
+
     def is_alive(self):
         """
         Check if the child process is alive
         """
+        if self.exit_status is not None:
+            return False
+
         try:
-            os.waitpid(self.pid, os.WNOHANG)
-            return True
+            pid, status = os.waitpid(self.pid, os.WNOHANG)
         except OSError:
             return False
         except KeyboardInterrupt:
             print("WAA" * 100)
             self.force_exit()
+            return False
+
+        if pid == 0:
+            return True
+
+        self._reaped(status)
+        return False
+
+    def _reaped(self, status):
+        self.exit_status = status
+        self.close()
+
+    def close(self):
+        """
+        Release the pidfd.  Call when the Process is done with, even if
+        the child was never reaped through it.
+        """
+        if self.exit_fd is not None:
+            os.close(self.exit_fd)
+            self.exit_fd = None
+
+    def wait_for_exit(self, timeout):
+        """
+        Sleep for up to timeout seconds, waking up as soon as the child
+        exits.  Uses a pidfd where available, otherwise the SIGCHLD pipe.
+
+        Returns: True if woken up by a child exit, otherwise False
+        """
+        fd = self.exit_fd
+        if fd is None:
+            fd = SigchldPipe.read_fd
+
+        if fd is None or self.exit_status is not None:
+            time.sleep(timeout)
+            return False
+
+        try:
+            readable, _, _ = select.select([fd], [], [], timeout)
+        except (OSError, ValueError):
+            # The fd was closed under us by a reap in another thread
+            return True
+
+        if fd == SigchldPipe.read_fd:
+            SigchldPipe.drain()
+
+        return bool(readable)
 
     def force_exit(self):
         """
         Send a SIGKILL to the child process
         """
         print("Killing Process %s" % self.pid)
+        if self.cgroup:
+            # Catches descendants which have left our pgrp
+            self.cgroup.kill_all()
+
         try:
             os.kill(self.pid, signal.SIGKILL)
         except OSError:
@@ -61,18 +258,23 @@ class Process(object):
         """
         Wait for the child process to finish.
         Returns:
-         None, None if the child is already dead
-         return value of os.waitpid() if we wait for it to exit
+         pid, exit status if the child has exited
+         None, None if the child is already dead but we didn't reap it
         """
         if not self.is_alive():
+            if self.exit_status is not None:
+                return self.pid, self.exit_status
             return None, None
 
         try:
-            return os.waitpid(self.pid, 0)
+            pid, status = os.waitpid(self.pid, 0)
         except OSError:
             # child already exited
             return 0, 0
 
+        self._reaped(status)
+        return pid, status
+
     @classmethod
     def get_system_cpu_usage(cls):
         """
@@ -80,7 +282,8 @@ class Process(object):
         utime, nicetime, stime, idle, iowate, irq, softiq
         """
 
-        cpu_stats = file("/proc/stat", "r").readline()
+        with open("/proc/stat", "r") as stat_file:
+            cpu_stats = stat_file.readline()
         columns = cpu_stats.replace("cpu", "").split(" ")
         return [int(a) for a in columns if a]
 
@@ -101,9 +304,8 @@ class Process(object):
         if not deep:
             return get_proc_cpu(self.pid)
 
-        # Deep means get the cpu usage for all processes in our pgrp
-        # Best way I can figure to do this is to check ALL procs in
-        # the kernel process table, sadface.
+        # Deep means get the cpu usage for all processes in our pgrp,
+        # proc_stats only holds members of the pgrp (see get_proc_stats)
         cpu_usage = [0] * 7
         for proc in list(self.proc_stats.keys()):
             usage = get_proc_cpu(int(proc), self.pid)
@@ -112,18 +314,24 @@ class Process(object):
 
         return cpu_usage
 
-    def get_proc_stats(self):
+    def get_proc_stats(self, deep=False):
         """
-        Cache /proc/ID/stat so we only have to read it once
+        Cache /proc/ID/stat so we only have to read it once.
+
+        When deep is set read every process in our pgrp, which the
+        ProcessTree tracks incrementally instead of rescanning the whole
+        kernel process table on every update.
         """
-        stats = {}
-        for proc in os.listdir('/proc'):
-            try:
-                raw_stats = file("/proc/%d/stat" % int(proc), "r").readline()
-                stats[int(proc)] = raw_stats.split(" ")
-            except ValueError:
-                # proc isn't a pid
-                pass
+        if deep:
+            stats = self.proc_tree.refresh()
+        else:
+            stats = {}
+            columns = proctree.read_proc_stat(self.pid)
+            if columns:
+                stats[self.pid] = columns
+
+        if not stats:
+            raise IOError("No such process %s" % self.pid)
 
         return stats
 
@@ -144,8 +352,6 @@ class Process(object):
             return get_proc_mem(self.pid)
 
         # Deep means get the memory for all processes in our pgrp
-        # Best way I can figure to do this is to check ALL procs in
-        # the kernel process table, sadface.
         mem_usage = [0, 0]
         for proc in list(self.proc_stats.keys()):
             usage = get_proc_mem(proc, self.pid)
@@ -155,63 +361,187 @@ class Process(object):
         # Returns vmem, res
         return mem_usage
 
-    def calculate_cpu_usage(self):
+    def get_task_pids(self, deep=False):
         """
-        Calculate CPU Usage for this process.
+        Return the pids making up the task
+        """
+        if not deep:
+            return [self.pid]
 
-        Reference: http://stackoverflow.com/questions/1420426/
-                   calculating-cpu-usage-of-a-process-in-linux
+        if self.cgroup:
+            return self.cgroup.get_pids()
 
-        Formula:
-        utime_jiffys_proc_used / utime_jiffys_system_used +
-        stime_jiffys_proc_used / stime_jiffys_system_used
+        return list(self.proc_tree.refresh().keys())
 
-        Return: True if child is in violation, false otherwise
+    def update_io_usage(self, pids):
+        """
+        Sum /proc/PID/io over pids and work out the rates since the last
+        update.
+        """
+        totals = dict([(name, 0) for name in list(self.io_counters.values())])
+        for pid in pids:
+            counters = proctree.read_proc_io(pid)
+            if not counters:
+                continue
+
+            for counter, name in list(self.io_counters.items()):
+                totals[name] += counters.get(counter, 0)
+
+        self.set_io_usage(totals)
+
+    def set_io_usage(self, totals):
+        """
+        Record cumulative io counters and work out the rates since the
+        last ones.  Counters of processes which exited in between are
+        lost, so rates are clamped at 0.
+        """
+        now = time.time()
+        if self.io_usage and now > self.last_io_update:
+            elapsed = now - self.last_io_update
+            self.io_rates = dict([
+                    (name, max(0, totals[name] - self.io_usage[name])
+                     / elapsed)
+                    for name in list(totals.keys())
+                    if name in self.io_usage])
+
+        self.io_usage = totals
+        self.last_io_update = now
+
+    def update_smaps_usage(self, deep=False, interval=None):
+        """
+        Update rss, pss and uss in self.mem_detail from smaps.
+
+        Only updates at most once per interval (default smaps_interval)
+        seconds
+
+        Return: True if we updated, otherwise False
+        """
+        if interval is None:
+            interval = self.smaps_interval
+
+        now = time.time()
+        if now - self.last_smaps_update < interval:
+            return False
+
+        detail = {'rss': 0, 'pss': 0, 'uss': 0}
+        for pid in self.get_task_pids(deep):
+            usage = proctree.read_proc_smaps(pid)
+            if not usage:
+                continue
+
+            for key, value in list(usage.items()):
+                detail[key] += value
+
+        self.mem_detail = detail
+        self.last_smaps_update = now
+        return True
+
+    def calculate_cpu_usage(self):
+        """
+        Calculate CPU Usage for this process.
+
+        Return: the new cpu usage, or None if there is only one sample
         """
         if not self.usage or not self.last_usage:
             return
 
-        proc_user_time_diff = (self.usage[0] -
-                               self.last_usage[0])
+        self.cpu_usage = cpu_usage_between(self.usage, self.last_usage,
+                                           self.system_usage,
+                                           self.last_system_usage)
+        return self.cpu_usage
 
-        system_user_time_diff = ((self.system_usage[0] +
-                                  self.system_usage[1]) -
-                                 (self.last_system_usage[0] +
-                                  self.last_system_usage[1])) or 1
+    def read_usage_feed(self):
+        """
+        Load usage figures published for our pgrp by a machine-wide
+        ProcSampler (see machinesitter.procsampler).
 
-        proc_sys_time_diff = (self.usage[2] -
-                              self.last_usage[2])
+        Return: True if a fresh reading was loaded, otherwise False
+        """
+        filename = os.path.join(self.usage_feed, "%d.usage" % self.pid)
+        try:
+            with open(filename) as feed:
+                data = json.load(feed)
+        except (IOError, OSError, ValueError):
+            self.report_feed_fallback("no usage in %s" % filename)
+            return False
 
-        # Include system time and idle time
-        system_sys_time_diff = (sum(self.system_usage[2:3]) -
-                                sum(self.last_system_usage[2:3])) or 1
+        max_age = max(self.feed_max_age,
+                      self.feed_max_intervals * data.get('interval', 0))
+        age = time.time() - data['time']
+        if age > max_age:
+            self.report_feed_fallback(
+                "usage in %s is %.1fs old" % (filename, age))
+            return False
 
-        #print "system:", system_sys_time_diff, system_user_time_diff
-        #print "proc:", proc_sys_time_diff, proc_user_time_diff
+        self.feed_fallback_reported = False
+        self.cpu_usage = data['cpu_usage']
+        self.mem_usage = data['mem_usage']
+        self.system_usage = data['system_usage']
+        self.feed_io_usage = data.get('io_usage')
+        return True
 
-        user_time_perc = float(proc_user_time_diff) / system_user_time_diff
-        sys_time_perc = float(proc_sys_time_diff) / system_sys_time_diff
+    def report_feed_fallback(self, reason):
+        if not self.feed_fallback_reported:
+            print("Sampling /proc ourselves, %s" % reason)
+            self.feed_fallback_reported = True
 
-        self.cpu_usage = user_time_perc + sys_time_perc
+    def update_cgroup_usage(self):
+        """
+        Read usage for the whole task from its cgroup.  The cgroup doesn't
+        track virtual memory, so only resident memory is updated.
+        """
+        try:
+            self.cpu_usage = self.cgroup.update_cpu_usage()
+            self.mem_usage = [self.mem_usage[0],
+                              self.cgroup.get_memory_usage()]
+        except (IOError, OSError):
+            # The cgroup has been removed
+            return
 
-        #print self.cpu_usage
-        return self.cpu_usage
+        if self.track_io:
+            try:
+                self.set_io_usage(self.cgroup.get_io_usage())
+            except (IOError, OSError):
+                # No io controller, read each process's counters
+                self.update_io_usage(self.cgroup.get_pids())
+
+        self.previous_update_time = self.last_usage_update
+        self.last_usage_update = time.time()
+        return True
 
     def update_usage(self, deep=False):
         """Update process usage.
 
-        Only updates at most once per 0.1 seconds
+        Only updates at most once per 0.1 seconds.  Deep usage comes
+        from the task's cgroup if it has one, otherwise from a fresh
+        usage feed if configured, otherwise from /proc.
 
         Return: True if we updated, otherwise False
         """
 
         now = time.time()
         if now - self.last_usage_update > 0.1:
+            if deep and self.cgroup:
+                return self.update_cgroup_usage()
+
+            if deep and self.usage_feed and self.read_usage_feed():
+                self.previous_update_time = self.last_usage_update
+                self.last_usage_update = now
+                # Don't diff against a stale sample if the feed goes away
+                self.usage = None
+                if self.track_io:
+                    if self.feed_io_usage is not None:
+                        self.set_io_usage(self.feed_io_usage)
+                    else:
+                        # A sampler which doesn't publish io counters
+                        self.update_io_usage(self.get_task_pids(deep))
+                return True
+
             self.previous_update_time = self.last_usage_update
             self.last_usage = self.usage
 
             try:
-                self.proc_stats = self.get_proc_stats()
+                self.proc_stats = self.get_proc_stats(deep)
                 self.usage = self.get_proc_cpu_usage(deep)
                 self.last_system_usage = self.system_usage
                 self.system_usage = Process.get_system_cpu_usage()
@@ -220,6 +550,9 @@ class Process(object):
                 # Process died and /proc/PID no longer exists
                 return
 
+            if self.track_io:
+                self.update_io_usage(list(self.proc_stats.keys()))
+
             self.calculate_cpu_usage()
             self.last_usage_update = time.time()
             return True
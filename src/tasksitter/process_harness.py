@@ -19,27 +19,46 @@ class ProcessHarness(object):
     An object which manages the lifecycle of a single child process, killing it
     when it violates constraints and rebooting it as necessary
     """
+    # Above this utilisation of any constraint we always poll at the
+    # minimum interval
+    tight_utilisation = .8
+
     def __init__(self, command, constraints, restart=False,
-                 max_restarts=-1, poll_interval=.1,
+                 max_restarts=-1, poll_interval=.1, max_poll_interval=None,
                  logmanager=None, uid=None, allow_spam=False,
-                 collect_stats=True):
+                 collect_stats=True, usage_feed=None, cgroup=None,
+                 track_io=False):
         self.launch_location = os.getcwd()
         self.child_proc = None
         self.child_running = True
+        # Notified when child_proc is replaced or child_running goes False
+        self.child_changed = threading.Condition()
         self.collect_stats = collect_stats
         self.command = command
         self.constraints = constraints
         self.max_restarts = max_restarts
         self.poll_interval = poll_interval
+        self.max_poll_interval = max(max_poll_interval or poll_interval,
+                                     poll_interval)
+        self.current_poll_interval = poll_interval
+        self.last_utilisation = None
         self.restart = restart
         self.start_count = 0
         self.uid = uid
+        self.usage_feed = usage_feed
+        self.cgroup = cgroup
+        self.track_io = track_io
         self.parent_pid = os.getpid()
         self.logmanager = logmanager
         self.logmanager.set_harness(self)
         self.stop_running = False
         self.last_start = datetime.datetime.min
         self.allow_spam = allow_spam
+        # Seconds from noticing the child died or was killed to the new
+        # child being started
+        self.last_restart_latency = None
+        self.total_restart_latency = 0
+        self.restart_count = 0
         # Statistics
         self.task_start = datetime.datetime.now()
         self.violations = {}
@@ -48,6 +67,7 @@ class ProcessHarness(object):
 
         signal.signal(signal.SIGTERM, self.exit_now)
         signal.signal(signal.SIGINT, self.exit_now)
+        process.install_exit_notifier()
 
         if self.uid != None:
             actual_uid = None
@@ -70,6 +90,8 @@ class ProcessHarness(object):
         self.stop_running = True
         self.child_running = False
         self.terminate_child()
+        if self.cgroup:
+            self.cgroup.destroy()
         print(simplejson.dumps(self.logmanager.get_logfile_names()))
         os._exit(0)
 
@@ -79,19 +101,29 @@ class ProcessHarness(object):
         """
         # Avoid spam-restarts, only allow restarting
         # once per second
-        now = datetime.datetime.now()
+        since_start = datetime.datetime.now() - self.last_start
         if not self.allow_spam and \
-                now - self.last_start < datetime.timedelta(seconds=1):
-            time.sleep(1)
+                since_start < datetime.timedelta(seconds=1):
+            time.sleep(1 - since_start.total_seconds())
 
         self.last_start = datetime.datetime.now()
 
+        if self.cgroup:
+            joined_read, joined_write = os.pipe()
+
         pid = os.fork()
         if pid == 0:
             # We're the child, we'll exec
             # Put ourselves into our own pgrp, for sanity
             os.setpgrp()
 
+            # Wait to be moved into the task's cgroup before exec so every
+            # descendant is accounted to it
+            if self.cgroup:
+                os.close(joined_write)
+                os.read(joined_read, 1)
+                os.close(joined_read)
+
             # Configure STDOUT and STDERR
             self.logmanager.setup_stdout()
             self.logmanager.setup_stderr()
@@ -114,9 +146,36 @@ class ProcessHarness(object):
             args = [cmd, "-c", self.command]
             os.execvp(cmd, args)
 
-        self.child_proc = process.Process(pid)
+        if self.cgroup:
+            os.close(joined_read)
+            self.join_cgroup(pid)
+            os.close(joined_write)
+
+        for constraint in self.constraints:
+            constraint.reset()
+
+        with self.child_changed:
+            if self.child_proc:
+                self.child_proc.close()
+            self.child_proc = process.Process(pid, usage_feed=self.usage_feed,
+                                              cgroup=self.cgroup,
+                                              track_io=self.track_io)
+            self.child_changed.notify_all()
         self.start_count += 1
 
+    def join_cgroup(self, pid):
+        """
+        Move the child into the task's cgroup.  If it can't be moved, usage
+        read from the cgroup would miss the whole task, so stop using the
+        cgroup and sample /proc instead.
+        """
+        try:
+            self.cgroup.add_pid(pid)
+        except (IOError, OSError):
+            print("Couldn't join cgroup %s, using /proc" % self.cgroup)
+            self.cgroup.destroy()
+            self.cgroup = None
+
     def do_monitoring(self):
         """
         Begin monitoring the child process
@@ -132,20 +191,24 @@ class ProcessHarness(object):
 
             for constraint in self.constraints:
                 if constraint.check_violation(self.child_proc):
+                    noticed = time.time()
                     if self.child_violation_occured(constraint):
                         print("Restarting child command %s" % self.command)
                         self.start_process()
+                        self.record_restart(noticed)
                         restarted = True
 
             if not self.child_proc.is_alive():
                 # The child proc could have died inbetween checking
                 # constraints and now.  If there is a LivingConstraint
                 # then fire it
+                noticed = time.time()
                 for constraint in self.constraints:
                     if str(constraint) == "LivingConstraint":
                         if self.child_violation_occured(constraint):
                             print("Restarting child command %s" % self.command)
                             self.start_process()
+                            self.record_restart(noticed)
                             restarted = True
 
                 # If we restarted the child proc we don't want to set
@@ -155,10 +218,69 @@ class ProcessHarness(object):
                     # so set running to false
                     print("Child exited on its own, not asked to " + \
                         "restart it, exiting")
-                    self.child_running = False
+                    self.stop_child_running()
                     return
 
-            time.sleep(self.poll_interval)
+            # Wakes up early if the child exits
+            self.child_proc.wait_for_exit(self.next_poll_interval())
+
+    def record_restart(self, noticed):
+        self.last_restart_latency = time.time() - noticed
+        self.total_restart_latency += self.last_restart_latency
+        self.restart_count += 1
+
+    def get_utilisation(self):
+        """
+        Return the highest utilisation over all constraints, or None if no
+        constraint reports one
+        """
+        values = [constraint.utilisation(self.child_proc)
+                  for constraint in self.constraints]
+        values = [value for value in values if value is not None]
+        if not values:
+            return None
+
+        return max(values)
+
+    def next_poll_interval(self):
+        """
+        Work out how long to sleep before the next check.
+
+        Backs off towards max_poll_interval while every constraint is well
+        under its limit, and drops straight back to poll_interval when usage
+        gets close to a limit or is climbing fast enough to reach it before
+        the next check.
+        """
+        if self.max_poll_interval == self.poll_interval:
+            return self.poll_interval
+
+        utilisation = self.get_utilisation()
+        if utilisation is None:
+            target = self.max_poll_interval
+        elif utilisation >= self.tight_utilisation:
+            target = self.poll_interval
+        else:
+            headroom = 1 - utilisation / self.tight_utilisation
+            target = (self.poll_interval +
+                      (self.max_poll_interval - self.poll_interval) *
+                      headroom)
+
+            if self.last_utilisation is not None:
+                rate = ((utilisation - self.last_utilisation) /
+                        self.current_poll_interval)
+                if rate > 0:
+                    # Check at least twice before we could hit the limit
+                    target = min(target, (1 - utilisation) / rate / 2)
+
+        self.last_utilisation = utilisation
+
+        # Tighten immediately, but only back off gradually
+        target = max(self.poll_interval, min(target, self.max_poll_interval))
+        if target > self.current_poll_interval:
+            target = min(target, self.current_poll_interval * 2)
+
+        self.current_poll_interval = target
+        return target
 
     def child_violation_occured(self, violated_constraint):
         """
@@ -178,9 +300,14 @@ class ProcessHarness(object):
                 self.start_count <= self.max_restarts):
                 return True
 
-        self.child_running = False
+        self.stop_child_running()
         return False
 
+    def stop_child_running(self):
+        with self.child_changed:
+            self.child_running = False
+            self.child_changed.notify_all()
+
     def begin_monitoring(self):
         """Split off a thread to monitor the child process"""
         monitoring_thread = threading.Thread(target=self.do_monitoring,
@@ -201,11 +328,16 @@ class ProcessHarness(object):
         """
         code = 0
         while self.child_running:
-            _, newcode = self.child_proc.wait_for_completion()
+            child_proc = self.child_proc
+            _, newcode = child_proc.wait_for_completion()
             if newcode:
                 code = newcode
 
-            print("Child %s exited %s" % (self.child_proc.pid, code))
-            time.sleep(.1)
+            print("Child %s exited %s" % (child_proc.pid, code))
+
+            # Until the monitoring thread restarts the child or gives up
+            with self.child_changed:
+                while self.child_running and self.child_proc is child_proc:
+                    self.child_changed.wait()
 
         return code
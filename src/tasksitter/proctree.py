@@ -0,0 +1,194 @@
+"""
+Incrementally track the processes which belong to a task's process group
+"""
+import os
+import time
+
+
+def read_proc_stat(pid):
+    """
+    Read and split /proc/PID/stat.
+
+    Returns: a list of columns, or None if the process no longer exists
+    """
+    try:
+        with open("/proc/%d/stat" % pid, "r") as stat_file:
+            return stat_file.readline().split(" ")
+    except (IOError, OSError):
+        return None
+
+
+def read_proc_smaps(pid):
+    """
+    Sum up the memory of pid from /proc/PID/smaps_rollup, or
+    /proc/PID/smaps on kernels older than 4.14.
+
+    Returns: a dict with rss, pss and uss in bytes, or None if the
+    process no longer exists
+    """
+    fields = {'Rss:': 'rss',
+              'Pss:': 'pss',
+              'Private_Clean:': 'uss',
+              'Private_Dirty:': 'uss'}
+
+    for filename in ("smaps_rollup", "smaps"):
+        totals = {'rss': 0, 'pss': 0, 'uss': 0}
+        try:
+            with open("/proc/%d/%s" % (pid, filename), "r") as smaps:
+                for line in smaps:
+                    columns = line.split()
+                    if columns and columns[0] in fields:
+                        # Values are in kB
+                        totals[fields[columns[0]]] += int(columns[1]) * 1024
+            return totals
+        except (IOError, OSError):
+            if not os.path.exists("/proc/%d" % pid):
+                return None
+
+    return None
+
+
+def read_proc_io(pid):
+    """
+    Read /proc/PID/io.
+
+    Returns: a dict of counter name -> value, or None if the process
+    no longer exists (or we aren't allowed to read it)
+    """
+    counters = {}
+    try:
+        with open("/proc/%d/io" % pid, "r") as io_file:
+            for line in io_file:
+                key, value = line.split(":")
+                counters[key] = int(value)
+    except (IOError, OSError, ValueError):
+        return None
+
+    return counters
+
+
+def list_pids():
+    """
+    Return the set of every pid currently in the kernel process table
+    """
+    pids = set()
+    for proc in os.listdir('/proc'):
+        try:
+            pids.add(int(proc))
+        except ValueError:
+            # proc isn't a pid
+            pass
+
+    return pids
+
+
+class ProcessTree(object):
+    """
+    Keep track of the members of a process group without reading the
+    stat file of every process on the machine on each update.
+
+    Where the kernel exposes /proc/PID/task/TID/children the tree is
+    walked down from the known members.  Otherwise the pid list in /proc
+    is diffed against the previous update and only new pids are read.
+    Either way a full scan is done every full_scan_interval seconds to
+    pick up anything the incremental path missed (e.g. reused pids).
+    """
+
+    full_scan_interval = 30
+
+    def __init__(self, pgrp):
+        self.pgrp = pgrp
+        self.members = set([pgrp])
+        self.seen_pids = set()
+        self.last_full_scan = 0
+        self.children_supported = os.path.exists(
+            "/proc/%d/task/%d/children" % (pgrp, pgrp))
+
+    def is_member(self, columns):
+        return int(columns[4]) == self.pgrp
+
+    def get_children(self, pid):
+        """
+        Return the pids of the direct children of every thread in pid
+        """
+        children = []
+        try:
+            tids = os.listdir("/proc/%d/task" % pid)
+        except OSError:
+            return children
+
+        for tid in tids:
+            try:
+                with open("/proc/%d/task/%s/children" % (pid, tid)) as fileh:
+                    children.extend([int(c) for c in fileh.read().split()])
+            except (IOError, OSError, ValueError):
+                pass
+
+        return children
+
+    def _walk_children(self):
+        """
+        Read the known members and everything below them in the tree.
+        """
+        stats = {}
+        visited = set()
+        frontier = list(self.members)
+        while frontier:
+            pid = frontier.pop()
+            if pid in visited:
+                continue
+            visited.add(pid)
+
+            columns = read_proc_stat(pid)
+            if not columns or not self.is_member(columns):
+                continue
+
+            stats[pid] = columns
+            frontier.extend(self.get_children(pid))
+
+        return stats
+
+    def _diff_pids(self):
+        """
+        Read the known members plus any pid that appeared since the
+        last update.
+        """
+        stats = {}
+        pids = list_pids()
+        for pid in (pids - self.seen_pids) | (self.members & pids):
+            columns = read_proc_stat(pid)
+            if columns and self.is_member(columns):
+                stats[pid] = columns
+
+        self.seen_pids = pids
+        return stats
+
+    def _full_scan(self):
+        stats = {}
+        pids = list_pids()
+        for pid in pids:
+            columns = read_proc_stat(pid)
+            if columns and self.is_member(columns):
+                stats[pid] = columns
+
+        self.seen_pids = pids
+        return stats
+
+    def refresh(self):
+        """
+        Update the member list.
+
+        Returns: a dict of pid -> /proc/PID/stat columns for every
+        process in the group
+        """
+        now = time.time()
+        if now - self.last_full_scan > self.full_scan_interval:
+            stats = self._full_scan()
+            self.last_full_scan = now
+        elif self.children_supported:
+            stats = self._walk_children()
+        else:
+            stats = self._diff_pids()
+
+        self.members = set(stats.keys())
+        return stats
@@ -7,6 +7,7 @@ import socket
 import threading
 import time
 from sittercommon.address import ExternalAddress
+from sittercommon.history import UsageHistory
 
 
 class StatsCollector(object):
@@ -15,6 +16,7 @@ class StatsCollector(object):
     """
 
     hostname_expire = 600
+    history_interval = 1
 
     def __init__(self, harness):
         self.hostname_create = None
@@ -22,6 +24,10 @@ class StatsCollector(object):
         self.hostname = None
         self.harness = harness
         self.thread = None
+        self.stopped = False
+        # Only recorded once start() is called, which only the tasksitter
+        # does
+        self.history = None
         self.update_hostname()
 
     def update_hostname(self):
@@ -36,14 +42,25 @@ class StatsCollector(object):
         """
         Public interface to start the collection thread
         """
-        self.thread = threading.Thread(target=self._start_collecting)
+        self.history = UsageHistory()
+        self.thread = threading.Thread(target=self._start_collecting,
+                                       name="StatsCollector")
+        self.thread.daemon = True
         self.thread.start()
 
+    def stop(self):
+        self.stopped = True
+
     def _start_collecting(self):
         """
         Collect stats as the process is running.
         """
-        pass
+        while not self.stopped:
+            child_proc = self.harness.child_proc
+            self.history.record(child_proc.cpu_usage,
+                                child_proc.mem_usage[1],
+                                child_proc.mem_usage[0])
+            time.sleep(self.history_interval)
 
     def get_live_data(self):
         """
@@ -57,9 +74,25 @@ class StatsCollector(object):
         for constraint, count in list(self.harness.violations.items()):
             data['violated_%s' % constraint] = count
 
+        for constraint in self.harness.constraints:
+            utilisation = constraint.utilisation(self.harness.child_proc)
+            if utilisation is not None:
+                data['utilisation_%s' % constraint] = utilisation
+        data['max_utilisation'] = self.harness.get_utilisation()
+
+        data['poll_interval'] = self.harness.current_poll_interval
+        data['last_restart_latency'] = self.harness.last_restart_latency
+        if self.harness.restart_count:
+            data['avg_restart_latency'] = (self.harness.total_restart_latency /
+                                           self.harness.restart_count)
         data['cpu_usage'] = self.harness.child_proc.cpu_usage
         data['mem_usage_vmem'] = self.harness.child_proc.mem_usage[0]
         data['mem_usage_res'] = self.harness.child_proc.mem_usage[1]
+        for key, value in list(self.harness.child_proc.mem_detail.items()):
+            data['mem_usage_%s' % key] = value
+        for key, value in list(self.harness.child_proc.io_rates.items()):
+            data['io_%s_rate' % key] = value
+
         data['system_usage'] = self.harness.child_proc.system_usage
 
         return data
@@ -86,6 +119,7 @@ class StatsCollector(object):
                 'file_version': file_version,
                 'dir_version': dir_version,
                 'launch_location': self.harness.launch_location,
+                'cgroup': self.harness.cgroup and str(self.harness.cgroup),
                 'constraints': ','.join(
                 [str(c) for c in self.harness.constraints])
                 }
@@ -0,0 +1,112 @@
+"""
+Benchmark request latency of the threaded and asyncio HTTPMonitor servers
+with 1, 50 and 500 concurrent keep-alive clients polling /stats.
+
+Run from the repository root:
+    PYTHONPATH=src python test/bench_async_http.py [seconds per case]
+"""
+import asyncio
+import multiprocessing
+import sys
+import time
+
+from sittercommon import http_monitor
+
+PORT = 18300
+CONCURRENCY = [1, 50, 500]
+
+
+class FakeHarness(object):
+    logmanager = None
+
+
+class FakeStats(object):
+    def get_metadata(self):
+        return dict([("stat%d" % i, i) for i in range(40)])
+
+    def get_live_data(self):
+        return {'cpu_usage': .5, 'mem_usage': [1024, 2048]}
+
+
+def serve(port, use_asyncio):
+    monitor = http_monitor.HTTPMonitor(FakeStats(), FakeHarness(), port,
+                                       use_asyncio=use_asyncio,
+                                       max_connections=1000)
+    # Don't measure request logging to stderr
+    http_monitor.HTTPMonitorHandler.log_message = lambda *args: None
+    monitor.start()
+    monitor.run_thread.join()
+
+
+async def request(reader, writer, keepalive):
+    writer.write(b'GET /stats?nohtml=1&format=json HTTP/1.1\r\n'
+                 b'Host: localhost\r\n%s\r\n' % (
+                     b'' if keepalive else b'Connection: close\r\n'))
+    head = await reader.readuntil(b'\r\n\r\n')
+    length = 0
+    for line in head.split(b'\r\n'):
+        if line.lower().startswith(b'content-length:'):
+            length = int(line.split(b':')[1])
+    await reader.readexactly(length)
+
+
+async def client(port, deadline, latencies, keepalive):
+    """
+    Poll until deadline, over one connection if keepalive is set,
+    otherwise with a new connection per request.
+    """
+    connection = await asyncio.open_connection('localhost', port)
+    while time.time() < deadline:
+        start = time.time()
+        if not connection:
+            connection = await asyncio.open_connection('localhost', port)
+
+        await request(connection[0], connection[1], keepalive)
+        latencies.append(time.time() - start)
+
+        if not keepalive:
+            connection[1].close()
+            connection = None
+
+    if connection:
+        connection[1].close()
+
+
+async def run_clients(port, concurrency, duration, keepalive):
+    latencies = []
+    deadline = time.time() + duration
+    await asyncio.gather(*[client(port, deadline, latencies, keepalive)
+                           for _ in range(concurrency)])
+    return sorted(latencies)
+
+
+def percentile(values, percent):
+    return values[min(len(values) - 1, int(len(values) * percent / 100.0))]
+
+
+def main(duration=3.0):
+    for use_asyncio, name in [(False, "threaded"), (True, "asyncio")]:
+        port = PORT + int(use_asyncio)
+        server = multiprocessing.Process(target=serve,
+                                         args=(port, use_asyncio))
+        server.daemon = True
+        server.start()
+        time.sleep(.5)
+
+        for keepalive in (True, False):
+            for concurrency in CONCURRENCY:
+                latencies = asyncio.run(run_clients(port, concurrency,
+                                                    duration, keepalive))
+                print("%-8s %-10s %4d clients: %6.0f requests/s  "
+                      "p50 %7.2fms  p99 %7.2fms" % (
+                          name, "keep-alive" if keepalive else "close",
+                          concurrency, len(latencies) / duration,
+                          percentile(latencies, 50) * 1000,
+                          percentile(latencies, 99) * 1000))
+
+        server.terminate()
+        server.join()
+
+
+if __name__ == '__main__':
+    main(*[float(arg) for arg in sys.argv[1:2]])
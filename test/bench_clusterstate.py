@@ -0,0 +1,106 @@
+"""
+Benchmark a ClusterState.calculate() cycle on clusters of 100 to 10000
+machines, each running a few tasks, where nothing needs to change.
+
+Run from the repository root:
+    PYTHONPATH=src python test/bench_clusterstate.py [max machines]
+"""
+import logging
+import shutil
+import sys
+import tempfile
+import time
+
+from clustersitter.clusterstate import ClusterState
+from clustersitter.machinemonitor import MachineMonitor
+
+ZONES = ['us-east-1a', 'us-east-1b', 'us-west-2a', 'us-west-2b']
+JOBS = 20
+TASKS_PER_MACHINE = 3
+
+
+class FakeConfig(object):
+    def __init__(self, hostname, zone):
+        self.hostname = hostname
+        self.shared_fate_zone = zone
+        self.dns_name = None
+        self.ip = None
+
+
+class FakeMachine(object):
+    datamanager = None
+
+    def __init__(self, number, tasks):
+        self.hostname = "machine%d" % number
+        self.config = FakeConfig(self.hostname, ZONES[number % len(ZONES)])
+        self.tasks = dict([(name, {'name': name, 'running': True})
+                           for name in tasks])
+
+    def is_initialized(self):
+        return True
+
+    def has_loaded_data(self):
+        return True
+
+    def get_tasks(self):
+        return self.tasks
+
+
+class FakeJob(object):
+    persistent = False
+    linked_job = None
+
+    def __init__(self, name):
+        self.name = name
+
+    def find_linked_job(self):
+        return None
+
+
+class FakeSitter(object):
+    stats_poll_interval = 5
+
+    def __init__(self, log_location):
+        self.log_location = log_location
+
+
+def build_state(sitter, count):
+    state = ClusterState(sitter)
+    monitor = MachineMonitor(sitter, 0)
+    state.monitors.append((monitor, None))
+    for i in range(JOBS):
+        state.jobs["job%d" % i] = FakeJob("job%d" % i)
+
+    for i in range(count):
+        machine = FakeMachine(i, ["job%d" % ((i + j) % JOBS)
+                                  for j in range(TASKS_PER_MACHINE)])
+        state.add_machine(machine, existing=True)
+        monitor.add_machine(machine)
+
+    return state
+
+
+def main(max_machines=10000):
+    logging.disable(logging.WARNING)
+    log_location = tempfile.mkdtemp()
+    try:
+        sitter = FakeSitter(log_location)
+        count = 100
+        while count <= max_machines:
+            start = time.time()
+            state = build_state(sitter, count)
+            built = time.time() - start
+
+            start = time.time()
+            state.calculate()
+            calculated = time.time() - start
+
+            print("%6d machines: built in %8.3fs, calculate() %8.3fs" % (
+                count, built, calculated))
+            count *= 10
+    finally:
+        shutil.rmtree(log_location)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
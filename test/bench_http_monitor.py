@@ -0,0 +1,87 @@
+"""
+Benchmark rendering the /stats and /overview pages with a template engine
+built per request (as HTTPMonitorHandler used to) against the engine
+shared by every request of an HTTPMonitor.
+
+Run from the repository root:
+    PYTHONPATH=src python test/bench_http_monitor.py [seconds per case]
+"""
+import sys
+import time
+
+from sittercommon import http_monitor
+
+# Templates are rendered with the caller's globals, which need tenjin's
+from tenjin.helpers import *
+
+
+class FakeHarness(object):
+    logmanager = None
+    launch_location = "."
+
+
+def overview_data(num_machines=20, num_tasks=5):
+    machines = []
+    for i in range(num_machines):
+        tasks = {}
+        for j in range(num_tasks):
+            tasks["task%d" % j] = {'name': "task%d" % j, 'cpu_usage': .5,
+                                   'mem_usage': 1024, 'max_utilisation': .3}
+        machines.append({'hostname': "machine%d" % i,
+                         'repr': "machine%d" % i,
+                         'url': "http://machine%d:40000" % i,
+                         'tasks': tasks,
+                         'config': {'shared_fate_zone': 'zone',
+                                    'dns_name': "machine%d" % i,
+                                    'cpus': 4, 'bits': 64, 'mem': 8192,
+                                    'disk': 100},
+                         'is_in_deployment': False, 'initialized': True,
+                         'has_loaded_data': True, 'pull_failures': 0,
+                         'idle': False})
+
+    return {'clustersitter_pid': 1, 'dns_provider_config': {}, 'events': [],
+            'hot_tasks': [], 'jobs': [], 'keys': [], 'launch_location': '.',
+            'launch_time': 0, 'load_fifteen_min': 0, 'load_five_min': 0,
+            'load_one_min': 0, 'log_location': '.', 'logfiles': {},
+            'login_user': 'root', 'machines': machines, 'monitors': [],
+            'other_threads': [], 'provider_config': {}, 'providers': [],
+            'start_state': '', 'std_threads': [], 'threads': [],
+            'utilisation_critical': .95, 'utilisation_warning': .8}
+
+
+def stats_data():
+    return dict([("stat%d" % i, i) for i in range(40)])
+
+
+def run(name, render, duration):
+    count = 0
+    start = time.time()
+    while time.time() - start < duration:
+        render()
+        count += 1
+
+    rate = count / (time.time() - start)
+    print("%-32s %10.1f requests/s" % (name, rate))
+    return rate
+
+
+def main(duration=2.0):
+    monitor = http_monitor.HTTPMonitor(None, FakeHarness(), 0)
+    pages = [('/stats', 'stats.html', {'data': stats_data()}),
+             ('/overview', 'cluster_overview.html',
+              {'data': overview_data(), 'pagewidth': 1300})]
+
+    for path, template, context in pages:
+        per_request = run(
+            "%s (engine per request)" % path,
+            lambda: monitor.build_engine().render(template, dict(context)),
+            duration)
+        shared = run(
+            "%s (shared engine)" % path,
+            lambda: monitor.engine.render(template, dict(context)),
+            duration)
+        print("%-32s %10.1fx" % ("%s speedup" % path, shared / per_request))
+
+
+if __name__ == '__main__':
+    main(*[float(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,183 @@
+"""
+Benchmark a pass over every machine by the threaded MachineMonitors (each
+polling its share of the machines in turn) against the
+AsyncMachineMonitor (polling them all from one event loop).
+
+Every machine is a different 127.0.x.y address of one fake
+machinesitter, which answers /all_stats after a delay like a loaded
+machine across a network would.  It listens on port 40000, where
+MonitoredMachines first look for a machinesitter.
+
+Needs four file descriptors per machine.  Run from the repository root:
+    PYTHONPATH=src python test/bench_machinemonitor.py [delay in seconds]
+"""
+import asyncio
+import concurrent.futures
+import logging
+import sys
+import threading
+import time
+
+import simplejson
+
+from clustersitter.machineconfig import MachineConfig
+from clustersitter.machinemonitor import AsyncMachineMonitor
+from clustersitter.monitoredmachine import MonitoredMachine
+from sittercommon import machinedata
+
+PORT = 40000
+THREADS = 4
+# The threaded monitors take about delay * machines / THREADS per pass
+MAX_THREADED_MACHINES = 500
+
+
+class FakeClusterSitter(object):
+    stats_poll_interval = 5
+    push_reconcile_interval = 60
+
+
+def all_stats(num_tasks=5):
+    machine = {}
+    tasks = {}
+    for i in range(num_tasks):
+        name = "task%d" % i
+        machine["%s-name" % name] = name
+        machine["%s-running" % name] = True
+        machine["%s-monitoring" % name] = (
+            '<a href="http://localhost:%d">%s</a>' % (PORT + 1 + i, name))
+        tasks[name] = {'cpu_usage': .5, 'mem_usage': 1024}
+
+    return {'version': 1, 'full': True, 'removed': [],
+            'changed': {'machine': machine, 'tasks': tasks}}
+
+
+class FakeMachineSitter(object):
+    """
+    Answers /all_stats?since= with the full stats, or nothing new if the
+    poller already has them, after delay seconds.  Anything else gets
+    the /identify answer, to be recognised as a machinesitter straight
+    away.
+    """
+    def __init__(self, delay):
+        self.delay = delay
+        self.full = simplejson.dumps(all_stats()).encode()
+        self.unchanged = simplejson.dumps(
+            {'version': 1, 'full': False, 'changed': {},
+             'removed': []}).encode()
+        self.identity = simplejson.dumps({'machinesitter_pid': 1}).encode()
+        self.started = threading.Event()
+
+    def start(self):
+        thread = threading.Thread(target=asyncio.run, args=(self._serve(),))
+        thread.daemon = True
+        thread.start()
+        self.started.wait()
+
+    async def _serve(self):
+        server = await asyncio.start_server(self._handle, '0.0.0.0', PORT,
+                                            backlog=4096)
+        self.started.set()
+        async with server:
+            await server.serve_forever()
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                request = await reader.readuntil(b'\r\n\r\n')
+                path = request.split(b' ', 2)[1]
+                if path.startswith(b'/all_stats'):
+                    await asyncio.sleep(self.delay)
+                    if b'since=1' in path:
+                        body = self.unchanged
+                    else:
+                        body = self.full
+                else:
+                    body = self.identity
+
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n"
+                             % len(body) + body)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+def build_machines(count):
+    machines = []
+    for i in range(count):
+        config = MachineConfig("127.0.%d.%d" % (1 + i // 250, 1 + i % 250),
+                               "zone", 4, 8192)
+        machines.append(MonitoredMachine(config))
+
+    with concurrent.futures.ThreadPoolExecutor(16) as pool:
+        list(pool.map(lambda machine: machine.initialize(), machines))
+    close_sessions()
+    return machines
+
+
+def close_sessions():
+    # Finding the machinesitters left a connection open to each
+    for session in list(machinedata.http_pool.sessions.values()):
+        session.close()
+    machinedata.http_pool.sessions.clear()
+
+
+def threaded_pass(machines):
+    def poll(share):
+        for machine in share:
+            machine._api_get_stats()
+
+    threads = [threading.Thread(target=poll, args=(machines[i::THREADS],))
+               for i in range(THREADS)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.time() - start
+
+
+async def async_pass(monitor, machines):
+    start = time.time()
+    results = await monitor.poll_once(machines)
+    elapsed = time.time() - start
+    if not all(results):
+        print("  %d polls failed" % results.count(False))
+    return elapsed
+
+
+def main(delay=.05):
+    logging.disable(logging.WARNING)
+    FakeMachineSitter(delay).start()
+    sitter = FakeClusterSitter()
+    print("Machinesitters answer /all_stats after %.0fms" % (delay * 1000))
+
+    for count in (10, 100, 1000, 5000):
+        machines = build_machines(count)
+        monitor = AsyncMachineMonitor(sitter, 0, max_in_flight=1000,
+                                      poll_deadline=60)
+
+        async def run():
+            # Fetch the full stats first
+            await monitor.poll_once(machines)
+            times = [await async_pass(monitor, machines) for _ in range(3)]
+            for machine in machines:
+                monitor._close(machine)
+            return times
+
+        async_time = min(asyncio.run(run()))
+
+        if count <= MAX_THREADED_MACHINES:
+            threaded_pass(machines)
+            threaded = "%8.2fs" % threaded_pass(machines)
+            close_sessions()
+        else:
+            threaded = "%9s" % "-"
+
+        print("%5d machines: %d threads %s, asyncio %8.2fs" % (
+            count, THREADS, threaded, async_time))
+
+
+if __name__ == '__main__':
+    main(*[float(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,60 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from tasksitter import cgroup
+
+
+class CGroupTests(unittest.TestCase):
+
+    def setUp(self):
+        # Fake a cgroup2 mount with a delegated parent
+        self.root = tempfile.mkdtemp()
+        open(os.path.join(self.root, "cgroup.controllers"), "w").close()
+        self.parent = os.path.join(self.root, "cerebro")
+        self.group = cgroup.CGroup("task", self.parent)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def write(self, filename, data):
+        with open(os.path.join(self.group.path, filename), "w") as fileh:
+            fileh.write(data)
+
+    def test_is_available(self):
+        self.assertTrue(cgroup.CGroup.is_available(self.parent))
+        self.assertFalse(cgroup.CGroup.is_available(
+            os.path.join(self.parent, "missing", "cerebro")))
+
+    def test_limits(self):
+        self.group.create()
+        self.group.set_cpu_limit(.5)
+        self.group.set_memory_limit(10 * 1024 * 1024)
+
+        path = self.group.path
+        self.assertEqual("50000 100000", open(
+            os.path.join(path, "cpu.max")).read())
+        self.assertEqual("10485760", open(
+            os.path.join(path, "memory.max")).read())
+
+    def test_accounting(self):
+        self.group.create()
+        self.write("cpu.stat", "usage_usec 1000\nuser_usec 800\n")
+        self.write("memory.current", "4096\n")
+
+        self.assertEqual(0, self.group.update_cpu_usage())
+        self.group.last_cpu_read -= 1
+        self.write("cpu.stat", "usage_usec 501000\nuser_usec 800\n")
+        self.assertAlmostEqual(.5, self.group.update_cpu_usage(), places=2)
+        self.assertEqual(4096, self.group.get_memory_usage())
+
+    def test_io_accounting(self):
+        self.group.create()
+        self.assertRaises(IOError, self.group.get_io_usage)
+
+        self.write("io.stat",
+                   "8:0 rbytes=4096 wbytes=100 rios=1 wios=1 dbytes=0 "
+                   "dios=0\n8:16 rbytes=1000 wbytes=0 rios=1 wios=0\n")
+        self.assertEqual({'read_bytes': 5096, 'write_bytes': 100},
+                         self.group.get_io_usage())
@@ -0,0 +1,135 @@
+import random
+import unittest
+
+try:
+    from clustersitter.clusterstate import ClusterState, JobState
+except (ImportError, SyntaxError):
+    ClusterState = JobState = None
+
+NAMES = ["web", "db", "cache"]
+ZONES = ["zone-a", "zone-b", "zone-c"]
+STATUSES = ['deploying', 'running', 'stopped']
+
+
+class FakeConfig(object):
+    def __init__(self, zone):
+        self.shared_fate_zone = zone
+
+
+class FakeMachine(object):
+    def __init__(self, number):
+        self.hostname = "machine%d" % number
+        self.config = FakeConfig(ZONES[number % len(ZONES)])
+
+    def __repr__(self):
+        return self.hostname
+
+
+class FakeSitter(object):
+    stats_poll_interval = 5
+    log_location = "/nonexistent"
+
+
+MACHINES = [FakeMachine(i) for i in range(6)]
+
+
+def scan_task_item(state, name, machine):
+    for task in state.tasks.get(name, []):
+        if task['machine'] == machine:
+            return task
+    return None
+
+
+def scan_machine_tasks(state, machine, status=None):
+    return set([name for name, tasks in state.tasks.items()
+                for task in tasks if task['machine'] == machine and
+                (status is None or task['status'] == status)])
+
+
+@unittest.skipIf(JobState is None, "clustersitter isn't importable")
+class IndexTests(unittest.TestCase):
+    """
+    Every lookup through an index gives what scanning the lists would,
+    after any sequence of changes.
+    """
+
+    def check_jobs(self, jobs):
+        for machine in MACHINES + [None]:
+            for name in NAMES:
+                self.assertTrue(scan_task_item(jobs, name, machine) is
+                                jobs._get_task_item(name, machine))
+            for status in [None] + STATUSES:
+                self.assertEqual(scan_machine_tasks(jobs, machine, status),
+                                 jobs.get_machine_tasks(machine, status))
+            self.assertEqual(not scan_machine_tasks(jobs, machine),
+                             jobs.is_machine_idle(machine))
+
+    def change_jobs(self, jobs, rng):
+        name = rng.choice(NAMES)
+        zone = rng.choice(ZONES)
+        machines = rng.sample(MACHINES, rng.randint(0, 3))
+        operation = rng.randint(0, 6)
+        if operation == 0:
+            jobs.add_tasks(name, zone, machines, create=rng.randint(0, 2),
+                           status=rng.choice(STATUSES))
+        elif operation == 1:
+            jobs.remove_tasks(name, rng.choice([None, machines]))
+        elif operation == 2:
+            jobs.remove_machine(rng.choice(MACHINES))
+        elif operation == 3:
+            jobs.update_tasks(name, rng.choice(STATUSES),
+                              rng.choice([None, machines]))
+        elif operation == 4:
+            jobs.set_pending_deploying(zone, name, rng.randint(1, 3))
+        else:
+            # Can put a task on a machine which already has it
+            jobs.set_pending_machines(zone, name, machines)
+
+    def test_job_state(self):
+        rng = random.Random(1)
+        duplicates = 0
+        for _ in range(20):
+            jobs = JobState()
+            for _ in range(100):
+                self.change_jobs(jobs, rng)
+                self.check_jobs(jobs)
+                duplicates += len([
+                    task for name in NAMES for machine in MACHINES
+                    for task in jobs.tasks.get(name, [])[1:]
+                    if task['machine'] is machine and
+                    scan_task_item(jobs, name, machine) is not task])
+
+        # The tricky case for _task_items was covered
+        self.assertTrue(duplicates)
+
+    def test_cluster_state(self):
+        rng = random.Random(2)
+        state = ClusterState(FakeSitter())
+        for _ in range(500):
+            machine = rng.choice(MACHINES)
+            operation = rng.randint(0, 2)
+            if operation == 0:
+                state.add_machine(machine)
+            elif operation == 1:
+                state.remove_machine(machine)
+            else:
+                self.change_jobs(state.desired_jobs, rng)
+
+            for machine in MACHINES:
+                item = None
+                for machine_item in state.machines:
+                    if machine_item['machine'] is machine:
+                        item = machine_item
+                self.assertTrue(item is state._get_machine_item(machine))
+                self.assertEqual(
+                    bool(item) and not scan_machine_tasks(
+                        state.desired_jobs, machine),
+                    bool(state.is_machine_idle(machine)))
+
+            zones = rng.sample(ZONES, rng.randint(1, len(ZONES)))
+            expected = dict([(zone, []) for zone in zones])
+            for item in state.machines:
+                expected.setdefault(item['zone'], [])
+                if item['zone'] in zones:
+                    expected[item['zone']].append(item['machine'])
+            self.assertEqual(expected, state.get_machines(zones=zones))
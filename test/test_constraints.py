@@ -0,0 +1,55 @@
+import unittest
+
+from tasksitter import constraints
+
+
+class SmoothingTests(unittest.TestCase):
+
+    def constraint(self, smoothing, grace_period=0):
+        constraint = constraints.Constraint("test", 1)
+        constraint.set_flexibility(constraints.parse_smoothing(smoothing),
+                                   grace_period)
+        return constraint
+
+    def test_parse(self):
+        self.assertEqual((None, ()), constraints.parse_smoothing("none"))
+        self.assertEqual(('ewma', (.5,)),
+                         constraints.parse_smoothing("ewma:.5"))
+        self.assertEqual(('percentile', (90, 30)),
+                         constraints.parse_smoothing("percentile:90:30"))
+
+        for spec in ("ewma:0", "ewma:1.5", "ewma:x", "percentile:101",
+                     "percentile:-1", "percentile:50:0", "median",
+                     "ewma:.5:1"):
+            self.assertRaises(ValueError, constraints.parse_smoothing, spec)
+
+    def test_ewma(self):
+        constraint = self.constraint("ewma:.5")
+        self.assertFalse(constraint.check_utilisation(.5, now=100))
+        # (2 + .5) / 2
+        self.assertTrue(constraint.check_utilisation(2, now=101))
+        self.assertEqual(1.25, constraint.current_utilisation)
+        # (.5 + 1.25) / 2
+        self.assertFalse(constraint.check_utilisation(.5, now=102))
+        self.assertEqual(.875, constraint.current_utilisation)
+
+    def test_percentile_window_in_seconds(self):
+        constraint = self.constraint("percentile:50:10")
+        for i, value in enumerate([2, 2, 2, .5]):
+            constraint.check_utilisation(value, now=100 + i)
+        self.assertEqual(2, constraint.current_utilisation)
+
+        # A minute between polls, the old samples have left the window
+        self.assertFalse(constraint.check_utilisation(.5, now=160))
+        self.assertEqual(.5, constraint.current_utilisation)
+        self.assertEqual(1, len(constraint.samples))
+
+    def test_grace_period_resets(self):
+        constraint = self.constraint("none", grace_period=5)
+        self.assertFalse(constraint.check_utilisation(2, now=100))
+        self.assertFalse(constraint.check_utilisation(2, now=104))
+        # Dips under the limit, the grace period starts again
+        self.assertFalse(constraint.check_utilisation(.9, now=104.5))
+        self.assertFalse(constraint.check_utilisation(2, now=105))
+        self.assertFalse(constraint.check_utilisation(2, now=109))
+        self.assertTrue(constraint.check_utilisation(2, now=110))
@@ -0,0 +1,41 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from sittercommon import filewatch
+
+
+class FileWatcherTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, "log")
+        open(self.filename, "w").close()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def append(self, data):
+        with open(self.filename, "a") as fileh:
+            fileh.write(data)
+
+    def check_watcher(self, watcher):
+        self.assertFalse(watcher.wait(.1))
+        self.append("more\n")
+        self.assertTrue(watcher.wait(1))
+
+        os.rename(self.filename, self.filename + ".1")
+        self.assertTrue(watcher.wait(1))
+        watcher.close()
+
+    def test_inotify(self):
+        watcher = filewatch.FileWatcher(self.filename)
+        if watcher.inotify_fd is None:
+            self.skipTest("inotify isn't available")
+        self.check_watcher(watcher)
+
+    def test_polling(self):
+        watcher = filewatch.FileWatcher(self.filename, poll_interval=.01)
+        watcher.close()
+        self.check_watcher(watcher)
@@ -0,0 +1,96 @@
+import array
+import time
+import unittest
+
+from machinesitter.machinestats import MachineStats
+from sittercommon import history, http_monitor
+from tasksitter.stats_collector import StatsCollector
+
+try:
+    from clustersitter.clusterstats import ClusterStats
+except (ImportError, SyntaxError):
+    ClusterStats = None
+
+
+class UsageHistoryTests(unittest.TestCase):
+
+    def test_ring_buffer_wraps(self):
+        ring = history.RingBuffer(3)
+        for i in range(5):
+            ring.append([i + 1, i, 0, 0])
+
+        times, values = ring.get('cpu')
+        self.assertEqual([3, 4, 5], times.tolist())
+        self.assertEqual([2, 3, 4], values.tolist())
+        self.assertEqual([5], ring.get('cpu', since=4)[0].tolist())
+
+    def test_downsampling(self):
+        usage = history.UsageHistory(tiers=[(1, 10), (5, 100)])
+        start = int(time.time()) - 20
+        start -= start % 5
+        for i in range(20):
+            usage.record(i, i * 2, 0, timestamp=start + i)
+
+        fine = usage.get('cpu', since=start + 16)
+        self.assertEqual(1, fine['resolution'])
+        # The newest second is still pending
+        self.assertEqual([16, 17, 18], fine['values'].tolist())
+        self.assertEqual(10, len(usage.get('cpu', resolution=1)['times']))
+
+        coarse = usage.get('rss', since=0)
+        self.assertEqual(5, coarse['resolution'])
+        self.assertEqual([4.0, 14.0, 24.0], coarse['values'].tolist())
+
+    def test_unknown_metric(self):
+        self.assertEqual(None, history.UsageHistory().get('disk'))
+
+    def test_binary(self):
+        usage = history.UsageHistory(tiers=[(1, 10)])
+        now = time.time()
+        usage.record(.5, 0, 0, timestamp=now - 2)
+        usage.record(.7, 0, 0, timestamp=now - 1)
+
+        packed = array.array('d')
+        packed.frombytes(history.to_binary(usage.get('cpu')))
+        self.assertEqual([1, 1, int(now - 1), .5], packed.tolist())
+
+
+class FakeHarness(object):
+    logmanager = None
+
+
+class FakeStats(object):
+    pass
+
+
+class HistoryHandlerTests(unittest.TestCase):
+
+    def handlers(self, stats):
+        return http_monitor.HTTPMonitor(stats, FakeHarness(), 0).handlers
+
+    def test_served_by_tasksitter(self):
+        stats = StatsCollector(FakeHarness())
+        self.assertFalse("/history" in self.handlers(stats))
+        # Record nothing
+        stats.stop()
+        stats.start()
+        self.assertTrue("/history" in self.handlers(stats))
+
+    def test_not_served_by_machinesitter(self):
+        self.assertFalse("/history" in self.handlers(
+            MachineStats(FakeHarness())))
+
+    @unittest.skipIf(ClusterStats is None, "clustersitter isn't importable")
+    def test_not_served_by_clustersitter(self):
+        self.assertFalse("/history" in self.handlers(
+            ClusterStats(FakeHarness())))
+
+    def test_json(self):
+        handler = http_monitor.HTTPMonitorHandler.__new__(
+            http_monitor.HTTPMonitorHandler)
+        handler.monitor = FakeStats()
+        handler.monitor.get_history = history.UsageHistory().get
+        args = {}
+        output = handler._get_history(args)
+        self.assertEqual('application/json',
+                         http_monitor.content_type(output, args))
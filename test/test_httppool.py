@@ -0,0 +1,68 @@
+import http.server
+import socket
+import threading
+import unittest
+
+import requests
+
+from sittercommon import httppool
+
+
+class OKHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'OK')
+
+    def log_message(self, *args):
+        pass
+
+
+class SessionPoolTests(unittest.TestCase):
+
+    def setUp(self):
+        self.server = http.server.ThreadingHTTPServer(('localhost', 0),
+                                                      OKHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.url = "http://localhost:%s" % self.server.server_address[1]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def test_connections_are_reused(self):
+        pool = httppool.SessionPool()
+        for _ in range(5):
+            self.assertEqual(b'OK', pool.get(self.url + "/stats").content)
+
+        self.assertTrue(pool.session(self.url + "/a") is
+                        pool.session(self.url + "/b"))
+        self.assertEqual({'hosts': 1, 'hits': 4, 'misses': 1},
+                         pool.get_stats())
+
+    def test_refused_connections_are_retried(self):
+        # Nothing listens on a port we just closed
+        sock = socket.socket()
+        sock.bind(('localhost', 0))
+        url = "http://localhost:%s" % sock.getsockname()[1]
+        sock.close()
+
+        pool = httppool.SessionPool(retries=2, backoff=0)
+        self.assertRaises(requests.ConnectionError, pool.get, url)
+        self.assertEqual(3, pool.get_stats()['misses'])
+
+    def test_least_recently_used_evicted(self):
+        pool = httppool.SessionPool(max_sessions=2)
+        first = pool.session("http://one:1/")
+        pool.session("http://two:2/")
+        pool.session("http://one:1/")
+        pool.session("http://three:3/")
+
+        self.assertEqual(["http://one:1", "http://three:3"],
+                         list(pool.sessions.keys()))
+        self.assertTrue(first is pool.session("http://one:1/stats"))
@@ -0,0 +1,54 @@
+import os
+import tempfile
+import unittest
+
+from sittercommon import http_monitor
+
+
+class LogfileReadingTests(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.unlink(self.filename)
+
+    def write(self, data):
+        with open(self.filename, "wb") as fileh:
+            fileh.write(data)
+
+    def test_head(self):
+        self.write(b"one\ntwo\nthree\n")
+        self.assertEqual("one\ntwo\n", http_monitor.head(self.filename, 2))
+        self.assertEqual("one\ntwo\nthree\n",
+                         http_monitor.head(self.filename, 10))
+
+    def test_tail(self):
+        self.write(b"one\ntwo\nthree\n")
+        self.assertEqual("two\nthree\n", http_monitor.tail(self.filename, 2))
+        self.assertEqual("one\ntwo\nthree\n",
+                         http_monitor.tail(self.filename, 10))
+        self.assertEqual("", http_monitor.tail(self.filename, 0))
+
+        self.write(b"one\ntwo\nthree")
+        self.assertEqual("two\nthree", http_monitor.tail(self.filename, 2))
+
+    def test_tail_across_blocks(self):
+        lines = [("line %d\n" % i).encode() for i in range(50000)]
+        self.write(b"".join(lines))
+        self.assertEqual(b"".join(lines[-20000:]).decode(),
+                         http_monitor.tail(self.filename, 20000))
+
+    def test_parse_range(self):
+        self.assertEqual((0, 10), http_monitor.parse_range("bytes=0-9", 100))
+        self.assertEqual((90, 10), http_monitor.parse_range("bytes=90-", 100))
+        self.assertEqual((80, 20), http_monitor.parse_range("bytes=-20", 100))
+        self.assertEqual((95, 5), http_monitor.parse_range("bytes=95-200",
+                                                           100))
+        self.assertEqual(None, http_monitor.parse_range("bytes=100-", 100))
+        self.assertEqual(None, http_monitor.parse_range("bytes=5-1", 100))
+        self.assertEqual(None, http_monitor.parse_range("bytes=-0", 100))
+        self.assertEqual(None, http_monitor.parse_range("bytes=-5", 0))
+        self.assertEqual(None, http_monitor.parse_range("bytes=0-1,5-6",
+                                                        100))
@@ -0,0 +1,119 @@
+import gzip
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from sittercommon import logmanager
+
+
+class FakeHarness(object):
+    command = "echo hi"
+    parent_pid = 1
+    start_count = 0
+
+
+class LogManagerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.harness = FakeHarness()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def make_manager(self, **kwargs):
+        manager = logmanager.LogManager(self.directory, **kwargs)
+        manager.set_harness(self.harness)
+        return manager
+
+    def write_start(self, manager, data):
+        filename = manager._calculate_filename(self.directory)
+        with open(filename, "a") as fileh:
+            fileh.write(data)
+        self.harness.start_count += 1
+        return filename
+
+    def test_listing_is_newest_first_and_paginated(self):
+        manager = self.make_manager()
+        for i in range(5):
+            self.write_start(manager, "run %d\n" % i)
+
+        names = manager.get_logfile_names(limit=2)
+        self.assertEqual(["stdout.3", "stdout.4"], sorted(names.keys()))
+        names = manager.get_logfile_names(offset=4, limit=2)
+        self.assertEqual(["stdout.0"], list(names.keys()))
+        self.assertTrue(manager.find_logfile("stdout.0"))
+        self.assertEqual(None, manager.find_logfile("stdout.9"))
+
+    def test_unchanged_without_limits(self):
+        manager = self.make_manager()
+        first = self.write_start(manager, "first\n")
+        self.write_start(manager, "second\n")
+        manager.maintain()
+        self.assertTrue(os.path.exists(first))
+
+    def test_compress_old_segments(self):
+        manager = self.make_manager(max_age=3600)
+        first = self.write_start(manager, "first\n")
+        live = self.write_start(manager, "second\n")
+        manager.maintain()
+
+        self.assertFalse(os.path.exists(first))
+        self.assertEqual(b"first\n", gzip.open(first + ".gz").read())
+        self.assertTrue(os.path.exists(live))
+        self.assertEqual(first + ".gz",
+                         manager.get_logfile_names()["stdout.0"])
+
+    def test_split_live_segment(self):
+        block = os.stat(self.directory).st_blksize
+        manager = self.make_manager(max_segment_bytes=10)
+        live = self.write_start(manager, "x" * (2 * block) + "y" * 10)
+        manager.maintain()
+        # Whole blocks are split off
+        self.assertEqual(b"y" * 10, open(live, "rb").read())
+        self.assertEqual(["stdout.0", "stdout.0.1"],
+                         sorted(manager.get_logfile_names().keys()))
+
+        manager.maintain()
+        self.assertEqual(b"x" * (2 * block),
+                         gzip.open(live + ".1.gz").read())
+
+    def test_split_while_writing(self):
+        manager = self.make_manager(max_segment_bytes=10, compress=False)
+        live = self.write_start(manager, "")
+        fd = manager.open_segment(live)
+        done = threading.Event()
+
+        def write():
+            for i in range(100000):
+                os.write(fd, b"%d\n" % i)
+            done.set()
+
+        writer = threading.Thread(target=write)
+        writer.start()
+        while not done.is_set():
+            manager.maintain()
+        writer.join()
+        os.close(fd)
+
+        data = b""
+        for _, _, filename in manager.get_segments(self.directory):
+            data += open(filename, "rb").read()
+        self.assertEqual(b"".join([b"%d\n" % i for i in range(100000)]),
+                         data)
+        self.assertTrue(len(manager.get_segments(self.directory)) > 2)
+
+    def test_retention(self):
+        manager = self.make_manager(max_segments=2, compress=False)
+        filenames = [self.write_start(manager, "run\n") for _ in range(4)]
+        manager.maintain()
+        self.assertEqual([False, False, True, True],
+                         [os.path.exists(f) for f in filenames])
+
+        manager = self.make_manager(max_bytes=10, compress=False)
+        filenames = [self.write_start(manager, "12345\n") for _ in range(3)]
+        manager.maintain()
+        self.assertEqual([False, False, True],
+                         [os.path.exists(f) for f in filenames])
@@ -0,0 +1,167 @@
+import http.server
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+
+from sittercommon import machinedata
+
+
+class SitterHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    body = b'{"machinesitter_pid": 1}'
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+
+class OtherHandler(SitterHandler):
+    body = b'{"pid": 1}'
+
+
+class OldSitterHandler(SitterHandler):
+    """
+    A machinesitter from before /identify
+    """
+    def do_GET(self):
+        if self.path.startswith('/identify'):
+            self.send_error(404)
+        else:
+            SitterHandler.do_GET(self)
+
+
+def free_ports(count):
+    """
+    Returns: the first of count consecutive ports nothing listens on
+    """
+    for start in range(42000, 43000, count):
+        sockets = []
+        try:
+            for port in range(start, start + count):
+                sock = socket.socket()
+                sockets.append(sock)
+                sock.bind(('localhost', port))
+            return start
+        except OSError:
+            pass
+        finally:
+            for sock in sockets:
+                sock.close()
+
+
+class FindPortTests(unittest.TestCase):
+
+    def setUp(self):
+        self.saved_cache = machinedata.port_cache
+        self.cache = machinedata.port_cache = machinedata.PortCache()
+        self.start = free_ports(4)
+        self.servers = []
+
+    def tearDown(self):
+        for server, thread in self.servers:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+        machinedata.port_cache = self.saved_cache
+
+    def serve(self, port, handler):
+        server = http.server.ThreadingHTTPServer(('localhost', port),
+                                                 handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        self.servers.append((server, thread))
+
+    def machine_data(self):
+        data = machinedata.MachineData.__new__(machinedata.MachineData)
+        data.hostname = 'localhost'
+        data.starting_port = self.start
+        data.port_range = 4
+        return data
+
+    def test_skips_other_services(self):
+        self.serve(self.start + 1, OtherHandler)
+        self.serve(self.start + 3, SitterHandler)
+
+        data = self.machine_data()
+        self.assertEqual("http://localhost:%s" % (self.start + 3),
+                         data._find_portnum())
+        self.assertEqual(self.start + 3, self.cache.get('localhost'))
+
+    def test_old_machinesitter(self):
+        self.serve(self.start + 2, OldSitterHandler)
+        data = self.machine_data()
+        data._find_portnum()
+        self.assertEqual(self.start + 2, data.portnum)
+
+    def test_cached_port_first(self):
+        self.serve(self.start, SitterHandler)
+        self.serve(self.start + 2, SitterHandler)
+        self.cache.set('localhost', self.start + 2)
+
+        data = self.machine_data()
+        data._find_portnum()
+        self.assertEqual(self.start + 2, data.portnum)
+
+        # Falls back to a scan once it's gone
+        self.cache.set('localhost', self.start + 1)
+        data._find_portnum()
+        self.assertEqual(self.start, data.portnum)
+        self.assertEqual(self.start, self.cache.get('localhost'))
+
+    def test_refound_only_for_machinesitter(self):
+        self.serve(self.start, SitterHandler)
+        data = self.machine_data()
+        data.lock = threading.Lock()
+        data._find_portnum()
+        found = []
+        data._find_portnum = lambda: found.append(True)
+
+        # A dead tasksitter
+        dead = "http://localhost:%s" % (self.start + 1)
+        self.assertEqual(None, data._make_request(machinedata.http_pool.get,
+                                                  "stats", host=dead))
+        self.assertEqual([], found)
+
+        data.url = dead
+        data._make_request(machinedata.http_pool.get, "stats")
+        self.assertEqual([True], found)
+
+    def test_not_found(self):
+        data = self.machine_data()
+        self.assertEqual(None, data._find_portnum())
+        self.assertEqual("", data.url)
+        self.assertEqual(None, data.portnum)
+
+
+class PortCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, "ports.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_saved_and_loaded(self):
+        cache = machinedata.PortCache()
+        cache.save_interval = 0
+        cache.load(self.filename)
+        cache.set('box', 40001)
+        for _ in range(100):
+            if os.path.exists(self.filename):
+                break
+            time.sleep(.01)
+
+        loaded = machinedata.PortCache()
+        loaded.load(self.filename)
+        self.assertEqual(40001, loaded.get('box'))
+        self.assertEqual(None, loaded.get('other'))
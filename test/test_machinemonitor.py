@@ -0,0 +1,56 @@
+import random
+import unittest
+
+try:
+    from clustersitter.machinemonitor import MachineMonitor
+except (ImportError, SyntaxError):
+    MachineMonitor = None
+
+
+class FakeClusterSitter(object):
+    stats_poll_interval = 5
+
+
+@unittest.skipIf(MachineMonitor is None, "clustersitter isn't importable")
+class ScheduleTests(unittest.TestCase):
+
+    def setUp(self):
+        random.seed(1)
+        self.monitor = MachineMonitor(FakeClusterSitter(), 0)
+        self.monitor.add_machine("box")
+
+    def test_backoff(self):
+        for failures, delay in [(1, 10), (2, 20), (3, 30), (10, 30)]:
+            for _ in range(20):
+                backoff = self.monitor.backoff(failures)
+                self.assertTrue(delay / 2.0 <= backoff <= delay)
+
+    def test_record_pull(self):
+        self.monitor.record_pull("box", True, started=100)
+        self.assertEqual(105, self.monitor.next_poll["box"])
+
+        self.monitor.record_pull("box", False, started=200)
+        self.assertEqual(1, self.monitor.pull_failures["box"])
+        self.assertTrue(205 <= self.monitor.next_poll["box"] <= 210)
+
+        # Back to normal, but soon checked again
+        self.monitor.record_pull("box", True, started=300)
+        self.assertEqual(0, self.monitor.pull_failures["box"])
+        self.assertEqual(301, self.monitor.next_poll["box"])
+        self.monitor.record_pull("box", True, started=400)
+        self.assertEqual(405, self.monitor.next_poll["box"])
+
+    def test_removed_during_poll(self):
+        self.monitor.remove_machine("box")
+        self.monitor.record_pull("box", False)
+        self.assertEqual({}, self.monitor.pull_failures)
+        self.assertEqual({}, self.monitor.get_schedule())
+
+    def test_spread(self):
+        machines = ["box%d" % i for i in range(100)]
+        self.monitor.spread(machines)
+        schedule = self.monitor.get_schedule()
+        delays = [schedule[machine] for machine in machines]
+        self.assertTrue(all(0 <= delay <= 5 for delay in delays))
+        # Not all at once
+        self.assertTrue(max(delays) - min(delays) > 2.5)
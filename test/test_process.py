@@ -0,0 +1,64 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from tasksitter import process
+
+
+class CPUUsageTests(unittest.TestCase):
+
+    def test_in_cores(self):
+        cpus = process.ONLINE_CPUS
+        last_system = [1000, 0, 500, 8000, 0, 0, 0, 0, 0, 0]
+        # A second passed (100 jiffies) on every cpu
+        system = [1000 + 50 * cpus, 0, 500 + 10 * cpus, 8000 + 40 * cpus,
+                  0, 0, 0, 0, 30, 0]
+        usage = process.cpu_usage_between([60, 0, 15, 0, 0, 0, 0],
+                                          [0, 0, 0, 0, 0, 0, 0],
+                                          system, last_system)
+        self.assertAlmostEqual(.75, usage)
+
+    def test_no_time_passed(self):
+        system = [1000, 0, 500, 8000, 0, 0, 0, 0]
+        self.assertEqual(0, process.cpu_usage_between(
+            [10, 0, 0], [0, 0, 0], system, system))
+
+
+class UsageFeedTests(unittest.TestCase):
+
+    def setUp(self):
+        self.feed_dir = tempfile.mkdtemp()
+        self.proc = process.Process(os.getpid(), usage_feed=self.feed_dir,
+                                    track_io=True)
+
+        def walk(deep=False):
+            raise AssertionError("Walked /proc")
+        self.proc.get_task_pids = walk
+
+    def tearDown(self):
+        self.proc.close()
+        shutil.rmtree(self.feed_dir)
+
+    def publish(self, read_bytes):
+        filename = os.path.join(self.feed_dir, "%d.usage" % os.getpid())
+        with open(filename, "w") as feed:
+            json.dump({'time': time.time(), 'interval': .1,
+                       'cpu_usage': .5, 'mem_usage': [2, 1],
+                       'system_usage': [],
+                       'io_usage': {'read_bytes': read_bytes,
+                                    'write_bytes': 0}}, feed)
+
+    def test_io_from_feed(self):
+        self.publish(1000)
+        self.assertTrue(self.proc.update_usage(deep=True))
+        self.proc.last_usage_update -= 1
+        self.proc.last_io_update -= 1
+        self.publish(3000)
+        self.assertTrue(self.proc.update_usage(deep=True))
+
+        self.assertEqual(.5, self.proc.cpu_usage)
+        self.assertAlmostEqual(2000, self.proc.io_rates['read_bytes'],
+                               delta=10)
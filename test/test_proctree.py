@@ -0,0 +1,65 @@
+import os
+import signal
+import time
+import unittest
+
+from tasksitter import proctree
+
+
+class ProcessTreeTests(unittest.TestCase):
+
+    def setUp(self):
+        self.pid = os.fork()
+        if self.pid == 0:
+            os.setpgrp()
+            os.execvp("/bin/bash", ["/bin/bash", "-c",
+                                    "sleep 5 & sleep 5 & wait"])
+
+        # Give bash time to fork its children
+        time.sleep(.2)
+
+    def tearDown(self):
+        try:
+            os.killpg(self.pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+        try:
+            os.waitpid(self.pid, 0)
+        except OSError:
+            # Already reaped
+            pass
+
+    def test_full_scan_finds_group(self):
+        tree = proctree.ProcessTree(self.pid)
+        stats = tree.refresh()
+        self.assertTrue(self.pid in stats)
+        self.assertEqual(3, len(stats))
+
+    def test_incremental_matches_full_scan(self):
+        tree = proctree.ProcessTree(self.pid)
+        full = tree.refresh()
+
+        tree.children_supported = False
+        self.assertEqual(set(full.keys()), set(tree.refresh().keys()))
+
+        if os.path.exists("/proc/%d/task/%d/children" % (self.pid,
+                                                         self.pid)):
+            tree.children_supported = True
+            self.assertEqual(set(full.keys()), set(tree.refresh().keys()))
+
+    def test_dead_members_are_dropped(self):
+        pid = os.fork()
+        if pid == 0:
+            os.setpgrp()
+            os.execvp("sleep", ["sleep", "5"])
+
+        time.sleep(.1)
+        tree = proctree.ProcessTree(pid)
+        self.assertEqual([pid], list(tree.refresh().keys()))
+        tree.children_supported = False
+
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+        self.assertEqual({}, tree.refresh())
+        self.assertEqual(set(), tree.members)
@@ -0,0 +1,76 @@
+import copy
+import unittest
+
+from sittercommon import statsdelta
+
+
+class VersionedStatsTests(unittest.TestCase):
+
+    def test_flatten(self):
+        data = {'machine': {'load': 1, 'empty': {}},
+                'tasks': {'a': {'cpu': .5, 'mem': [1, 2]}}}
+        flat = statsdelta.flatten(data)
+        self.assertEqual({('machine', 'load'): 1,
+                          ('machine', 'empty'): {},
+                          ('tasks', 'a', 'cpu'): .5,
+                          ('tasks', 'a', 'mem'): [1, 2]}, flat)
+        self.assertEqual(data, statsdelta.nest(flat))
+
+    def test_deltas(self):
+        stats = statsdelta.VersionedStats()
+        data = {'machine': {'load': 1, 'host': 'a'},
+                'tasks': {'a': {'cpu': .5}, 'b': {'cpu': .1}}}
+
+        first = stats.get_delta(data, 0)
+        self.assertTrue(first['full'])
+        self.assertEqual(data, first['changed'])
+
+        data = copy.deepcopy(data)
+        data['machine']['load'] = 2
+        del data['tasks']['b']
+        data['tasks']['c'] = {'cpu': .9}
+        delta = stats.get_delta(data, first['version'])
+        self.assertFalse(delta['full'])
+        self.assertEqual({'machine': {'load': 2},
+                          'tasks': {'c': {'cpu': .9}}}, delta['changed'])
+        self.assertEqual([['tasks', 'b', 'cpu']], delta['removed'])
+        self.assertEqual(first['version'] + 1, delta['version'])
+
+        # Nothing changed, nothing is sent and the version stays put
+        same = stats.get_delta(data, delta['version'])
+        self.assertEqual({}, same['changed'])
+        self.assertEqual(delta['version'], same['version'])
+
+        # An older poller gets everything since its version
+        older = stats.get_delta(data, first['version'])
+        self.assertEqual(delta['changed'], older['changed'])
+
+        cache = statsdelta.apply_delta({}, first)
+        cache = statsdelta.apply_delta(cache, delta)
+        self.assertEqual(data, statsdelta.apply_delta(cache, same))
+
+    def test_unknown_versions_get_everything(self):
+        stats = statsdelta.VersionedStats()
+        data = {'load': 1}
+        version = stats.update(data)
+        self.assertTrue(stats.get_delta(data, version + 100)['full'])
+        self.assertTrue(stats.get_delta(data, None)['full'])
+        self.assertFalse(stats.get_delta(data, version)['full'])
+
+    def test_emptied_dicts(self):
+        stats = statsdelta.VersionedStats()
+        data = {'tasks': {'a': {'cpu': 1}, 'b': {'cpu': 2}}}
+        first = stats.get_delta(data)
+        cache = statsdelta.apply_delta({}, first)
+
+        data = {'tasks': {'a': {}}}
+        cache = statsdelta.apply_delta(
+            cache, stats.get_delta(data, first['version']))
+        self.assertEqual(data, cache)
+
+    def test_forgotten_removals(self):
+        stats = statsdelta.VersionedStats()
+        stats.max_removed = 4
+        first = stats.get_delta(dict([(str(i), i) for i in range(10)]))
+        stats.update({})
+        self.assertTrue(stats.get_delta({}, first['version'])['full'])
@@ -0,0 +1,115 @@
+import http.server
+import threading
+import unittest
+import urllib.parse
+
+import simplejson
+
+from machinesitter import statspusher
+from sittercommon import statsdelta
+
+
+class FakeTask(object):
+    def __init__(self):
+        self.running = True
+
+    def is_running(self):
+        return self.running
+
+
+class FakeStats(object):
+    hostname = "box"
+    hostname_external = "box.example.com"
+
+    def update_hostname(self):
+        pass
+
+
+class FakeMonitor(object):
+    port = 40000
+
+
+class FakeManager(object):
+    def __init__(self):
+        self.tasks = {'task': FakeTask()}
+        self.stats = FakeStats()
+        self.http_monitor = FakeMonitor()
+        self.all_stats_versions = statsdelta.VersionedStats()
+        self.cpu = .5
+
+    def get_all_stats(self):
+        return {'machine': {'task-running': self.tasks['task'].running},
+                'tasks': {'task': {'cpu': self.cpu}}}
+
+
+class IngestHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        push = simplejson.loads(
+            urllib.parse.parse_qs(body.decode('utf-8'))['data'][0])
+        self.server.pushes.append(push)
+
+        answer = self.server.answers.pop(0).encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(answer)))
+        self.end_headers()
+        self.wfile.write(answer)
+
+    def log_message(self, *args):
+        pass
+
+
+class StatsPusherTests(unittest.TestCase):
+
+    def setUp(self):
+        self.server = http.server.ThreadingHTTPServer(('localhost', 0),
+                                                      IngestHandler)
+        self.server.pushes = []
+        self.server.answers = []
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+        self.manager = FakeManager()
+        self.pusher = statspusher.StatsPusher(
+            self.manager,
+            "http://localhost:%s/" % self.server.server_address[1],
+            heartbeat_interval=60)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def test_pushes_on_change(self):
+        self.server.answers = ["OK", "OK"]
+        self.assertTrue(self.pusher.tick())
+        first = self.server.pushes[0]
+        self.assertEqual(["box", "box.example.com"], first['hostnames'])
+        self.assertEqual(None, first['since'])
+        self.assertTrue(first['delta']['full'])
+
+        # Usage alone waits for the heartbeat
+        self.manager.cpu = .7
+        self.assertFalse(self.pusher.tick())
+
+        self.manager.tasks['task'].running = False
+        self.assertTrue(self.pusher.tick())
+        second = self.server.pushes[1]
+        self.assertEqual(first['delta']['version'], second['since'])
+        self.assertEqual({'machine': {'task-running': False},
+                          'tasks': {'task': {'cpu': .7}}},
+                         second['delta']['changed'])
+
+    def test_resync(self):
+        self.server.answers = ["OK", "Resync", "OK"]
+        self.pusher.tick()
+        self.manager.tasks['task'].running = False
+        self.pusher.tick()
+        self.assertEqual(None, self.pusher.since)
+
+        # Everything is pushed again without waiting for the heartbeat
+        self.assertTrue(self.pusher.tick())
+        self.assertTrue(self.server.pushes[2]['delta']['full'])
+        self.assertEqual(1, self.pusher.failures)